@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+  Author: DawsonLin
+  Email: lin_dongsen@126.com
+  Created: 2026-10-17
+  Purpose: run the agent daemon in foreground, the CLIs (agent_chat, llm_chat, ai_*) run in it without cold start.
+  Env:
+    @AGENT_DAEMON: the CLIs use the daemon only if it is 1;
+    @AGENT_DAEMON_SOCKET: the unix socket, see topsailai.daemon.client;
+  Example:
+    export AGENT_DAEMON=1
+    nohup agent_daemon > /tmp/agent_daemon.log 2>&1 &
+    agent_chat 'xxx'
+    agent_daemon --status
+'''
+
+import os
+import sys
+import argparse
+from dotenv import load_dotenv
+
+# Add project root to path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root + "/src")
+
+os.chdir(project_root)
+
+from topsailai.daemon import client
+
+
+def get_params():
+    ''' return dict for parameters '''
+    parser = argparse.ArgumentParser(
+        usage="",
+        description="the agent daemon, it keeps the modules warm for the CLIs"
+    )
+    parser.add_argument(
+        "-s", "--socket", required=False, dest="socket", type=str,
+        default=None,
+        help="the unix socket, default is env AGENT_DAEMON_SOCKET"
+    )
+    parser.add_argument(
+        "--status", required=False, dest="status", action="store_true",
+        default=False,
+        help="check if the daemon is running"
+    )
+    args = parser.parse_args()
+    return args
+
+def main():
+    load_dotenv()
+    args = get_params()
+    socket_path = args.socket or client.get_socket_path()
+
+    if args.status:
+        sock = client.connect(socket_path)
+        if sock is None:
+            print(f"agent daemon is not running: {socket_path}")
+            sys.exit(1)
+        sock.close()
+        print(f"agent daemon is running: {socket_path}")
+        return
+
+    from topsailai.daemon.server import AgentDaemon
+    AgentDaemon(
+        socket_path=socket_path,
+        cli_dir=os.path.join(project_root, "cli"),
+    ).serve_forever()
+    return
+
+if __name__ == "__main__":
+    main()
@@ -27,6 +27,10 @@ from datetime import datetime, timedelta
 project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 sys.path.insert(0, project_root + "/src")
 
+# a running agent daemon serves it without cold start
+from topsailai.daemon.client import exit_if_served_by_daemon
+exit_if_served_by_daemon(__file__)
+
 os.chdir(project_root)
 
 from topsailai.context.ctx_manager import get_session_manager
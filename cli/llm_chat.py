@@ -18,6 +18,10 @@ from dotenv import load_dotenv
 project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 sys.path.insert(0, project_root + "/src")
 
+# a running agent daemon serves it without cold start
+from topsailai.daemon.client import exit_if_served_by_daemon
+exit_if_served_by_daemon(__file__)
+
 os.chdir(project_root)
 
 from topsailai.logger import logger
@@ -91,7 +95,8 @@ def main():
     if not env_tool.is_debug_mode():
         print(f">>> message:\n{message}")
         print(">>> answer:")
-    answer = llm_model.chat(prompt_ctl.messages, for_raw=True, for_stream=True)
+    prompt_ctl.fit_context_window(llm_model.get_prompt_budget())
+    answer = llm_model.chat(prompt_ctl.get_messages_for_chat(), for_raw=True, for_stream=True)
     prompt_ctl.add_assistant_message(answer)
     print()
 
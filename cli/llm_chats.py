@@ -79,7 +79,8 @@ def main():
     while True:
         max_count -= 1
         print(">>> LLM Answer:")
-        answer = llm_model.chat(prompt_ctl.messages, for_raw=True, for_stream=True)
+        prompt_ctl.fit_context_window(llm_model.get_prompt_budget())
+        answer = llm_model.chat(prompt_ctl.get_messages_for_chat(), for_raw=True, for_stream=True)
         prompt_ctl.add_assistant_message(answer)
         print()
         if max_count == 0:
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+  Author: DawsonLin
+  Email: lin_dongsen@126.com
+  Created: 2026-10-17
+  Purpose: run an offline OpenAI-compatible stub server, it replays recorded responses.
+  Example:
+    llm_stub_server -r dump.AgentReAct.xxx.msg -p 18000 -l 0.5 -t 50
+    OPENAI_API_BASE=http://127.0.0.1:18000/v1 agent_chat 'xxx'
+'''
+
+import os
+import sys
+import time
+import argparse
+
+# Add project root to path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root + "/src")
+
+from topsailai.ai_base.llm_stub import (
+    StubLLMServer,
+    StubConfig,
+    load_recorded_responses,
+)
+
+
+def get_params():
+    ''' return dict for parameters '''
+    parser = argparse.ArgumentParser(
+        usage="",
+        description="offline OpenAI-compatible stub server"
+    )
+    parser.add_argument(
+        "-r", "--record", required=True, dest="record", type=str,
+        default=None,
+        help="a file of dump messages (FLAG_DUMP_MESSAGES=1)"
+    )
+    parser.add_argument(
+        "-H", "--host", required=False, dest="host", type=str,
+        default="127.0.0.1",
+    )
+    parser.add_argument(
+        "-p", "--port", required=False, dest="port", type=int,
+        default=18000,
+    )
+    parser.add_argument(
+        "-l", "--latency", required=False, dest="latency", type=float,
+        default=0.0,
+        help="seconds before the first byte"
+    )
+    parser.add_argument(
+        "-t", "--tokens_per_second", required=False, dest="tokens_per_second", type=float,
+        default=0.0,
+        help="0 for no limit"
+    )
+    parser.add_argument(
+        "--rate_limit_ratio", required=False, dest="rate_limit_ratio", type=float,
+        default=0.0,
+        help="chance of 429, 0.0 ~ 1.0"
+    )
+    parser.add_argument(
+        "--server_error_ratio", required=False, dest="server_error_ratio", type=float,
+        default=0.0,
+        help="chance of 500, 0.0 ~ 1.0"
+    )
+    args = parser.parse_args()
+    return args
+
+def main():
+    args = get_params()
+    server = StubLLMServer(
+        load_recorded_responses(args.record),
+        StubConfig(
+            latency=args.latency,
+            tokens_per_second=args.tokens_per_second,
+            rate_limit_ratio=args.rate_limit_ratio,
+            server_error_ratio=args.server_error_ratio,
+        ),
+        host=args.host,
+        port=args.port,
+    )
+    server.start()
+    print(f"OPENAI_API_BASE={server.base_url}")
+    try:
+        while True:
+            time.sleep(60)
+            print(f"[stat] {server.stat.to_dict()}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+
+if __name__ == "__main__":
+    main()
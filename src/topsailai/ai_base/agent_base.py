@@ -1,11 +1,20 @@
+import copy
+import asyncio
+import functools
+import simplejson
+from concurrent.futures import ThreadPoolExecutor
+
 from topsailai.logger.log_chat import logger
 from topsailai.utils.print_tool import (
     print_error,
     print_step,
 )
+from topsailai.utils.thread_tool import run_with_barriers
 from topsailai.utils.thread_local_tool import (
     ctxm_give_agent_name,
     ctxm_set_agent,
+    get_thread_vars,
+    ctxm_set_thread_vars,
 )
 from topsailai.utils import (
     json_tool,
@@ -17,13 +26,20 @@ from topsailai.ai_base.prompt_base import (
 )
 from topsailai.ai_base.llm_base import (
     LLMModel,
+    AsyncLLMModel,
+)
+from topsailai.ai_base.llm_cascade import (
+    CascadePolicy,
+    ModelCascade,
 )
+from topsailai.ai_base.stream_parser import StepStreamParser
 from topsailai.prompt_hub import prompt_tool
 
 from topsailai.tools import (
     get_tool_prompt,
     TOOLS as INTERNAL_TOOLS,
     get_tools_for_chat,
+    is_tool_parallel,
 )
 
 
@@ -39,6 +55,19 @@ class StepCallBase(object):
     CODE_STEP_FINAL = 1
     CODE_TASK_FAILED = -1
 
+    # the steps can be executed before the stream ends, see StepDispatcher
+    early_step_names = ()
+
+    # the response is complete after one of these steps, the stream is aborted there
+    stop_step_names = ()
+
+    # the steps of tool calls, the consecutive ones of a response run as a batch, see ToolCallBatch;
+    # in text mode, only if the step is not one of stop_step_names, as the stream stops after it
+    tool_step_names = ()
+
+    # CascadePolicy of this type of steps, it overrides the one of agent, see ModelCascade
+    cascade_policy = None
+
     def __init__(self, flag_interactive:bool=False):
 
         # for result
@@ -46,6 +75,8 @@ class StepCallBase(object):
         self.user_msg = None
         self.tool_msg = None
         self.result = None
+        # True if the tool call is failed, e.g. no found the tool
+        self.tool_error = False
 
         # flags
         self.flag_interactive = True if flag_interactive else False
@@ -128,6 +159,155 @@ class StepCallBase(object):
         """ override this method """
         raise NotImplementedError("Subclasses must implement this method")
 
+def get_tool_call_key(tool_call_info:ToolCallInfo) -> str:
+    """ return a string to compare tool calls """
+    return simplejson.dumps(
+        [tool_call_info.func_name, tool_call_info.func_args],
+        sort_keys=True, ensure_ascii=False, default=str,
+    )
+
+
+class StepDispatcher(object):
+    """ execute the early steps (e.g. action) of a streaming response in background.
+
+    The step is dispatched as soon as StepStreamParser closes it,
+    its result is reused if the final response has the same tool call.
+    Only the first action of a response is dispatched, because the step loop stops there.
+    """
+    def __init__(self, step_call:StepCallBase, tools:dict):
+        self.step_call = step_call
+        self.tools = tools
+
+        # key is tool call key, value is Future of StepCallBase
+        self.futures = {}
+
+        # the steps of the current response
+        self.steps = []
+
+        self.executor = None
+
+        # stat
+        self.dispatched_count = 0
+        self.reused_count = 0
+        self.wasted_count = 0
+
+    def get_key(self, step:dict, rsp_msg_obj=None) -> str|None:
+        """ return the tool call key of step, None if it is not an early step """
+        if step.get("step_name") not in self.step_call.early_step_names:
+            return None
+        tool_call_info = self.step_call.get_tool_call_info(step, rsp_msg_obj)
+        if tool_call_info is None:
+            return None
+        return get_tool_call_key(tool_call_info)
+
+    def _execute(self, thread_vars:dict, step_call:StepCallBase, step:dict, response:list, index:int):
+        with ctxm_set_thread_vars(thread_vars):
+            return step_call(step, tools=self.tools, response=response, index=index, rsp_msg_obj=None)
+
+    def on_step(self, index:int, step:dict):
+        """ callback of StepStreamParser """
+        if index == 0:
+            # a new response, or a retry
+            self.steps = []
+        previous_steps = list(self.steps)
+        self.steps.append(step)
+
+        for previous_step in previous_steps:
+            step_name = previous_step.get("step_name") or ""
+            if step_name in self.step_call.early_step_names or step_name.startswith("final"):
+                return
+
+        key = self.get_key(step)
+        if key is None or key in self.futures:
+            return
+
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="StepDispatcher")
+        self.futures[key] = self.executor.submit(
+            self._execute,
+            get_thread_vars(),
+            copy.copy(self.step_call),
+            step,
+            previous_steps + [step],
+            index,
+        )
+        self.dispatched_count += 1
+        logger.info(f"step is dispatched early: [{index}] {key}")
+        return
+
+    def pop_result(self, step:dict, rsp_msg_obj=None) -> StepCallBase|None:
+        """ return the result of the dispatched step, None if no found """
+        key = self.get_key(step, rsp_msg_obj)
+        if key is None:
+            return None
+        future = self.futures.pop(key, None)
+        if future is None:
+            return None
+        self.reused_count += 1
+        return future.result()
+
+    def discard(self):
+        """ the unused steps are dropped, e.g. the final response has a different tool call """
+        for key, future in self.futures.items():
+            if future.cancel():
+                continue
+            self.wasted_count += 1
+            logger.warning(f"the early step is not used: {key}")
+        self.futures = {}
+        self.steps = []
+        return
+
+    def close(self):
+        """ wait for the running steps """
+        self.discard()
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+        logger.info(
+            "step dispatcher: dispatched=%s, reused=%s, wasted=%s",
+            self.dispatched_count, self.reused_count, self.wasted_count,
+        )
+        return
+
+
+class ToolCallBatch(object):
+    """ run the tool calls of one response, the parallel ones (TOOLS_META) run concurrently.
+
+    A tool which is not parallel is a barrier, it runs alone and in order.
+    """
+    def __init__(self, step_call:StepCallBase, tools:dict, max_workers:int=None):
+        self.step_call = step_call
+        self.tools = tools
+        self.max_workers = max_workers or env_tool.get_tool_parallel_workers()
+
+    def is_parallel(self, step:dict) -> bool:
+        tool_call_info = self.step_call.get_tool_call_info(step, None)
+        if tool_call_info is None:
+            return False
+        return is_tool_parallel(tool_call_info.func_name)
+
+    def _execute(self, step:dict, response:list, index:int):
+        return copy.copy(self.step_call)(step, tools=self.tools, response=response, index=index, rsp_msg_obj=None)
+
+    def run(self, steps:list, response:list, index:int, dispatcher:"StepDispatcher"=None) -> list[StepCallBase]:
+        """ return the results of steps, in order """
+        results = [None] * len(steps)
+        positions = []
+        tasks = []
+        for i, step in enumerate(steps):
+            if dispatcher is not None:
+                results[i] = dispatcher.pop_result(step)
+                if results[i] is not None:
+                    continue
+            positions.append(i)
+            tasks.append((functools.partial(self._execute, step, response, index), self.is_parallel(step)))
+
+        rets = run_with_barriers(tasks, max_workers=self.max_workers, thread_name_prefix="ToolCallBatch")
+        for i, ret in zip(positions, rets):
+            results[i] = ret
+        return results
+
+
 class AgentBase(PromptBase):
     """ AI-Agent base class """
     def __init__(
@@ -149,6 +329,13 @@ class AgentBase(PromptBase):
         assert self.system_prompt, "system_prompt is required"
 
         self.llm_model = LLMModel()
+        # AsyncLLMModel for arun, it is created on the first arun
+        self.async_llm_model = None
+
+        # CascadePolicy, None for env LLM_CASCADE_MODEL
+        self.cascade_policy = None
+        # ModelCascade of the last run
+        self.cascade = None
 
         ######################################################################
         # tool_kits, internal tools
@@ -203,7 +390,10 @@ class AgentBase(PromptBase):
         if self.tool_prompt:
             print_step(f"[tool_prompt]:\n{self.tool_prompt}\n", need_format=False)
 
-        super(AgentBase, self).__init__(self.system_prompt, self.tool_prompt)
+        super(AgentBase, self).__init__(
+            self.system_prompt, self.tool_prompt,
+            model_name=self.llm_model.model_name,
+        )
         return
 
     @property
@@ -239,10 +429,50 @@ class AgentBase(PromptBase):
     def _run(self, step_call:StepCallBase, user_input:str):
         raise NotImplementedError("Subclasses must implement this method")
 
+    async def arun(self, step_call:StepCallBase, user_input:str):
+        """ the coroutine of run, many agents can run concurrently on one event loop.
+
+        The agent name, agent object and depth are context-local (see thread_local_tool),
+        so each asyncio task has its own. The LLM calls are awaited,
+        the steps of tool calls run in the default executor of the loop.
+        The step_call must not be shared by the agents running at the same time.
+        """
+        with (
+                ctxm_give_agent_name(self.agent_name),
+                ctxm_set_agent(self),
+            ):
+            try:
+                return await self._arun(step_call, user_input)
+            finally:
+                if self.flag_dump_messages:
+                    self.dump_messages()
+
+    async def _arun(self, step_call:StepCallBase, user_input:str):
+        raise NotImplementedError("Subclasses must implement this method")
+
+    def get_async_llm_model(self) -> AsyncLLMModel:
+        """ the async model shares the settings of self.llm_model """
+        if self.async_llm_model is None:
+            llm_model = AsyncLLMModel(model_name=self.llm_model.model_name)
+            for name in (
+                    "max_tokens", "temperature", "top_p", "frequency_penalty",
+                    "content_senders", "retry_policy",
+                ):
+                setattr(llm_model, name, getattr(self.llm_model, name))
+            self.async_llm_model = llm_model
+        return self.async_llm_model
+
+    def new_cascade(self, step_call:StepCallBase, llm_model:LLMModel=None) -> ModelCascade|None:
+        """ return ModelCascade if a policy is set by the steps, the agent or env """
+        policy = step_call.cascade_policy or self.cascade_policy or CascadePolicy.from_env()
+        if policy is None:
+            return None
+        return ModelCascade(policy, llm_model or self.llm_model)
+
 class AgentRun(AgentBase):
     """ a common of running steps """
-    def _run(self, step_call:StepCallBase, user_input:str):
-        """ return final answer, or None if error """
+    def _prepare_run(self, step_call:StepCallBase, user_input:str) -> tuple:
+        """ start the session, return tuple (all_tools, tools_for_chat, dispatcher) """
         # tools
         all_tools = self.available_tools
         print_step(f"[available_tools] [{len(all_tools)}] {list(all_tools.keys())}", need_format=False)
@@ -253,44 +483,289 @@ class AgentRun(AgentBase):
         if tools_for_chat:
             print_step(f"[effective_tools] [{len(tools_for_chat)}] {list(tools_for_chat.keys())}", need_format=False)
 
+        # streaming mode, the tool calls of 'tools' are not in the content
+        dispatcher = None
+        if env_tool.is_agent_stream() and not tools_for_chat and step_call.early_step_names:
+            dispatcher = StepDispatcher(step_call, all_tools)
+
         # new session
         if user_input:
             self.new_session({"step_name":"task","raw_text":user_input})
 
-        while True:
-            rsp_obj, response = self.llm_model.chat(
-                self.messages, for_response=True,
-                tools=list(tools_for_chat.values()),
+        return (all_tools, tools_for_chat, dispatcher)
+
+    def _run(self, step_call:StepCallBase, user_input:str):
+        """ return final answer, or None if error """
+        all_tools, tools_for_chat, dispatcher = self._prepare_run(step_call, user_input)
+        self.cascade = self.new_cascade(step_call)
+
+        try:
+            return self._run_steps(step_call, all_tools, tools_for_chat, dispatcher)
+        finally:
+            if self.cascade is not None:
+                logger.info(f"cascade: {self.cascade.get_stats()}")
+            if dispatcher is not None:
+                dispatcher.close()
+
+    async def _arun(self, step_call:StepCallBase, user_input:str):
+        """ the coroutine of _run """
+        all_tools, tools_for_chat, dispatcher = self._prepare_run(step_call, user_input)
+        self.cascade = self.new_cascade(step_call, self.get_async_llm_model())
+
+        try:
+            return await self._arun_steps(step_call, all_tools, tools_for_chat, dispatcher)
+        finally:
+            if self.cascade is not None:
+                logger.info(f"cascade: {self.cascade.get_stats()}")
+            if dispatcher is not None:
+                await asyncio.to_thread(dispatcher.close)
+
+    def _chat(self, llm_model:LLMModel, step_call:StepCallBase, tools_for_chat:dict, dispatcher:StepDispatcher=None):
+        """ return tuple (rsp_obj, response:list, rsp_msg) of one turn """
+        # compact the context before sending, not after a BadRequestError of provider
+        self.fit_context_window(llm_model.get_prompt_budget())
+
+        if dispatcher is not None:
+            dispatcher.discard()
+            rsp_obj, response = llm_model.chat(
+                self.get_messages_for_chat(), for_response=True, for_stream=True,
+                step_parser=StepStreamParser(
+                    on_step=dispatcher.on_step,
+                    stop_step_names=step_call.stop_step_names,
+                ),
             )
+            # the stream has no message object
+            return (rsp_obj, response, None)
+
+        rsp_obj, response = llm_model.chat(
+            self.get_messages_for_chat(), for_response=True,
+            tools=list(tools_for_chat.values()),
+        )
+        return (rsp_obj, response, llm_model.get_response_message(rsp_obj))
+
+    async def _achat(self, llm_model:AsyncLLMModel, step_call:StepCallBase, tools_for_chat:dict, dispatcher:StepDispatcher=None):
+        """ the coroutine of _chat """
+        # the archiving hooks may be blocking
+        await asyncio.to_thread(self.fit_context_window, llm_model.get_prompt_budget())
+
+        if dispatcher is not None:
+            dispatcher.discard()
+            rsp_obj, response = await llm_model.chat(
+                self.get_messages_for_chat(), for_response=True, for_stream=True,
+                step_parser=StepStreamParser(
+                    on_step=dispatcher.on_step,
+                    stop_step_names=step_call.stop_step_names,
+                ),
+            )
+            return (rsp_obj, response, None)
+
+        rsp_obj, response = await llm_model.chat(
+            self.get_messages_for_chat(), for_response=True,
+            tools=list(tools_for_chat.values()),
+        )
+        return (rsp_obj, response, llm_model.get_response_message(rsp_obj))
+
+    def get_tool_call_steps(self, step_call:StepCallBase, response:list, index:int, rsp_msg=None) -> list[tuple]:
+        """ return list of (tool_call_id, step), all of the tool calls from the step at index.
+
+        'tools' mode: one step for each of rsp_msg.tool_calls;
+        text mode: the consecutive tool steps of response, only the first one if it is a stop step,
+            so the result is the same with streaming, which stops there.
+        """
+        step_name = response[index].get("step_name")
+        if step_name not in step_call.tool_step_names:
+            return []
+        if rsp_msg is not None and rsp_msg.tool_calls:
+            result = []
+            for tool_call in rsp_msg.tool_calls:
+                step = {
+                    "step_name": step_name,
+                    "tool_call": tool_call.function.name,
+                    "tool_args": json_tool.json_load(tool_call.function.arguments) if tool_call.function.arguments else {},
+                }
+                result.append((tool_call.id, step))
+            return result
+        if step_name in step_call.stop_step_names:
+            return [(None, response[index])]
+        result = []
+        for step in response[index:]:
+            if step.get("step_name") != step_name:
+                break
+            result.append((None, step))
+        return result
+
+    def _run_tool_calls(self, step_call:StepCallBase, all_tools:dict, tool_call_steps:list,
+                        response:list, index:int, dispatcher:StepDispatcher=None) -> list[StepCallBase]:
+        """ run a batch of tool calls, one tool message for each tool_call_id """
+        steps = [step for _, step in tool_call_steps]
+        logger.info(f"running {len(steps)} tool calls in a batch")
+        results = ToolCallBatch(step_call, all_tools).run(steps, response, index, dispatcher=dispatcher)
+
+        # the tool messages must follow the assistant message
+        for (tool_call_id, _), ret in zip(tool_call_steps, results):
+            self.add_tool_message(ret.tool_msg, tool_call_id=tool_call_id)
+        for ret in results:
+            self.add_user_message(ret.user_msg)
+        return results
+
+    def _apply_batch_results(self, step_call:StepCallBase, tool_call_steps:list, results:list) -> StepCallBase:
+        """ feedback the cascade by the results of a batch, return the result which ends the turn:
+        the first one of task final or task failed, or else the last one.
+        """
+        if self.cascade is not None:
+            for (_, tool_step), ret in zip(tool_call_steps, results):
+                tool_call_info = step_call.get_tool_call_info(tool_step, None)
+                self.cascade.on_step(
+                    get_tool_call_key(tool_call_info) if tool_call_info else None,
+                    tool_error=ret.tool_error,
+                )
+        for ret in results:
+            if ret.code == ret.CODE_TASK_FINAL:
+                logger.info(f"final: {ret.result}")
+                return ret
+            if ret.code == ret.CODE_TASK_FAILED:
+                print_error(f"Task failed: {ret.result}")
+                return ret
+        return results[-1]
+
+    def _call_step(self, step_call:StepCallBase, all_tools:dict, step:dict, response:list, index:int,
+                   rsp_msg=None, dispatcher:StepDispatcher=None) -> StepCallBase:
+        """ return the result of a step, it is reused if the step is dispatched early """
+        ret = None
+        if dispatcher is not None:
+            ret = dispatcher.pop_result(step, rsp_msg)
+        if ret is None:
+            ret = step_call(step, tools=all_tools, response=response, index=index, rsp_msg_obj=rsp_msg)
+        assert isinstance(ret, StepCallBase), "step_call must return StepCallBase instance"
+        return ret
+
+    def _apply_step_result(self, step_call:StepCallBase, step:dict, rsp_msg, ret:StepCallBase) -> int:
+        """ feedback the cascade and the context by the result of a step, return ret.code """
+        if self.cascade is not None:
+            tool_call_info = step_call.get_tool_call_info(step, rsp_msg)
+            self.cascade.on_step(
+                get_tool_call_key(tool_call_info) if tool_call_info else None,
+                tool_error=ret.tool_error,
+            )
+        if ret.code == ret.CODE_TASK_FINAL:
+            logger.info(f"final: {ret.result}")
+        elif ret.code == ret.CODE_TASK_FAILED:
+            print_error(f"Task failed: {ret.result}")
+        elif ret.code == ret.CODE_STEP_FINAL:
+            self.add_user_message(ret.user_msg)
+            self.add_tool_message(ret.tool_msg)
+        return ret.code
+
+    def _end_turn(self, ctx_count:int) -> bool:
+        """ a turn is done, return False if no progress is made """
+        if self.cascade is not None:
+            self.cascade.end_turn()
+
+        if len(self.messages) == ctx_count:
+            print_error("No progress made in this iteration, exiting.")
+            return False
+
+        # update env
+        self.update_message_for_env()
+        return True
+
+    def _run_steps(self, step_call:StepCallBase, all_tools:dict, tools_for_chat:dict, dispatcher:StepDispatcher=None):
+        """ the loop of chat and steps """
+        cascade = self.cascade
+        while True:
+            if cascade is None:
+                rsp_obj, response, rsp_msg = self._chat(self.llm_model, step_call, tools_for_chat, dispatcher)
+            else:
+                rsp_obj, response, rsp_msg = cascade.call(
+                    # no early dispatch on the small model, the side effects of tools are not undone on escalation
+                    lambda llm_model: self._chat(
+                        llm_model, step_call, tools_for_chat, dispatcher if cascade.is_final(llm_model) else None,
+                    )
+                )
             if not response:
                 print_error("No response from LLM.")
                 return None
-            rsp_msg = self.llm_model.get_response_message(rsp_obj)
-            self.add_assistant_message(response, tool_calls=rsp_msg.tool_calls)
+            self.add_assistant_message(response, tool_calls=rsp_msg.tool_calls if rsp_msg else None)
 
             ctx_count = len(self.messages)
 
             for i, step in enumerate(response):
-                ret = step_call(step, tools=all_tools, response=response, index=i, rsp_msg_obj=rsp_msg)
-                assert isinstance(ret, StepCallBase), "step_call must return StepCallBase instance"
-                if ret.code == ret.CODE_TASK_FINAL:
-                    logger.info(f"final: {ret.result}")
+                tool_call_steps = self.get_tool_call_steps(step_call, response, i, rsp_msg)
+                if len(tool_call_steps) > 1:
+                    results = self._run_tool_calls(step_call, all_tools, tool_call_steps, response, i, dispatcher)
+                    ret = self._apply_batch_results(step_call, tool_call_steps, results)
+                    if ret.code == ret.CODE_TASK_FINAL:
+                        return ret.result
+                    elif ret.code == ret.CODE_TASK_FAILED:
+                        return None
+                    break
+
+                ret = self._call_step(step_call, all_tools, step, response, i, rsp_msg, dispatcher)
+                code = self._apply_step_result(step_call, step, rsp_msg, ret)
+                if code == ret.CODE_TASK_FINAL:
                     return ret.result
-                elif ret.code == ret.CODE_TASK_FAILED:
-                    print_error(f"Task failed: {ret.result}")
+                elif code == ret.CODE_TASK_FAILED:
                     return None
-                elif ret.code == ret.CODE_STEP_FINAL:
-                    self.add_user_message(ret.user_msg)
-                    self.add_tool_message(ret.tool_msg)
+                elif code == ret.CODE_STEP_FINAL:
                     break
 
             # end for step in response
 
-            if len(self.messages) == ctx_count:
-                print_error("No progress made in this iteration, exiting.")
+            if not self._end_turn(ctx_count):
                 return None
 
-            # update env
-            self.update_message_for_env()
-
         # raise RuntimeError("Unreachable code reached")
+
+    async def _arun_steps(self, step_call:StepCallBase, all_tools:dict, tools_for_chat:dict, dispatcher:StepDispatcher=None):
+        """ the coroutine of _run_steps, the steps of tool calls run in the default executor """
+        cascade = self.cascade
+        llm_model = self.get_async_llm_model()
+        while True:
+            if cascade is None:
+                rsp_obj, response, rsp_msg = await self._achat(llm_model, step_call, tools_for_chat, dispatcher)
+            else:
+                rsp_obj, response, rsp_msg = await cascade.acall(
+                    # no early dispatch on the small model, the side effects of tools are not undone on escalation
+                    lambda llm_model: self._achat(
+                        llm_model, step_call, tools_for_chat, dispatcher if cascade.is_final(llm_model) else None,
+                    )
+                )
+            if not response:
+                print_error("No response from LLM.")
+                return None
+            self.add_assistant_message(response, tool_calls=rsp_msg.tool_calls if rsp_msg else None)
+
+            ctx_count = len(self.messages)
+
+            for i, step in enumerate(response):
+                tool_call_steps = self.get_tool_call_steps(step_call, response, i, rsp_msg)
+                if len(tool_call_steps) > 1:
+                    results = await asyncio.to_thread(
+                        self._run_tool_calls, step_call, all_tools, tool_call_steps, response, i, dispatcher,
+                    )
+                    ret = self._apply_batch_results(step_call, tool_call_steps, results)
+                    if ret.code == ret.CODE_TASK_FINAL:
+                        return ret.result
+                    elif ret.code == ret.CODE_TASK_FAILED:
+                        return None
+                    break
+
+                if step_call.get_tool_call_info(step, rsp_msg) is None:
+                    # e.g. thought or final answer, it may ask user in the main thread
+                    ret = self._call_step(step_call, all_tools, step, response, i, rsp_msg, dispatcher)
+                else:
+                    ret = await asyncio.to_thread(
+                        self._call_step, step_call, all_tools, step, response, i, rsp_msg, dispatcher,
+                    )
+                code = self._apply_step_result(step_call, step, rsp_msg, ret)
+                if code == ret.CODE_TASK_FINAL:
+                    return ret.result
+                elif code == ret.CODE_TASK_FAILED:
+                    return None
+                elif code == ret.CODE_STEP_FINAL:
+                    break
+
+            # end for step in response
+
+            if not self._end_turn(ctx_count):
+                return None
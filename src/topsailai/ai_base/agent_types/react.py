@@ -14,6 +14,8 @@ from topsailai.utils import (
     env_tool,
 )
 from topsailai.prompt_hub.prompt_tool import PromptHubExtractor
+from topsailai.tools import TOOLS_META
+from topsailai.ai_base.tool_runner import ToolRunnerInstance
 from topsailai.ai_base.agent_base import (
     StepCallBase,
 )
@@ -30,6 +32,10 @@ AGENT_NAME = "AgentReAct"
 class Step4ReAct(StepCallBase):
     """ running on ReAct mode """
 
+    early_step_names = ("action",)
+    stop_step_names = ("action", "final_answer")
+    tool_step_names = ("action",)
+
     def _execute(self, step:dict, tools:dict, response:list, index:int, rsp_msg_obj=None, **_):
         """ acting steps """
         try:
@@ -48,6 +54,7 @@ class Step4ReAct(StepCallBase):
                     "raw_text": "missing tool_call"
                 }
                 self.tool_msg = obs_json
+                self.tool_error = True
                 self.code = self.CODE_STEP_FINAL
                 return
 
@@ -62,13 +69,16 @@ class Step4ReAct(StepCallBase):
                     "raw_text": f"no found such as tool: {tool}"
                 }
                 self.tool_msg = obs_json
+                self.tool_error = True
                 self.code = self.CODE_STEP_FINAL
                 return
             else:
                 try:
-                    obs = tool_func(**args)
+                    # with timeout, and memoized in the session if the tool is cacheable
+                    obs = ToolRunnerInstance.call(tool, tool_func, args, TOOLS_META.get(tool))
                 except Exception as e:
                     obs = str(e)
+                    self.tool_error = True
                     logger.exception(e)
                 obs_json = {
                     "step_name": "observation",
@@ -1,8 +1,12 @@
 import os
-import sys
 import copy
+import sys
 import time
-import random
+import asyncio
+import threading
+from contextlib import nullcontext
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import simplejson
 import openai
 from openai.types.chat import ChatCompletionMessage
@@ -17,12 +21,62 @@ from topsailai.utils import (
     env_tool,
     format_tool,
 )
-from topsailai.context.token import TokenStat
+from topsailai.utils.thread_local_tool import (
+    get_session_id,
+    get_agent_name,
+    get_agent_object,
+    get_thread_vars,
+    ctxm_set_thread_vars,
+)
+from topsailai.context.token import (
+    TokenStat,
+    get_context_window,
+    count_tokens_for_model,
+    parse_usage,
+)
+from topsailai.ai_base.llm_client import get_chat_client
+from topsailai.ai_base.llm_router import RouterInstance, EndpointLimiter, get_endpoint_key
+from topsailai.ai_base.llm_cache import get_response_cache
+from topsailai.ai_base.llm_hedge import HedgerInstance
+from topsailai.ai_base.llm_structured import (
+    LEVEL_NONE,
+    LEVEL_JSON_OBJECT,
+    PARSE_NULL,
+    PARSE_INVALID_JSON,
+    ParseStatInstance,
+    StructuredOutputRegistryInstance,
+    get_response_format,
+    get_structured_mode,
+    is_unsupported_error,
+    unwrap_steps,
+)
+from topsailai.ai_base.llm_retry import (
+    ERROR_EMPTY,
+    ERROR_JSON,
+    ERROR_SERVER,
+    RetryPolicy,
+    get_chat_deadline,
+)
+
+
+# the model must not write these steps, they come from the user, e.g. a hallucinated observation
+STOP_STEP_NAMES = ("observation",)
+
+# the models which reject the parameter 'stop' with 400, key is the prefix of model name (lower case)
+NO_STOP_MODEL_PREFIXES = ("o1", "o3", "o4", "gpt-5")
+
+# the messages of BadRequestError when the parameter 'stop' is not supported
+STOP_UNSUPPORTED_KEYWORDS = ("'stop'", '"stop"', "stop sequence")
 
 
 class JsonError(Exception):
     """ invalid json string """
-    pass
+    retry_class = "json"
+
+    def __init__(self, message:str, reason:str=PARSE_INVALID_JSON):
+        super().__init__(message)
+        # PARSE_NULL or PARSE_INVALID_JSON
+        self.reason = reason
 
 
 def _to_list(obj):
@@ -39,40 +93,91 @@ def _format_content(content):
     """ format content to json string if it is list/dict """
     return to_json_str(content)
 
-def _format_messages(messages, key_name, value_name):
-    """ format messages to specific format """
+class FormattedContentCache(object):
+    """ LRU of formatted contents, so only new or modified messages are formatted.
+
+    The key is the content itself, str caches its hash, so a hit costs no parsing.
+    """
+    def __init__(self, max_count:int=4096):
+        self.max_count = max_count
+        self.lock = threading.Lock()
+        self.contents = OrderedDict()
+        self.hit_count = 0
+        self.miss_count = 0
+
+    def get(self, content:str, func_format, key_name:str, value_name:str) -> str:
+        """ return the formatted content """
+        key = (func_format, key_name, value_name, content)
+        with self.lock:
+            new_content = self.contents.get(key)
+            if new_content is not None:
+                self.contents.move_to_end(key)
+                self.hit_count += 1
+                return new_content
+            self.miss_count += 1
+
+        new_content = func_format(
+            content,
+            key_name=key_name,
+            value_name=value_name,
+        )
+        new_content = new_content.strip() if new_content else content
+
+        with self.lock:
+            self.contents[key] = new_content
+            while len(self.contents) > self.max_count:
+                self.contents.popitem(last=False)
+        return new_content
+
+    def clear(self):
+        with self.lock:
+            self.contents.clear()
+            self.hit_count = 0
+            self.miss_count = 0
+
+
+# init
+FormattedContentCacheInstance = FormattedContentCache()
+
+
+def _format_messages(messages, key_name, value_name) -> list:
+    """ return a new list of messages in specific format, the input is not changed """
     func_format = None # func(content, key_name, value_name)
 
     if format_tool.TOPSAILAI_FORMAT_PREFIX in messages[0]["content"]:
         func_format = format_tool.to_topsailai_format
 
+    # shallow copy, the values are not changed
+    new_messages = [dict(msg) for msg in messages]
     if func_format is None:
-        return messages
-
-    for msg in messages[2:]:
-        if msg["content"][0] in ["[", "{"]:
-            new_content = func_format(
-                msg["content"],
-                key_name=key_name,
-                value_name=value_name,
+        return new_messages
+
+    for msg in new_messages[2:]:
+        content = msg["content"]
+        if isinstance(content, str) and content[:1] in ["[", "{"]:
+            msg["content"] = FormattedContentCacheInstance.get(
+                content, func_format, key_name, value_name,
             )
-            if new_content:
-                msg["content"] = new_content.strip()
 
     #logger.info(simplejson.dumps(messages, indent=2, default=str))
 
-    return messages
+    return new_messages
+
+def _format_response(response, structured=False):
+    """ format response to list if it is json string
 
-def _format_response(response):
-    """ format response to list if it is json string """
+    :structured: the response is asked by response_format, the steps are unwrapped from {"steps": [...]}.
+    """
     if isinstance(response, (list, dict)):
-        return _to_list(response)
+        return _to_list(unwrap_steps(response) if structured else response)
 
     if isinstance(response, str):
         response = response.strip()
         if not response:
-            raise JsonError("null of response")
+            ParseStatInstance.add_failure(PARSE_NULL)
+            raise JsonError("null of response", reason=PARSE_NULL)
 
+    raw_response = response
     for count in range(3):
         try:
             if response.startswith(format_tool.TOPSAILAI_FORMAT_PREFIX) or \
@@ -87,13 +192,172 @@ def _format_response(response):
                     )
 
             response = to_json_str(response)
-            return _to_list(simplejson.loads(response))
+            result = simplejson.loads(response)
+            result = _to_list(unwrap_steps(result) if structured else result)
+            ParseStatInstance.add_parsed(repaired=(count > 0 or response != raw_response))
+            return result
         except Exception as e:
             print_error(f"parsing response: {e}\n>>>\n{response}\n<<<\nretrying times: {count}")
 
+    ParseStatInstance.add_failure(PARSE_INVALID_JSON)
     raise JsonError("invalid json string")
 
 
+def is_early_stop() -> bool:
+    """ LLM_EARLY_STOP, default is enabled """
+    return os.getenv("LLM_EARLY_STOP", "1") != "0"
+
+def is_stream_usage() -> bool:
+    """ LLM_STREAM_USAGE, default is enabled, ask the usage at the end of stream """
+    return os.getenv("LLM_STREAM_USAGE", "1") != "0"
+
+def is_stop_supported(model_name:str=None) -> bool:
+    """ False for the models which reject the parameter 'stop', e.g. o1, o3 and gpt-5 """
+    # e.g. "openai/o3-mini"
+    name = (model_name or "").lower().rsplit("/", 1)[-1]
+    return not name.startswith(NO_STOP_MODEL_PREFIXES)
+
+def is_stop_rejected(e:Exception) -> bool:
+    """ True if the endpoint rejects the parameter 'stop' """
+    if not isinstance(e, openai.BadRequestError):
+        return False
+    message = str(e).lower()
+    for keyword in STOP_UNSUPPORTED_KEYWORDS:
+        if keyword in message:
+            return True
+    return False
+
+def drop_stop(params:dict) -> dict:
+    """ return params without the parameter 'stop' """
+    return {k: v for k, v in params.items() if k != "stop"}
+
+def get_stop_sequences(messages, model_name:str=None) -> list[str]|None:
+    """ return stop sequences by the format of system prompt, None for no stop """
+    if not messages or not is_early_stop() or not is_stop_supported(model_name):
+        return None
+    content = messages[0].get("content")
+    if isinstance(content, str) and format_tool.TOPSAILAI_FORMAT_PREFIX in content:
+        return [format_tool.TOPSAILAI_FORMAT_PREFIX + step_name for step_name in STOP_STEP_NAMES]
+    return None
+
+
+class StopRegistry(object):
+    """ the endpoints which reject the parameter 'stop', it is learned from errors """
+    def __init__(self):
+        self.lock = threading.Lock()
+        # key is (api_key, api_base)
+        self.rejected_keys = set()
+
+    def is_supported(self, model_config:dict) -> bool:
+        with self.lock:
+            return get_endpoint_key(model_config) not in self.rejected_keys
+
+    def set_rejected(self, model_config:dict):
+        key = get_endpoint_key(model_config)
+        with self.lock:
+            self.rejected_keys.add(key)
+        logger.warning(f"stop sequences are not supported: api_base={key[1]}")
+        return
+
+    def clear(self):
+        with self.lock:
+            self.rejected_keys.clear()
+
+
+class EarlyStopStat(object):
+    """ counters of the aborted streams.
+
+    The output which is not generated is estimated by the streams of agent steps which run to the end:
+    saved_tokens = the average output of them * abort_count - the output received by the aborted streams,
+    saved_seconds is by the output speed of the aborted streams.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.abort_count = 0
+        # the output of the aborted streams till they are closed, from the first token
+        self.received_tokens = 0
+        self.received_seconds = 0.0
+        # the streams which are not aborted
+        self.full_count = 0
+        self.full_tokens = 0
+
+    def add(self, received_tokens:int, received_seconds:float):
+        """ a stream is aborted """
+        with self.lock:
+            self.abort_count += 1
+            self.received_tokens += received_tokens
+            self.received_seconds += received_seconds
+
+    def add_full(self, tokens:int):
+        """ a stream runs to the end """
+        with self.lock:
+            self.full_count += 1
+            self.full_tokens += tokens
+
+    def get_saved_tokens(self) -> int:
+        """ estimated output tokens which are not generated, 0 if no stream runs to the end """
+        with self.lock:
+            if not self.full_count:
+                return 0
+            average_tokens = float(self.full_tokens) / self.full_count
+            return max(0, int(average_tokens * self.abort_count) - self.received_tokens)
+
+    def get_saved_seconds(self) -> float:
+        """ estimated seconds of generation which are saved """
+        saved_tokens = self.get_saved_tokens()
+        with self.lock:
+            if not saved_tokens or not self.received_tokens or self.received_seconds <= 0:
+                return 0.0
+            return round(saved_tokens * self.received_seconds / self.received_tokens, 3)
+
+    def to_dict(self) -> dict:
+        saved_tokens = self.get_saved_tokens()
+        saved_seconds = self.get_saved_seconds()
+        with self.lock:
+            return dict(
+                abort_count=self.abort_count,
+                received_tokens=self.received_tokens,
+                full_count=self.full_count,
+                full_tokens=self.full_tokens,
+                saved_tokens=saved_tokens,
+                saved_seconds=saved_seconds,
+            )
+
+
+# init
+StopRegistryInstance = StopRegistry()
+
+
+def get_batch_concurrency() -> tuple[int, int]:
+    """ return (max_concurrency, max_per_endpoint) of chat_many by env """
+    return (
+        int(os.getenv("LLM_BATCH_CONCURRENCY", 8)),
+        int(os.getenv("LLM_BATCH_ENDPOINT_CONCURRENCY", 0)),
+    )
+
+def get_timeout_kwargs(timeout:float=None) -> dict:
+    """ return kwargs of create for the timeout of request """
+    if not timeout:
+        return {}
+    return {"timeout": timeout}
+
+def build_completion_for_stream(params:dict, content:str) -> dict:
+    """ build a dict of ChatCompletion for the content of a stream """
+    return {
+        "id": "stream",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": params.get("model") or "",
+        "choices": [
+            {
+                "index": 0,
+                "finish_reason": "stop",
+                "message": {"role": "assistant", "content": content},
+            }
+        ],
+    }
+
+
 class ContentSender(object):
     """ send content to endpoint. """
     def send(self, content):
@@ -174,21 +438,64 @@ class LLMModel(object):
 
         self.content_senders = [] # instances of base class ContentSender
 
+        self.early_stop_stat = EarlyStopStat()
+
+        # when and how long to retry a failed chat
+        self.retry_policy = RetryPolicy.from_env()
+
+        # EndpointLimiter, limit the in-flight requests of each endpoint, see chat_many
+        self.endpoint_limiter = None
+
     def send_content(self, content):
         for sender in self.content_senders:
             sender.send(content)
         return
 
-    def __del__(self):
-        self.tokenStat.flag_running = False
-
     @property
     def chat_model(self):
         """ get a available model object to chat """
+        return self.choose_model()[1]
+
+    def get_usage_labels(self) -> dict:
+        """ the keys of usage aggregation """
+        session_id = get_session_id()
+        return dict(
+            model_name=self.model_name,
+            agent_name=get_agent_name(),
+            session_id=session_id if session_id and session_id != "None" else None,
+        )
+
+    def record_usage(self, usage, content:str=None):
+        """ record the usage of response, local tokenization is the fallback if it is None """
+        self.tokenStat.add_usage(usage, content=content, labels=self.get_usage_labels())
+        return
+
+    def get_prompt_budget(self) -> int:
+        """ max tokens of the prompt, the context window without the output and a safety margin """
+        context_window = get_context_window(self.model_name)
+        return int(context_window * 0.95) - self.max_tokens
+
+    def get_affinity_key(self) -> str:
+        """ the key of sticky routing: session_id > agent object > this model """
+        session_id = get_session_id()
+        if session_id and session_id != "None":
+            return f"session:{session_id}"
+        agent = get_agent_object()
+        if agent is not None:
+            return f"agent:{id(agent)}"
+        return f"llm:{id(self)}"
+
+    def choose_model(self, affinity_key:str=None) -> tuple:
+        """ choose the healthiest endpoint, return tuple (model_config:dict, model:obj)
+
+        :affinity_key: for sticky routing, see LLM_ROUTING_MODE.
+        """
         if self.models:
-            self.model_config = random.choice(self.models)
-            self.model = self.model_config["_model"]
-        return self.model
+            model_config = RouterInstance.choose(self.models, affinity_key=affinity_key)
+            self.model_config = model_config
+            self.model = model_config["_model"]
+            return (model_config, model_config["_model"])
+        return (self.model_config, self.model)
 
     def get_llm_models(self):
         """ add model to self.models;
@@ -215,16 +522,13 @@ class LLMModel(object):
         return self.models
 
     # get a object abount llm model by openai api
-    def get_llm_model(self, api_key=None, api_base=None):
+    def get_llm_model(self, api_key=None, api_base=None, renew=False):
+        """ the client is shared in this process, :renew: True for a new client """
         logger.info("getting llm model ...")
-        return openai.OpenAI(
-            api_key=api_key or os.getenv("OPENAI_API_KEY", ""),
-            base_url=api_base or os.getenv("OPENAI_API_BASE", "https://api.openai.com/v1"),
-        ).chat.completions
+        return get_chat_client(api_key=api_key, api_base=api_base, renew=renew)
 
     def build_parameters_for_chat(self, messages, stream=False, tools=None, tool_choice="auto"):
-        messages = copy.deepcopy(messages)
-        _format_messages(messages, key_name="step_name", value_name="raw_text")
+        messages = _format_messages(messages, key_name="step_name", value_name="raw_text")
         params = dict(
             model=self.model_name,
             messages=messages,
@@ -233,10 +537,17 @@ class LLMModel(object):
             top_p=self.top_p,
             frequency_penalty=self.frequency_penalty,
             n=1,
-            stop=None,
             stream=stream,
         )
 
+        # no 'stop' at all for the models which reject it
+        stop = get_stop_sequences(messages, self.model_name)
+        if stop:
+            params["stop"] = stop
+
+        if stream and is_stream_usage():
+            params["stream_options"] = {"include_usage": True}
+
         if tools:
             params["tools"] = tools
             params["tool_choice"] = tool_choice
@@ -285,19 +596,8 @@ class LLMModel(object):
         """
         return response.choices[0].message
 
-    def call_llm_model(self, messages, tools=None, tool_choice="auto"):
-        """ return tuple (response:obj, content:str) """
-        self.tokenStat.add_msgs(messages)
-
-        response = self.chat_model.create(
-            **self.build_parameters_for_chat(
-                messages,
-                tools=tools, tool_choice=tool_choice,
-            )
-        )
-
-        self.tokenStat.output_token_stat()
-
+    def get_response_content(self, response) -> str:
+        """ return content of response, raise TypeError if it is null """
         full_content = response.choices[0].message.content
         try:
             self.debug_response(response, full_content)
@@ -309,25 +609,274 @@ class LLMModel(object):
         full_content = full_content.strip()
         if not full_content:
             raise TypeError("null of response")
+        return full_content
+
+    def get_cached_response(self, params:dict):
+        """ return response from cache, None for miss or disabled """
+        cache = get_response_cache()
+        if cache is None:
+            return None
+        response = cache.get(params)
+        self.tokenStat.add_cache_result(response is not None)
+        if response is not None:
+            # no token is used
+            self.tokenStat.drop_msgs()
+        return response
+
+    def set_cached_response(self, params:dict, response, content:str):
+        """ save response to cache if it is enabled """
+        cache = get_response_cache()
+        if cache is None:
+            return
+        try:
+            cache.set(params, response, content=content)
+        except Exception as e:
+            logger.warning(f"failed to cache response: {e}")
+        return
 
-        self.send_content(full_content)
+    def discard_cached_response(self, content:str):
+        """ a bad response cannot be reused """
+        cache = get_response_cache()
+        if cache is None:
+            return
+        cache.discard(content)
+        return
 
-        return (response, full_content)
+    def on_stream_aborted(self, content:str, seconds:float):
+        """ the stream is closed after the stop step
+
+        :content: the output received, :seconds: from the first token.
+        """
+        self.early_stop_stat.add(count_tokens_for_model(content, self.model_name), seconds)
+        logger.info(f"stream is aborted: {self.early_stop_stat.to_dict()}")
+        return
+
+    def on_stream_done(self, usage, content:str):
+        """ the stream of agent steps runs to the end, it is the length of a full output """
+        usage = parse_usage(usage)
+        if usage and usage["completion_tokens"] > 0:
+            self.early_stop_stat.add_full(usage["completion_tokens"])
+        else:
+            self.early_stop_stat.add_full(count_tokens_for_model(content, self.model_name))
+        return
+
+    def create_by_model(self, model_config:dict, model, params:dict, timeout=None):
+        """ model.create, the parameter 'stop' is dropped if the endpoint rejects it, it is remembered """
+        if "stop" in params and not StopRegistryInstance.is_supported(model_config):
+            params = drop_stop(params)
+        try:
+            return model.create(**params, **get_timeout_kwargs(timeout))
+        except openai.BadRequestError as e:
+            if "stop" not in params or not is_stop_rejected(e):
+                raise
+            StopRegistryInstance.set_rejected(model_config)
+        return model.create(**drop_stop(params), **get_timeout_kwargs(timeout))
+
+    def choose_backup_model(self, model_config:dict) -> tuple|None:
+        """ return tuple (model_config, model) of another endpoint, None if no found """
+        backup_configs = [
+            x for x in self.models
+            if get_endpoint_key(x) != get_endpoint_key(model_config)
+        ]
+        if not backup_configs:
+            return None
+        backup_config = RouterInstance.choose(backup_configs)
+        return (backup_config, backup_config["_model"])
+
+    def can_hedge(self, model_config:dict) -> bool:
+        """ True if hedging is enabled and there is another endpoint """
+        if not HedgerInstance.enabled:
+            return False
+        for x in self.models:
+            if get_endpoint_key(x) != get_endpoint_key(model_config):
+                return True
+        return False
+
+    def ctxm_endpoint_slot(self, model_config:dict):
+        """ wait for a free slot of the endpoint if there is a limiter """
+        if self.endpoint_limiter is None:
+            return nullcontext()
+        return self.endpoint_limiter.ctxm_acquire(model_config)
+
+    def use_structured_output(self, messages, for_raw=False, for_stream=False, tools=None) -> bool:
+        """ True if the steps can be asked by response_format (LLM_STRUCTURED_OUTPUT).
+
+        Not for raw text, streaming (the steps are parsed on the fly), tool calls and the topsailai format.
+        """
+        if for_raw or for_stream or tools or not messages:
+            return False
+        if get_structured_mode() == LEVEL_NONE:
+            return False
+        content = messages[0].get("content")
+        if not isinstance(content, str) or format_tool.TOPSAILAI_FORMAT_PREFIX in content:
+            return False
+        return True
+
+    def get_structured_level(self, model_config:dict, structured:bool) -> str:
+        """ the level of structured output for the endpoint """
+        if not structured:
+            return LEVEL_NONE
+        return StructuredOutputRegistryInstance.get_level(model_config, get_structured_mode())
+
+    def apply_response_format(self, params:dict, level:str) -> dict:
+        """ return params with response_format of the level """
+        if level == LEVEL_NONE:
+            return params
+        if level == LEVEL_JSON_OBJECT and "json" not in str(params["messages"][0].get("content")).lower():
+            # json_object needs the word 'json' in the prompt
+            return params
+        ParseStatInstance.add_structured()
+        return dict(params, response_format=get_response_format(level))
+
+    def _create_by_endpoint(self, model_config, model, params, affinity_key=None, timeout=None, structured=False):
+        """ send the request to the endpoint
+
+        :structured: ask response_format, it falls back at once if the endpoint rejects it,
+            or it is retried once without response_format on other 400/422,
+            the endpoint drops it after MAX_GENERIC_REJECTIONS of them in a row.
+        """
+        level = self.get_structured_level(model_config, structured)
+        rejected_level = None
+        while True:
+            try:
+                with self.ctxm_endpoint_slot(model_config), RouterInstance.ctxm_track(model_config, affinity_key):
+                    response = self.create_by_model(
+                        model_config, model, self.apply_response_format(params, level), timeout
+                    )
+                break
+            except (openai.BadRequestError, openai.UnprocessableEntityError) as e:
+                if level == LEVEL_NONE:
+                    raise
+                if is_unsupported_error(e):
+                    level = StructuredOutputRegistryInstance.downgrade(model_config, level)
+                else:
+                    # it may be rejected without a clear message, try once without response_format
+                    rejected_level, level = level, LEVEL_NONE
+        if rejected_level:
+            StructuredOutputRegistryInstance.add_rejection(model_config, rejected_level)
+        elif level != LEVEL_NONE:
+            StructuredOutputRegistryInstance.add_accepted(model_config)
+        RouterInstance.report_usage(model_config, response.usage)
+        return response
+
+    def create_response(self, params:dict, timeout=None, structured=False):
+        """ return the response of a non-streaming request.
+
+        If hedging is enabled (LLM_HEDGE), a slow request is raced by a duplicate to another endpoint.
+        """
+        affinity_key = self.get_affinity_key()
+        model_config, model = self.choose_model(affinity_key)
+        if not self.can_hedge(model_config):
+            return self._create_by_endpoint(model_config, model, params, affinity_key, timeout, structured)
+
+        def _primary():
+            return self._create_by_endpoint(model_config, model, params, affinity_key, timeout, structured)
+
+        def _backup():
+            backup_config, backup_model = self.choose_backup_model(model_config)
+            return self._create_by_endpoint(backup_config, backup_model, params, timeout=timeout, structured=structured)
+
+        # the loser is done in the pool, it is paid too
+        labels = self.get_usage_labels()
+
+        def _on_loser(response):
+            self.tokenStat.add_dropped_usage(response.usage, labels)
+
+        return HedgerInstance.call(_primary, _backup, on_loser=_on_loser)
 
-    def call_llm_model_by_stream(self, messages):
-        """ return tuple (response:obj, content:str) """
+    def call_llm_model(self, messages, tools=None, tool_choice="auto", timeout=None, structured=False):
+        """ return tuple (response:obj, content:str)
+
+        :timeout: seconds of this request, None for default.
+        :structured: ask the steps by response_format, see use_structured_output.
+        """
         self.tokenStat.add_msgs(messages)
 
-        response = self.chat_model.create(
-            **self.build_parameters_for_chat(messages, stream=True)
+        params = self.build_parameters_for_chat(
+            messages,
+            tools=tools, tool_choice=tool_choice,
         )
+        response = self.get_cached_response(params)
+        if response is None:
+            response = self.create_response(params, timeout=timeout, structured=structured)
+
+            full_content = self.get_response_content(response)
+            self.record_usage(response.usage, full_content)
+            self.set_cached_response(params, response, full_content)
+        else:
+            full_content = self.get_response_content(response)
+
+        self.tokenStat.output_token_stat()
 
-        full_content = ""
-        for chunk in response:
-            delta_content = chunk.choices[0].delta.content
-            if delta_content:
-                full_content += delta_content
-                self.send_content(delta_content)
+        self.send_content(full_content)
+
+        return (response, full_content)
+
+    def call_llm_model_by_stream(self, messages, step_parser=None, timeout=None):
+        """ return tuple (response:obj, content:str)
+
+        :step_parser: StepStreamParser, it gets the steps as soon as they are closed.
+        :timeout: seconds of this request, None for default.
+        """
+        self.tokenStat.add_msgs(messages)
+        if step_parser is not None:
+            step_parser.reset()
+
+        params = self.build_parameters_for_chat(messages, stream=True)
+        response = self.get_cached_response(params)
+        if response is not None:
+            full_content = self.get_response_content(response)
+            if step_parser is not None:
+                step_parser.feed(full_content)
+                step_parser.finish()
+            self.send_content(full_content)
+            self.tokenStat.output_token_stat()
+            return (response, full_content)
+
+        content_parts = []
+        usage = None
+        first_time = None
+        aborted = False
+        affinity_key = self.get_affinity_key()
+        model_config, model = self.choose_model(affinity_key)
+        with self.ctxm_endpoint_slot(model_config), RouterInstance.ctxm_track(model_config, affinity_key):
+            response = self.create_by_model(model_config, model, params, timeout)
+
+            for chunk in response:
+                if getattr(chunk, "usage", None):
+                    usage = chunk.usage
+                if not chunk.choices:
+                    continue
+                delta_content = chunk.choices[0].delta.content
+                if delta_content:
+                    if first_time is None:
+                        first_time = time.time()
+                    content_parts.append(delta_content)
+                    self.send_content(delta_content)
+                    if step_parser is not None:
+                        step_parser.feed(delta_content)
+                        if step_parser.is_done and is_early_stop():
+                            # no need to wait for the rest, e.g. a hallucinated observation
+                            response.close()
+                            aborted = True
+                            self.on_stream_aborted("".join(content_parts), time.time() - first_time)
+                            break
+        RouterInstance.report_usage(model_config, usage)
+        full_content = "".join(content_parts)
+        self.record_usage(usage, full_content)
+        if step_parser is not None:
+            if not aborted:
+                self.on_stream_done(usage, full_content)
+            step_parser.finish()
+            if step_parser.is_done:
+                full_content = step_parser.get_done_content()
+
+        if full_content.strip():
+            self.set_cached_response(
+                params,
+                build_completion_for_stream(params, full_content.strip()),
+                full_content.strip(),
+            )
 
         if env_tool.is_debug_mode():
             print()
@@ -336,6 +885,44 @@ class LLMModel(object):
 
         return (response, full_content.strip())
 
+    def handle_chat_error(self, retry_state, e, rsp_content=None) -> float:
+        """ handle a failed call of chat.
+
+        return seconds to wait before the next try, raise if it is not retryable or out of budget.
+        """
+        delay = retry_state.next_delay(e)
+        error_class = retry_state.last_error_class
+        print_error(
+            f"!!! [{retry_state.retry_count}] {type(e).__name__} ({error_class}), "
+            f"{self.model_config['api_key'][:7]}, {e}"
+        )
+
+        if error_class in (ERROR_JSON, ERROR_EMPTY):
+            ParseStatInstance.add_retry(getattr(e, "reason", error_class))
+        if isinstance(e, JsonError):
+            self.discard_cached_response(rsp_content)
+        if error_class == ERROR_SERVER and retry_state.get_error_count(ERROR_SERVER) > 5:
+            self.model = self.get_llm_model(renew=True)
+
+        if delay is None:
+            if not self.retry_policy.is_retryable(e):
+                # e.g. context length exceeded, retrying never helps
+                raise e
+            raise Exception("chat to LLM is failed") from e
+        return delay
+
+    def format_chat_result(self, rsp_obj, rsp_content, for_raw=False, for_response=False, structured=False):
+        """ convert the content of response to the return value of chat """
+        if for_raw:
+            return rsp_content
+
+        result = _format_response(rsp_content, structured=structured)
+
+        if for_response:
+            return (rsp_obj, result)
+
+        return result
+
     def chat(
             self, messages,
             for_raw=False,
@@ -343,100 +930,388 @@ class LLMModel(object):
             for_response=False,
             tools=None,
             tool_choice="auto",
+            step_parser=None,
+            deadline=None,
         ):
         """
         Args:
             for_response: if True, return (response:obj, content:list[dict])
+            step_parser: StepStreamParser for for_stream, it is reset for each retry
+            deadline: seconds, the overall time of chat include of retries, default is env LLM_CHAT_DEADLINE
 
         default return list_dict.
         """
-        retry_times = 10
-        err_count_map = {}
+        if deadline is None:
+            deadline = get_chat_deadline()
+        retry_state = self.retry_policy.new_state(deadline)
+        structured = self.use_structured_output(messages, for_raw, for_stream, tools)
 
         rsp_content = None
         rsp_obj = None
 
-        for i in range(100):
-            if i > retry_times:
+        while True:
+            try:
+                if for_stream:
+                    rsp_obj, rsp_content = self.call_llm_model_by_stream(
+                        messages, step_parser=step_parser,
+                        timeout=retry_state.get_remaining_seconds(),
+                    )
+                else:
+                    rsp_obj, rsp_content = self.call_llm_model(
+                        messages,
+                        tools=tools, tool_choice=tool_choice,
+                        timeout=retry_state.get_remaining_seconds(),
+                        structured=structured,
+                    )
+
+                return self.format_chat_result(
+                    rsp_obj, rsp_content,
+                    for_raw=for_raw, for_response=for_response, structured=structured,
+                )
+            except (JsonError, TypeError, openai.OpenAIError) as e:
+                sec = self.handle_chat_error(retry_state, e, rsp_content)
+
+            print_error(f"[{retry_state.retry_count}] blocking chat {sec:.2f}s ...")
+            time.sleep(sec)
+
+
+    def _new_batch_model(self, max_per_endpoint:int=None):
+        """ return a shallow copy of this model for a batch, it shares clients and stats """
+        if max_per_endpoint is None:
+            max_per_endpoint = get_batch_concurrency()[1]
+        llm_model = copy.copy(self)
+        llm_model.endpoint_limiter = EndpointLimiter(max_per_endpoint)
+        return llm_model
+
+    def _chat_one(self, thread_vars:dict, index:int, messages, chat_kwargs:dict) -> tuple:
+        with ctxm_set_thread_vars(thread_vars):
+            try:
+                return (index, self.chat(messages, **chat_kwargs), None)
+            except Exception as e:
+                logger.exception(f"chat_many: item [{index}] is failed: {e}")
+                return (index, None, e)
+
+    def chat_many(self, messages_list:list, max_concurrency:int=None, max_per_endpoint:int=None, **chat_kwargs):
+        """ run many independent chats concurrently, yield tuple (index, result, error) as they complete.
+
+        Args:
+            messages_list: list of messages, one item for one chat
+            max_concurrency: max in-flight chats, default is env LLM_BATCH_CONCURRENCY
+            max_per_endpoint: max in-flight requests of one endpoint, 0 for no limit,
+                default is env LLM_BATCH_ENDPOINT_CONCURRENCY
+            chat_kwargs: the arguments of chat, e.g. for_raw
+
+        A failed item yields (index, None, error), the other items go on.
+
+        Example:
+            for index, result, error in llm_model.chat_many(messages_list, for_raw=True):
+                ...
+        """
+        if max_concurrency is None:
+            max_concurrency = get_batch_concurrency()[0]
+        llm_model = self._new_batch_model(max_per_endpoint)
+        thread_vars = get_thread_vars()
+
+        executor = ThreadPoolExecutor(max_workers=max(1, max_concurrency), thread_name_prefix="chat_many")
+        try:
+            futures = [
+                executor.submit(llm_model._chat_one, thread_vars, index, messages, chat_kwargs)
+                for index, messages in enumerate(messages_list)
+            ]
+            for future in as_completed(futures):
+                yield future.result()
+        finally:
+            # the caller may stop early
+            executor.shutdown(wait=False, cancel_futures=True)
+        return
+
+
+class AsyncLLMModel(LLMModel):
+    """ asyncio-native LLM model.
+
+    It is built on openai.AsyncOpenAI, so many calls can be in-flight on one event loop.
+    The retry and format semantics are the same as LLMModel.
+
+    Example:
+        llm_model = AsyncLLMModel()
+        answer = await llm_model.chat(messages)
+    """
+
+    # get a object abount llm model by openai api
+    def get_llm_model(self, api_key=None, api_base=None, renew=False):
+        """ the client is shared in the running event loop, :renew: True for a new client.
+
+        None out of event loop, the client is created by the first call in the loop, see get_loop_model.
+        """
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return None
+        logger.info("getting async llm model ...")
+        return get_chat_client(api_key=api_key, api_base=api_base, for_async=True, renew=renew)
+
+    @staticmethod
+    def get_loop_model(model_config:dict):
+        """ the async client of the running event loop for the endpoint """
+        return get_chat_client(
+            api_key=model_config.get("api_key") or None,
+            api_base=model_config.get("api_base") or None,
+            for_async=True,
+        )
+
+    def choose_model(self, affinity_key:str=None) -> tuple:
+        """ the client is looked up for each request, it can not be reused by another event loop """
+        model_config, _ = super().choose_model(affinity_key)
+        return (model_config, self.get_loop_model(model_config))
+
+    def choose_backup_model(self, model_config:dict) -> tuple|None:
+        backup = super().choose_backup_model(model_config)
+        if backup is None:
+            return None
+        return (backup[0], self.get_loop_model(backup[0]))
+
+    def actxm_endpoint_slot(self, model_config:dict):
+        """ wait for a free slot of the endpoint if there is a limiter """
+        if self.endpoint_limiter is None:
+            return nullcontext()
+        return self.endpoint_limiter.actxm_acquire(model_config)
+
+    async def create_by_model(self, model_config:dict, model, params:dict, timeout=None):
+        """ model.create, the parameter 'stop' is dropped if the endpoint rejects it, it is remembered """
+        if "stop" in params and not StopRegistryInstance.is_supported(model_config):
+            params = drop_stop(params)
+        try:
+            return await model.create(**params, **get_timeout_kwargs(timeout))
+        except openai.BadRequestError as e:
+            if "stop" not in params or not is_stop_rejected(e):
+                raise
+            StopRegistryInstance.set_rejected(model_config)
+        return await model.create(**drop_stop(params), **get_timeout_kwargs(timeout))
+
+    async def _create_by_endpoint(self, model_config, model, params, affinity_key=None, timeout=None, structured=False):
+        """ send the request to the endpoint """
+        level = self.get_structured_level(model_config, structured)
+        rejected_level = None
+        while True:
+            try:
+                async with self.actxm_endpoint_slot(model_config):
+                    with RouterInstance.ctxm_track(model_config, affinity_key):
+                        response = await self.create_by_model(
+                            model_config, model, self.apply_response_format(params, level), timeout
+                        )
                 break
+            except (openai.BadRequestError, openai.UnprocessableEntityError) as e:
+                if level == LEVEL_NONE:
+                    raise
+                if is_unsupported_error(e):
+                    level = StructuredOutputRegistryInstance.downgrade(model_config, level)
+                else:
+                    # it may be rejected without a clear message, try once without response_format
+                    rejected_level, level = level, LEVEL_NONE
+        if rejected_level:
+            StructuredOutputRegistryInstance.add_rejection(model_config, rejected_level)
+        elif level != LEVEL_NONE:
+            StructuredOutputRegistryInstance.add_accepted(model_config)
+        RouterInstance.report_usage(model_config, response.usage)
+        return response
+
+    async def create_response(self, params:dict, timeout=None, structured=False):
+        """ return the response of a non-streaming request, the loser of hedging is cancelled """
+        affinity_key = self.get_affinity_key()
+        model_config, model = self.choose_model(affinity_key)
+        if not self.can_hedge(model_config):
+            return await self._create_by_endpoint(model_config, model, params, affinity_key, timeout, structured)
+
+        async def _primary():
+            return await self._create_by_endpoint(model_config, model, params, affinity_key, timeout, structured)
+
+        async def _backup():
+            backup_config, backup_model = self.choose_backup_model(model_config)
+            return await self._create_by_endpoint(backup_config, backup_model, params, timeout=timeout, structured=structured)
+
+        return await HedgerInstance.acall(_primary, _backup)
+
+    async def call_llm_model(self, messages, tools=None, tool_choice="auto", timeout=None, structured=False):
+        """ return tuple (response:obj, content:str)
+
+        :timeout: seconds of this request, None for default.
+        :structured: ask the steps by response_format, see use_structured_output.
+        """
+        self.tokenStat.add_msgs(messages)
+
+        params = self.build_parameters_for_chat(
+            messages,
+            tools=tools, tool_choice=tool_choice,
+        )
+        response = self.get_cached_response(params)
+        if response is None:
+            response = await self.create_response(params, timeout=timeout, structured=structured)
+
+            full_content = self.get_response_content(response)
+            self.record_usage(response.usage, full_content)
+            self.set_cached_response(params, response, full_content)
+        else:
+            full_content = self.get_response_content(response)
+
+        self.tokenStat.output_token_stat()
+
+        self.send_content(full_content)
+
+        return (response, full_content)
+
+    async def call_llm_model_by_stream(self, messages, step_parser=None, timeout=None):
+        """ return tuple (response:obj, content:str)
+
+        :step_parser: StepStreamParser, it gets the steps as soon as they are closed.
+        :timeout: seconds of this request, None for default.
+        """
+        self.tokenStat.add_msgs(messages)
+        if step_parser is not None:
+            step_parser.reset()
+
+        params = self.build_parameters_for_chat(messages, stream=True)
+        response = self.get_cached_response(params)
+        if response is not None:
+            full_content = self.get_response_content(response)
+            if step_parser is not None:
+                step_parser.feed(full_content)
+                step_parser.finish()
+            self.send_content(full_content)
+            self.tokenStat.output_token_stat()
+            return (response, full_content)
+
+        content_parts = []
+        usage = None
+        first_time = None
+        aborted = False
+        affinity_key = self.get_affinity_key()
+        model_config, model = self.choose_model(affinity_key)
+        async with self.actxm_endpoint_slot(model_config):
+            with RouterInstance.ctxm_track(model_config, affinity_key):
+                response = await self.create_by_model(model_config, model, params, timeout)
+
+                async for chunk in response:
+                    if getattr(chunk, "usage", None):
+                        usage = chunk.usage
+                    if not chunk.choices:
+                        continue
+                    delta_content = chunk.choices[0].delta.content
+                    if delta_content:
+                        if first_time is None:
+                            first_time = time.time()
+                        content_parts.append(delta_content)
+                        self.send_content(delta_content)
+                        if step_parser is not None:
+                            step_parser.feed(delta_content)
+                            if step_parser.is_done and is_early_stop():
+                                # no need to wait for the rest, e.g. a hallucinated observation
+                                await response.close()
+                                aborted = True
+                                self.on_stream_aborted("".join(content_parts), time.time() - first_time)
+                                break
+        RouterInstance.report_usage(model_config, usage)
+        full_content = "".join(content_parts)
+        self.record_usage(usage, full_content)
+        if step_parser is not None:
+            if not aborted:
+                self.on_stream_done(usage, full_content)
+            step_parser.finish()
+            if step_parser.is_done:
+                full_content = step_parser.get_done_content()
+
+        if full_content.strip():
+            self.set_cached_response(
+                params,
+                build_completion_for_stream(params, full_content.strip()),
+                full_content.strip(),
+            )
+
+        if env_tool.is_debug_mode():
+            print()
+
+        self.tokenStat.output_token_stat()
+
+        return (response, full_content.strip())
 
-            if i > 0:
-                sec = (i%retry_times)*5
-                if sec <= 0:
-                    sec = 3
-                if sec > 120:
-                    sec = 120
-                print_error(f"[{i}] blocking chat {sec}s ...")
-                time.sleep(sec)
+    async def chat(
+            self, messages,
+            for_raw=False,
+            for_stream=False,
+            for_response=False,
+            tools=None,
+            tool_choice="auto",
+            step_parser=None,
+            deadline=None,
+        ):
+        """
+        Args:
+            for_response: if True, return (response:obj, content:list[dict])
+            step_parser: StepStreamParser for for_stream, it is reset for each retry
+            deadline: seconds, the overall time of chat include of retries, default is env LLM_CHAT_DEADLINE
+
+        default return list_dict.
+        """
+        if deadline is None:
+            deadline = get_chat_deadline()
+        retry_state = self.retry_policy.new_state(deadline)
+        structured = self.use_structured_output(messages, for_raw, for_stream, tools)
 
+        rsp_content = None
+        rsp_obj = None
+
+        while True:
             try:
                 if for_stream:
-                    rsp_obj, rsp_content = self.call_llm_model_by_stream(messages)
+                    rsp_obj, rsp_content = await self.call_llm_model_by_stream(
+                        messages, step_parser=step_parser,
+                        timeout=retry_state.get_remaining_seconds(),
+                    )
                 else:
-                    rsp_obj, rsp_content = self.call_llm_model(
+                    rsp_obj, rsp_content = await self.call_llm_model(
                         messages,
                         tools=tools, tool_choice=tool_choice,
+                        timeout=retry_state.get_remaining_seconds(),
+                        structured=structured,
                     )
 
-                if for_raw:
-                    return rsp_content
-
-                result = _format_response(rsp_content)
-
-                if for_response:
-                    return (rsp_obj, result)
-
-                return result
-            except JsonError as e:
-                print_error(f"!!! [{i}] JsonError, {e}")
-                continue
-            except openai.RateLimitError as e:
-                print_error(f"!!! [{i}] RateLimitError, {self.model_config["api_key"][:7]}, {e}")
-                if i > 7:
-                    retry_times += 1
-                continue
-            except TypeError as e:
-                print_error(f"!!! [{i}] TypeError, {e}")
-                continue
-            except openai.InternalServerError as e:
-                print_error(f"!!! [{i}] InternalServerError, {e}")
-                if i > 7:
-                    retry_times += 1
-
-                if 'InternalServerError' not in err_count_map:
-                    err_count_map["InternalServerError"] = 0
-                err_count_map["InternalServerError"] += 1
-
-                if err_count_map["InternalServerError"] > 5:
-                    self.model = self.get_llm_model()
-
-                continue
-            except openai.APIConnectionError as e:
-                print_error(f"!!! [{i}] APIConnectionError, {e}")
-                if i > 7:
-                    retry_times += 1
-                continue
-            except openai.APITimeoutError as e:
-                print_error(f"!!! [{i}] APITimeoutError, {e}")
-                if i > 7:
-                    retry_times += 1
-                continue
-            except openai.PermissionDeniedError as e:
-                print_error(f"!!! [{i}] PermissionDeniedError, {e}")
-                continue
-            except openai.BadRequestError as e:
-                # I don't know why some large model services return this issue, but retrying usually resolves it.
-                print_error(f"!!! [{i}] BadRequestError, {e}")
-
-                # case: Requested token count exceeds the model's maximum context length
-                e_str = str(e).lower()
-                for key in [
-                    "exceed",
-                    "maximum context",
-                ]:
-                    if key in e_str:
-                        break
+                return self.format_chat_result(
+                    rsp_obj, rsp_content,
+                    for_raw=for_raw, for_response=for_response, structured=structured,
+                )
+            except (JsonError, TypeError, openai.OpenAIError) as e:
+                sec = self.handle_chat_error(retry_state, e, rsp_content)
 
-                continue
+            print_error(f"[{retry_state.retry_count}] awaiting chat {sec:.2f}s ...")
+            await asyncio.sleep(sec)
 
-        raise Exception("chat to LLM is failed")
+    async def _chat_one(self, semaphore, index:int, messages, chat_kwargs:dict) -> tuple:
+        async with semaphore:
+            try:
+                return (index, await self.chat(messages, **chat_kwargs), None)
+            except Exception as e:
+                logger.exception(f"chat_many: item [{index}] is failed: {e}")
+                return (index, None, e)
+
+    async def chat_many(self, messages_list:list, max_concurrency:int=None, max_per_endpoint:int=None, **chat_kwargs):
+        """ asyncio version of LLMModel.chat_many, it is an async generator.
+
+        Example:
+            async for index, result, error in llm_model.chat_many(messages_list):
+                ...
+        """
+        if max_concurrency is None:
+            max_concurrency = get_batch_concurrency()[0]
+        llm_model = self._new_batch_model(max_per_endpoint)
+        semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+        tasks = [
+            asyncio.ensure_future(llm_model._chat_one(semaphore, index, messages, chat_kwargs))
+            for index, messages in enumerate(messages_list)
+        ]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            for task in tasks:
+                task.cancel()
+        return
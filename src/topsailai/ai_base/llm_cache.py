@@ -0,0 +1,248 @@
+'''
+  Author: DawsonLin
+  Email: lin_dongsen@126.com
+  Created: 2026-10-17
+  Purpose: persistent content-addressed cache for responses of LLM
+  Env:
+    @LLM_CACHE_DIR: a folder, the cache is enabled if it is set;
+    @LLM_CACHE_TTL: seconds, default is 604800 (7 days);
+    @LLM_CACHE_MAX_SIZE: bytes, default is 268435456 (256MB), the least recently used entries are evicted;
+    @LLM_CACHE_MAX_TEMPERATURE: float, default is 0.5, bypass the cache if temperature is above it;
+'''
+
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+import simplejson
+from openai.types.chat import ChatCompletion
+
+from topsailai.logger.log_chat import logger
+
+
+# the parameters of chat which affect the response
+CACHE_KEY_NAMES = (
+    "model",
+    "messages",
+    "temperature",
+    "top_p",
+    "max_tokens",
+    "frequency_penalty",
+    "stop",
+    "tools",
+    "tool_choice",
+    "response_format",
+)
+
+
+def _default_json(obj):
+    """ make objects of openai serializable """
+    if hasattr(obj, "model_dump"):
+        return obj.model_dump()
+    return str(obj)
+
+def get_cache_key(params:dict) -> str:
+    """ return sha256 of the normalized parameters of chat """
+    normalized = {}
+    for name in CACHE_KEY_NAMES:
+        value = params.get(name)
+        if value is None:
+            continue
+        normalized[name] = value
+    content = simplejson.dumps(
+        normalized, sort_keys=True, ensure_ascii=False, default=_default_json,
+    )
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+class ResponseCache(object):
+    """ on-disk cache, one file per response, file mtime is the last access time (LRU) """
+    def __init__(
+            self,
+            folder:str,
+            ttl:int=604800,
+            max_size:int=268435456,
+            max_temperature:float=0.5,
+        ):
+        self.folder = folder
+        self.ttl = ttl
+        self.max_size = max_size
+        self.max_temperature = max_temperature
+
+        self.rlock = threading.RLock()
+
+        # bytes of all files, None for unknown
+        self._total_size = None
+
+        # key is md5 of content, value is cache key. for discarding a bad response.
+        self._recent_keys = OrderedDict()
+        self._max_recent_count = 1000
+
+        os.makedirs(self.folder, exist_ok=True)
+
+    def _get_file_path(self, key:str) -> str:
+        return os.path.join(self.folder, key[:2], key + ".json")
+
+    def is_cacheable(self, params:dict) -> bool:
+        """ False if the response is not reproducible """
+        if params.get("n", 1) != 1:
+            return False
+        temperature = params.get("temperature")
+        if temperature is not None and float(temperature) > self.max_temperature:
+            return False
+        return True
+
+    def get(self, params:dict) -> ChatCompletion|None:
+        """ return cached response, None for miss """
+        if not self.is_cacheable(params):
+            return None
+
+        key = get_cache_key(params)
+        file_path = self._get_file_path(key)
+        try:
+            with open(file_path, encoding="utf-8") as fd:
+                data = simplejson.load(fd)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"invalid cache file: [{file_path}], {e}")
+            self._delete_file(file_path)
+            return None
+
+        if self.ttl > 0 and data.get("create_time", 0) + self.ttl < time.time():
+            self._delete_file(file_path)
+            return None
+
+        # touch, it is the most recently used
+        try:
+            os.utime(file_path)
+        except OSError:
+            pass
+
+        response = ChatCompletion.model_validate(data["response"])
+        if response.choices:
+            self._remember_key(response.choices[0].message.content, key)
+        return response
+
+    def _remember_key(self, content:str, key:str):
+        """ remember the cache key of content """
+        if not content:
+            return
+        content_key = hashlib.md5(content.encode("utf-8")).hexdigest()
+        with self.rlock:
+            self._recent_keys[content_key] = key
+            self._recent_keys.move_to_end(content_key)
+            while len(self._recent_keys) > self._max_recent_count:
+                self._recent_keys.popitem(last=False)
+        return
+
+    def discard(self, content:str):
+        """ delete the cached response with this content, e.g. it cannot be parsed """
+        if not content:
+            return
+        content_key = hashlib.md5(content.encode("utf-8")).hexdigest()
+        with self.rlock:
+            key = self._recent_keys.pop(content_key, None)
+        if key:
+            logger.info(f"discard the cached response: {key}")
+            self._delete_file(self._get_file_path(key))
+        return
+
+    def set(self, params:dict, response:ChatCompletion|dict, content:str=None):
+        """ save response
+
+        :content: the content of response, it is used to discard this response.
+        """
+        if not self.is_cacheable(params):
+            return
+
+        if hasattr(response, "model_dump"):
+            response = response.model_dump()
+
+        key = get_cache_key(params)
+        self._remember_key(content, key)
+        file_path = self._get_file_path(key)
+        file_content = simplejson.dumps(
+            {"create_time": time.time(), "response": response},
+            ensure_ascii=False, default=_default_json,
+        )
+
+        with self.rlock:
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            tmp_file_path = f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_file_path, "w", encoding="utf-8") as fd:
+                fd.write(file_content)
+            os.replace(tmp_file_path, file_path)
+
+            if self._total_size is not None:
+                self._total_size += len(file_content)
+            self.evict()
+        return
+
+    def _delete_file(self, file_path:str):
+        try:
+            os.unlink(file_path)
+        except OSError:
+            pass
+
+    def _list_files(self) -> list[tuple]:
+        """ return list of (mtime, size, file_path) """
+        result = []
+        for root, _, files in os.walk(self.folder):
+            for file_name in files:
+                if not file_name.endswith(".json"):
+                    continue
+                file_path = os.path.join(root, file_name)
+                try:
+                    file_stat = os.stat(file_path)
+                except OSError:
+                    continue
+                result.append((file_stat.st_mtime, file_stat.st_size, file_path))
+        return result
+
+    def evict(self):
+        """ delete the least recently used files if the size is exceeded """
+        with self.rlock:
+            if self._total_size is not None and self._total_size <= self.max_size:
+                return
+
+            files = self._list_files()
+            self._total_size = sum(x[1] for x in files)
+            if self._total_size <= self.max_size:
+                return
+
+            # keep 90% to avoid evicting on each set
+            target_size = int(self.max_size * 0.9)
+            count = 0
+            for _, size, file_path in sorted(files):
+                if self._total_size <= target_size:
+                    break
+                self._delete_file(file_path)
+                self._total_size -= size
+                count += 1
+            logger.info(f"llm cache is evicted: count={count}, size={self._total_size}")
+        return
+
+
+g_response_cache = None
+g_response_cache_lock = threading.Lock()
+
+def get_response_cache() -> ResponseCache|None:
+    """ return the cache by env, None if it is disabled """
+    global g_response_cache
+
+    folder = os.getenv("LLM_CACHE_DIR")
+    if not folder:
+        return None
+
+    with g_response_cache_lock:
+        if g_response_cache is None or g_response_cache.folder != folder:
+            g_response_cache = ResponseCache(
+                folder,
+                ttl=int(os.getenv("LLM_CACHE_TTL", 604800)),
+                max_size=int(os.getenv("LLM_CACHE_MAX_SIZE", 268435456)),
+                max_temperature=float(os.getenv("LLM_CACHE_MAX_TEMPERATURE", 0.5)),
+            )
+        return g_response_cache
@@ -0,0 +1,282 @@
+'''
+  Author: DawsonLin
+  Email: lin_dongsen@126.com
+  Created: 2026-10-17
+  Purpose: model cascade, a small fast model first, the large model on failure or low confidence
+  Env:
+    @LLM_CASCADE_MODEL: the small model, e.g. DeepSeek-V3.1-Turbo, empty for disabled (default);
+    @LLM_CASCADE_ESCALATE_TURNS: default is 2, turns on the large model after an escalation;
+    @LLM_CASCADE_MAX_REPEAT: default is 2, the same tool call in so many turns in a row escalates;
+    @LLM_CASCADE_STEP_NAMES: the steps of the small model which are redone by the large model,
+      separated by ';', e.g. final_answer, default is empty;
+'''
+
+import os
+import time
+import threading
+from collections import deque
+
+from topsailai.logger.log_chat import logger
+from topsailai.ai_base.llm_base import LLMModel
+from topsailai.ai_base.llm_retry import (
+    ERROR_EMPTY,
+    ERROR_JSON,
+    RetryPolicy,
+    classify_error,
+)
+
+
+TIER_SMALL = "small"
+TIER_LARGE = "large"
+
+# reasons of escalation
+REASON_PARSE = "parse_failure"
+REASON_FAILURE = "chat_failure"
+REASON_TOOL_ERROR = "tool_error"
+REASON_REPEAT = "repeated_step"
+REASON_STEP = "step_trigger"
+REASON_EXPLICIT = "explicit"
+
+
+class CascadePolicy(object):
+    """ when to use the small model and when to escalate to the large one """
+    def __init__(
+            self,
+            small_model:str,
+            escalate_turns:int=2,
+            max_repeat:int=2,
+            escalate_step_names:tuple=(),
+            escalate_on_tool_error:bool=True,
+        ):
+        """
+        :small_model: model name of the cheap/fast tier;
+        :escalate_turns: turns on the large model after an escalation;
+        :max_repeat: the same tool call in so many turns in a row escalates, 0 for never;
+        :escalate_step_names: if the small model gives one of these steps, the turn is redone by the large model;
+        :escalate_on_tool_error: a failed tool call escalates the next turn.
+        """
+        assert small_model, "missing small_model"
+        self.small_model = small_model
+        self.escalate_turns = max(1, escalate_turns)
+        self.max_repeat = max_repeat
+        self.escalate_step_names = tuple(escalate_step_names or ())
+        self.escalate_on_tool_error = escalate_on_tool_error
+
+    @classmethod
+    def from_env(cls):
+        """ return a policy by env, None if LLM_CASCADE_MODEL is not set """
+        small_model = os.getenv("LLM_CASCADE_MODEL", "").strip()
+        if not small_model:
+            return None
+        step_names = os.getenv("LLM_CASCADE_STEP_NAMES", "")
+        return cls(
+            small_model,
+            escalate_turns=int(os.getenv("LLM_CASCADE_ESCALATE_TURNS", 2)),
+            max_repeat=int(os.getenv("LLM_CASCADE_MAX_REPEAT", 2)),
+            escalate_step_names=[x.strip() for x in step_names.split(";") if x.strip()],
+        )
+
+
+class TierStat(object):
+    """ counters of one tier """
+    def __init__(self, model_name:str):
+        self.model_name = model_name
+        self.request_count = 0
+        self.failure_count = 0
+        self.seconds = 0.0
+
+    def to_dict(self, llm_model:LLMModel) -> dict:
+        token_stat = llm_model.tokenStat
+        return dict(
+            model_name=self.model_name,
+            request_count=self.request_count,
+            failure_count=self.failure_count,
+            avg_seconds=round(self.seconds / self.request_count, 3) if self.request_count else 0.0,
+            prompt_tokens=token_stat.prompt_tokens,
+            completion_tokens=token_stat.completion_tokens,
+            cached_tokens=token_stat.cached_tokens,
+        )
+
+
+class ModelCascade(object):
+    """ choose the model of each turn of an agent.
+
+    The small model is used by default. It escalates to the large model:
+      - at once (the turn is redone), on parse failure, chat failure or a step of escalate_step_names;
+      - for the next turns, on tool errors, repeated steps, or escalate() by the caller.
+    """
+    def __init__(self, policy:CascadePolicy, large_llm_model:LLMModel, small_llm_model:LLMModel=None):
+        self.policy = policy
+        self.large_llm_model = large_llm_model
+        self.small_llm_model = small_llm_model or self.new_small_llm_model()
+        self.rlock = threading.RLock()
+
+        # turns left on the large model, include of the running turn
+        self.escalated_turns = 0
+        # True after the turn starts (the first call or step), till end_turn
+        self.in_turn = False
+        # tool call keys of the recent turns
+        self.recent_keys = deque(maxlen=max(1, policy.max_repeat))
+        self.turn_keys = []
+
+        self.tiers = {
+            TIER_SMALL: TierStat(self.small_llm_model.model_name),
+            TIER_LARGE: TierStat(self.large_llm_model.model_name),
+        }
+        # key is reason, value is count
+        self.escalation_counts = {}
+
+    def new_small_llm_model(self) -> LLMModel:
+        """ the small model shares the settings of the large one, and its class (e.g. AsyncLLMModel) """
+        llm_model = type(self.large_llm_model)(model_name=self.policy.small_model)
+        llm_model.max_tokens = self.large_llm_model.max_tokens
+        llm_model.temperature = self.large_llm_model.temperature
+        llm_model.top_p = self.large_llm_model.top_p
+        llm_model.frequency_penalty = self.large_llm_model.frequency_penalty
+        llm_model.content_senders = self.large_llm_model.content_senders
+        # a broken response is escalated at once, not retried on the small model
+        llm_model.retry_policy = RetryPolicy.from_env()
+        llm_model.retry_policy.budgets.update({ERROR_JSON: 0, ERROR_EMPTY: 0})
+        return llm_model
+
+    def get_tier(self) -> str:
+        """ the tier of the next turn """
+        with self.rlock:
+            return TIER_LARGE if self.escalated_turns > 0 else TIER_SMALL
+
+    def get_llm_model(self, tier:str) -> LLMModel:
+        return self.small_llm_model if tier == TIER_SMALL else self.large_llm_model
+
+    def is_final(self, llm_model:LLMModel) -> bool:
+        """ True if the result of llm_model is never redone, so its steps can run before the stream ends.
+        The result of the small model may be escalated and redone, e.g. on a parse failure at the end.
+        """
+        return llm_model is self.large_llm_model
+
+    def escalate(self, reason:str=REASON_EXPLICIT, turns:int=None):
+        """ use the large model for the next turns, 0 for the running turn only.
+
+        The countdown starts with the next turn, the running turn is not counted.
+        """
+        if turns is None:
+            turns = self.policy.escalate_turns
+        with self.rlock:
+            # the running turn is counted down by end_turn
+            self.escalated_turns = max(self.escalated_turns, turns + 1 if self.in_turn else turns)
+            self.escalation_counts[reason] = self.escalation_counts.get(reason, 0) + 1
+        logger.info(f"cascade: escalated to {self.large_llm_model.model_name}, reason={reason}, turns={turns}")
+        return
+
+    def _call(self, tier:str, func):
+        stat = self.tiers[tier]
+        start_time = time.time()
+        try:
+            return func(self.get_llm_model(tier))
+        except Exception:
+            stat.failure_count += 1
+            raise
+        finally:
+            stat.request_count += 1
+            stat.seconds += time.time() - start_time
+
+    async def _acall(self, tier:str, afunc):
+        stat = self.tiers[tier]
+        start_time = time.time()
+        try:
+            return await afunc(self.get_llm_model(tier))
+        except Exception:
+            stat.failure_count += 1
+            raise
+        finally:
+            stat.request_count += 1
+            stat.seconds += time.time() - start_time
+
+    def need_escalation(self, response) -> str|None:
+        """ return the reason if the response of the small model is not trusted """
+        if not response:
+            return REASON_PARSE
+        for step in response:
+            if not isinstance(step, dict) or not step.get("step_name"):
+                return REASON_PARSE
+            if step["step_name"] in self.policy.escalate_step_names:
+                return REASON_STEP
+        return None
+
+    def call(self, func):
+        """ call func(llm_model) on the tier of this turn.
+
+        func returns a tuple, its second item is the steps of response.
+        A failed or untrusted result of the small model is redone by the large model.
+        """
+        self.in_turn = True
+        if self.get_tier() == TIER_SMALL:
+            reason = None
+            try:
+                result = self._call(TIER_SMALL, func)
+                reason = self.need_escalation(result[1])
+                if reason is None:
+                    return result
+            except Exception as e:
+                reason = self.get_failure_reason(e)
+            # redo this turn only
+            self.escalate(reason, turns=0)
+        return self._call(TIER_LARGE, func)
+
+    async def acall(self, afunc):
+        """ the coroutine of call, afunc(llm_model) is a coroutine function """
+        self.in_turn = True
+        if self.get_tier() == TIER_SMALL:
+            reason = None
+            try:
+                result = await self._acall(TIER_SMALL, afunc)
+                reason = self.need_escalation(result[1])
+                if reason is None:
+                    return result
+            except Exception as e:
+                reason = self.get_failure_reason(e)
+            # redo this turn only
+            self.escalate(reason, turns=0)
+        return await self._acall(TIER_LARGE, afunc)
+
+    def get_failure_reason(self, e:Exception) -> str:
+        """ the escalation reason of a failed call of the small model """
+        cause = e.__cause__ or e
+        logger.warning(f"cascade: the small model is failed: {e}")
+        return REASON_PARSE if classify_error(cause) in (ERROR_JSON, ERROR_EMPTY) else REASON_FAILURE
+
+    def on_step(self, tool_call_key:str|None, tool_error:bool=False):
+        """ feedback of a step of this turn """
+        self.in_turn = True
+        if tool_error and self.policy.escalate_on_tool_error:
+            self.escalate(REASON_TOOL_ERROR)
+        if tool_call_key:
+            self.turn_keys.append(tool_call_key)
+        return
+
+    def end_turn(self):
+        """ a turn is done, check the repeated steps """
+        with self.rlock:
+            if self.escalated_turns > 0:
+                self.escalated_turns -= 1
+            self.in_turn = False
+        key = "\n".join(self.turn_keys)
+        self.turn_keys = []
+        if not key or self.policy.max_repeat <= 0:
+            self.recent_keys.clear()
+            return
+        self.recent_keys.append(key)
+        if len(self.recent_keys) >= self.policy.max_repeat and len(set(self.recent_keys)) == 1:
+            self.recent_keys.clear()
+            self.escalate(REASON_REPEAT)
+        return
+
+    def get_stats(self) -> dict:
+        """ per-tier latency and tokens, and escalations """
+        with self.rlock:
+            return dict(
+                tiers={
+                    tier: stat.to_dict(self.get_llm_model(tier))
+                    for tier, stat in self.tiers.items()
+                },
+                escalation_counts=dict(self.escalation_counts),
+            )
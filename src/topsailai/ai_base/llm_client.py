@@ -0,0 +1,208 @@
+'''
+  Author: DawsonLin
+  Email: lin_dongsen@126.com
+  Created: 2026-10-17
+  Purpose: process-wide registry of openai clients with pooled keep-alive connections
+  Env:
+    @LLM_POOL_MAX_CONNECTIONS: int, max connections of one client;
+    @LLM_POOL_MAX_KEEPALIVE: int, max keep-alive connections of one client;
+    @LLM_POOL_KEEPALIVE_EXPIRY: float, seconds, idle keep-alive connection will be closed;
+    @LLM_HTTP2: 1 for enabled, it needs the package 'h2';
+'''
+
+import os
+import asyncio
+import weakref
+import threading
+import importlib.util
+
+import openai
+
+from topsailai.logger.log_chat import logger
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+
+DEFAULT_API_BASE = "https://api.openai.com/v1"
+
+
+class ClientStat(object):
+    """ counters of a shared client """
+    def __init__(self):
+        self.created_count = 0
+        self.reused_count = 0
+        self.request_count = 0
+
+    def to_dict(self) -> dict:
+        """ return dict """
+        return dict(
+            created_count=self.created_count,
+            reused_count=self.reused_count,
+            request_count=self.request_count,
+        )
+
+
+class ClientRegistry(object):
+    """ hand out shared clients keyed by (api_key, api_base).
+
+    All of LLMModel instances (include of nested agents) will reuse the warm connections.
+    """
+    def __init__(self):
+        self.rlock = threading.RLock()
+
+        # key is (api_key, api_base, is_async), value is client; the async ones out of event loop
+        self.clients = {}
+
+        # key is event loop, value is dict {(api_key, api_base): client}, an async client is bound to its loop
+        self.loop_clients = weakref.WeakKeyDictionary()
+
+        # key is (api_key, api_base, is_async), value is ClientStat
+        self.stats = {}
+
+    @staticmethod
+    def _get_running_loop():
+        try:
+            return asyncio.get_running_loop()
+        except RuntimeError:
+            return None
+
+    def _get_client_map(self, for_async:bool) -> dict:
+        """ the clients of this event loop for async, the closed loops are dropped """
+        loop = self._get_running_loop() if for_async else None
+        if loop is None:
+            return self.clients
+        for old_loop in list(self.loop_clients.keys()):
+            if old_loop.is_closed():
+                del self.loop_clients[old_loop]
+        return self.loop_clients.setdefault(loop, {})
+
+    def _get_limits(self):
+        """ return httpx.Limits or None for default """
+        if httpx is None:
+            return None
+
+        max_connections = os.getenv("LLM_POOL_MAX_CONNECTIONS")
+        max_keepalive = os.getenv("LLM_POOL_MAX_KEEPALIVE")
+        keepalive_expiry = os.getenv("LLM_POOL_KEEPALIVE_EXPIRY")
+        if not max_connections and not max_keepalive and not keepalive_expiry:
+            return None
+
+        return httpx.Limits(
+            max_connections=int(max_connections or 1000),
+            max_keepalive_connections=int(max_keepalive or 100),
+            keepalive_expiry=float(keepalive_expiry or 60),
+        )
+
+    @staticmethod
+    def _need_http2() -> bool:
+        """ HTTP/2 only if it is enabled and the package 'h2' is installed """
+        if os.getenv("LLM_HTTP2", "0") == "0":
+            return False
+        if importlib.util.find_spec("h2") is None:
+            logger.warning("LLM_HTTP2 is enabled, but no found the package 'h2'")
+            return False
+        return True
+
+    def _build_http_client(self, stat:ClientStat, for_async:bool):
+        """ return a http client with a tunable connection pool, None for default """
+        if httpx is None:
+            return None
+
+        kwargs = {}
+        limits = self._get_limits()
+        if limits is not None:
+            kwargs["limits"] = limits
+        if self._need_http2():
+            kwargs["http2"] = True
+
+        if for_async:
+            async def _hook_request(_):
+                with self.rlock:
+                    stat.request_count += 1
+            return openai.DefaultAsyncHttpxClient(
+                event_hooks={"request": [_hook_request]},
+                **kwargs
+            )
+
+        def _hook_request(_):
+            with self.rlock:
+                stat.request_count += 1
+        return openai.DefaultHttpxClient(
+            event_hooks={"request": [_hook_request]},
+            **kwargs
+        )
+
+    def get_client(self, api_key:str=None, api_base:str=None, for_async:bool=False, renew:bool=False):
+        """ return a shared object of openai.OpenAI or openai.AsyncOpenAI.
+
+        An async client is shared in the running event loop, so look it up for each request.
+
+        :renew: if True, drop the old client and create a new one.
+        """
+        api_key = api_key or os.getenv("OPENAI_API_KEY", "")
+        api_base = api_base or os.getenv("OPENAI_API_BASE", DEFAULT_API_BASE)
+        key = (api_key, api_base, for_async)
+
+        with self.rlock:
+            stat = self.stats.setdefault(key, ClientStat())
+            clients = self._get_client_map(for_async)
+            client = clients.get(key)
+            if client is not None and not renew:
+                stat.reused_count += 1
+                return client
+
+            client_cls = openai.AsyncOpenAI if for_async else openai.OpenAI
+            client = client_cls(
+                api_key=api_key,
+                base_url=api_base,
+                # the retries are owned by LLMModel.retry_policy
+                max_retries=0,
+                http_client=self._build_http_client(stat, for_async),
+            )
+            clients[key] = client
+            stat.created_count += 1
+            logger.info(f"new llm client: api_base={api_base}, async={for_async}, count={stat.created_count}")
+            return client
+
+    def get_stats(self) -> list[dict]:
+        """ return counters of all clients, api_key is masked """
+        result = []
+        with self.rlock:
+            for (api_key, api_base, is_async), stat in self.stats.items():
+                info = dict(
+                    api_key=api_key[:7],
+                    api_base=api_base,
+                    is_async=is_async,
+                )
+                info.update(stat.to_dict())
+                result.append(info)
+        return result
+
+    def clear(self):
+        """ drop all of clients, the connections will be closed when clients are released """
+        with self.rlock:
+            self.clients.clear()
+            self.loop_clients.clear()
+            self.stats.clear()
+        return
+
+
+# init
+ClientRegistryInstance = ClientRegistry()
+
+
+def get_chat_client(api_key:str=None, api_base:str=None, for_async:bool=False, renew:bool=False):
+    """ return the object of chat, `client.chat.completions` """
+    return ClientRegistryInstance.get_client(
+        api_key=api_key,
+        api_base=api_base,
+        for_async=for_async,
+        renew=renew,
+    ).chat.completions
+
+def get_client_stats() -> list[dict]:
+    """ return counters of shared clients for monitoring """
+    return ClientRegistryInstance.get_stats()
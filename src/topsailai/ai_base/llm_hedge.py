@@ -0,0 +1,257 @@
+'''
+  Author: DawsonLin
+  Email: lin_dongsen@126.com
+  Created: 2026-10-17
+  Purpose: hedged requests, send a duplicate to another endpoint if the first one is slow
+  Env:
+    @LLM_HEDGE: 1 for enabled, default is 0, it needs 2+ endpoints of MODEL_SETTINGS;
+    @LLM_HEDGE_PERCENTILE: default is 95, hedge after this percentile of recent latency;
+    @LLM_HEDGE_MAX_RATIO: default is 0.1, the cap of hedged requests / all requests;
+    @LLM_HEDGE_MIN_SAMPLES: default is 20, no hedge until there are enough latencies;
+'''
+
+import os
+import time
+import asyncio
+import functools
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from topsailai.logger.log_chat import logger
+
+
+class Hedger(object):
+    """ race a backup request against a slow one, the first response wins.
+
+    The delay of hedge is a percentile of recent latencies, so only the tail is duplicated,
+    and max_ratio caps the extra spend.
+    """
+    def __init__(
+            self,
+            percentile:float=95,
+            max_ratio:float=0.1,
+            min_samples:int=20,
+            window:int=200,
+            max_workers:int=32,
+            enabled:bool=True,
+        ):
+        self.enabled = enabled
+        self.percentile = percentile
+        self.max_ratio = max_ratio
+        self.min_samples = min_samples
+        self.rlock = threading.RLock()
+
+        # seconds of recent requests
+        self.latencies = deque(maxlen=window)
+
+        self.request_count = 0
+        self.hedged_count = 0
+        # the backup request is faster
+        self.hedge_win_count = 0
+        # the primary is slower than the delay, but hedging is refused by max_ratio
+        self.capped_count = 0
+
+        self.max_workers = max_workers
+        self._executor = None
+        # the requests in the pool, a request runs inline if the pool is busy
+        self.pooled_count = 0
+
+    @classmethod
+    def from_env(cls):
+        """ return a hedger by env """
+        return cls(
+            enabled=os.getenv("LLM_HEDGE", "0") != "0",
+            percentile=float(os.getenv("LLM_HEDGE_PERCENTILE", 95)),
+            max_ratio=float(os.getenv("LLM_HEDGE_MAX_RATIO", 0.1)),
+            min_samples=int(os.getenv("LLM_HEDGE_MIN_SAMPLES", 20)),
+        )
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        with self.rlock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="llm_hedge",
+                )
+            return self._executor
+
+    def record_latency(self, latency:float):
+        """ a request is done """
+        with self.rlock:
+            self.latencies.append(latency)
+
+    def get_hedge_delay(self) -> float|None:
+        """ seconds to wait before hedging, None if there are not enough samples """
+        with self.rlock:
+            if len(self.latencies) < max(1, self.min_samples):
+                return None
+            values = sorted(self.latencies)
+        index = min(len(values) - 1, int(len(values) * self.percentile / 100))
+        return values[index]
+
+    def has_budget(self) -> bool:
+        """ True if one more backup request is allowed by max_ratio, no counter is changed """
+        with self.rlock:
+            return self.hedged_count + 1 <= self.max_ratio * self.request_count
+
+    def acquire_hedge(self) -> bool:
+        """ True if a backup request is allowed by max_ratio, or else it is counted as capped """
+        with self.rlock:
+            if not self.has_budget():
+                self.capped_count += 1
+                return False
+            self.hedged_count += 1
+            return True
+
+    def acquire_pool(self) -> bool:
+        """ True if the pool has room for a request and its backup, release_pool after it """
+        with self.rlock:
+            if self.pooled_count + 2 > self.max_workers:
+                return False
+            self.pooled_count += 1
+            return True
+
+    def release_pool(self, *_):
+        with self.rlock:
+            self.pooled_count -= 1
+
+    def _on_latency(self, latency:float, capped_delay:float=None):
+        """ :capped_delay: hedging is refused by max_ratio, it is capped if the latency is over it """
+        self.record_latency(latency)
+        if capped_delay is not None and latency > capped_delay:
+            with self.rlock:
+                self.capped_count += 1
+        return
+
+    def _timed(self, func, capped_delay:float=None):
+        """ call func and record its latency """
+        start_time = time.time()
+        result = func()
+        self._on_latency(time.time() - start_time, capped_delay)
+        return result
+
+    async def _atimed(self, func, capped_delay:float=None):
+        start_time = time.time()
+        result = await func()
+        self._on_latency(time.time() - start_time, capped_delay)
+        return result
+
+    def _on_loser_done(self, on_loser, future):
+        """ the loser of call is done in the pool, its result is given to on_loser, e.g. for the usage """
+        if on_loser is None or future.cancelled() or future.exception() is not None:
+            return
+        try:
+            on_loser(future.result())
+        except Exception as e:
+            logger.warning(f"failed to handle the loser of hedged request: {e}")
+        return
+
+    def _on_winner(self, is_backup:bool):
+        if is_backup:
+            with self.rlock:
+                self.hedge_win_count += 1
+        logger.info(f"hedged request is done: backup_win={is_backup}, {self.to_dict()}")
+        return
+
+    def call(self, primary, backup, on_loser=None):
+        """ return the result of primary(), or backup() if primary is slow.
+
+        A blocking call can not be abandoned in this thread, so the primary goes to the pool
+        only if a hedge may fire: enough samples, budget of max_ratio and room of the pool.
+        Otherwise it runs inline. The loser cannot be interrupted, it is left to finish in the pool,
+        on_loser(result) is called if it succeeds, e.g. to record its usage.
+        """
+        with self.rlock:
+            self.request_count += 1
+        delay = self.get_hedge_delay()
+        if delay is None:
+            return self._timed(primary)
+        if not self.has_budget():
+            return self._timed(primary, capped_delay=delay)
+        if not self.acquire_pool():
+            return self._timed(primary)
+
+        primary_future = self.executor.submit(self._timed, primary)
+        primary_future.add_done_callback(self.release_pool)
+        done, _ = wait([primary_future], timeout=delay)
+        if done or not self.acquire_hedge():
+            return primary_future.result()
+
+        with self.rlock:
+            self.pooled_count += 1
+        backup_future = self.executor.submit(self._timed, backup)
+        backup_future.add_done_callback(self.release_pool)
+        futures = {primary_future, backup_future}
+        while futures:
+            done, futures = wait(futures, return_when=FIRST_COMPLETED)
+            for future in sorted(done, key=lambda x: x.exception() is not None):
+                if future.exception() is not None and futures:
+                    # the other one may still succeed
+                    continue
+                for other in futures:
+                    if not other.cancel():
+                        other.add_done_callback(functools.partial(self._on_loser_done, on_loser))
+                self._on_winner(future is backup_future)
+                return future.result()
+        # both are failed
+        return primary_future.result()
+
+    async def acall(self, primary, backup):
+        """ asyncio version of call, primary and backup are coroutine functions.
+
+        The loser is cancelled, its usage is unknown and it is not counted.
+        """
+        with self.rlock:
+            self.request_count += 1
+        delay = self.get_hedge_delay()
+        if delay is None:
+            return await self._atimed(primary)
+        if not self.has_budget():
+            return await self._atimed(primary, capped_delay=delay)
+
+        primary_task = asyncio.ensure_future(self._atimed(primary))
+        done, _ = await asyncio.wait([primary_task], timeout=delay)
+        if done or not self.acquire_hedge():
+            return await primary_task
+
+        backup_task = asyncio.ensure_future(self._atimed(backup))
+        tasks = {primary_task, backup_task}
+        while tasks:
+            done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in sorted(done, key=lambda x: x.exception() is not None):
+                if task.exception() is not None and tasks:
+                    continue
+                for other in tasks:
+                    other.cancel()
+                self._on_winner(task is backup_task)
+                return task.result()
+        return primary_task.result()
+
+    def to_dict(self) -> dict:
+        """ return stats for monitoring """
+        with self.rlock:
+            request_count = self.request_count
+            hedged_count = self.hedged_count
+            return dict(
+                request_count=request_count,
+                hedged_count=hedged_count,
+                hedge_rate=round(float(hedged_count) / request_count, 3) if request_count else 0.0,
+                hedge_win_count=self.hedge_win_count,
+                hedge_win_rate=round(float(self.hedge_win_count) / hedged_count, 3) if hedged_count else 0.0,
+                capped_count=self.capped_count,
+                hedge_delay=self.get_hedge_delay(),
+            )
+
+
+# init
+HedgerInstance = Hedger.from_env()
+
+
+def is_hedge_enabled() -> bool:
+    """ env LLM_HEDGE, it is read at import like the other settings of hedging """
+    return HedgerInstance.enabled
+
+def get_hedge_stats() -> dict:
+    """ return stats of hedged requests """
+    return HedgerInstance.to_dict()
@@ -0,0 +1,210 @@
+'''
+  Author: DawsonLin
+  Email: lin_dongsen@126.com
+  Created: 2026-10-17
+  Purpose: retry policy of chat, exponential backoff with jitter, Retry-After, budgets and deadline
+  Env:
+    @LLM_RETRY_MAX: int, default is 10, max retries of one chat;
+    @LLM_RETRY_BASE_DELAY: float, seconds, default is 2;
+    @LLM_RETRY_MAX_DELAY: float, seconds, default is 60;
+    @LLM_CHAT_DEADLINE: float, seconds, default is 0 (no deadline), the overall time of one chat;
+'''
+
+import os
+import time
+import random
+
+import openai
+
+from topsailai.ai_base.llm_router import get_retry_after
+
+
+# classes of errors
+ERROR_RATE_LIMIT = "rate_limit"
+ERROR_SERVER = "server"
+ERROR_CONNECTION = "connection"
+ERROR_JSON = "json"
+ERROR_EMPTY = "empty"
+ERROR_BAD_REQUEST = "bad_request"
+ERROR_PERMISSION = "permission"
+ERROR_CONTEXT_LENGTH = "context_length"
+ERROR_AUTHENTICATION = "authentication"
+ERROR_NOT_FOUND = "not_found"
+ERROR_UNKNOWN = "unknown"
+
+# max retries of each class, 0 for no retry
+DEFAULT_BUDGETS = {
+    ERROR_RATE_LIMIT: 10,
+    ERROR_SERVER: 6,
+    ERROR_CONNECTION: 6,
+    ERROR_JSON: 5,
+    ERROR_EMPTY: 5,
+    # some providers return it by chance, a retry usually resolves it
+    ERROR_BAD_REQUEST: 3,
+    ERROR_PERMISSION: 2,
+    ERROR_CONTEXT_LENGTH: 0,
+    ERROR_AUTHENTICATION: 0,
+    ERROR_NOT_FOUND: 0,
+    ERROR_UNKNOWN: 0,
+}
+
+# the messages of BadRequestError, the request can never succeed
+CONTEXT_LENGTH_KEYWORDS = (
+    "context_length_exceeded",
+    "context length",
+    "maximum context",
+    "context window",
+    "too many tokens",
+    "prompt is too long",
+)
+
+
+def is_context_length_error(e:Exception) -> bool:
+    """ True if the prompt exceeds the context window of model """
+    code = getattr(e, "code", None)
+    if code == "context_length_exceeded":
+        return True
+    message = str(e).lower()
+    for keyword in CONTEXT_LENGTH_KEYWORDS:
+        if keyword in message:
+            return True
+    return False
+
+def classify_error(e:Exception) -> str:
+    """ return the class of error """
+    retry_class = getattr(e, "retry_class", None)
+    if retry_class:
+        return retry_class
+    if isinstance(e, openai.RateLimitError):
+        return ERROR_RATE_LIMIT
+    if isinstance(e, openai.InternalServerError):
+        return ERROR_SERVER
+    if isinstance(e, openai.APIConnectionError):
+        # APITimeoutError is a subclass of APIConnectionError
+        return ERROR_CONNECTION
+    if isinstance(e, openai.AuthenticationError):
+        return ERROR_AUTHENTICATION
+    if isinstance(e, openai.PermissionDeniedError):
+        return ERROR_PERMISSION
+    if isinstance(e, openai.NotFoundError):
+        return ERROR_NOT_FOUND
+    if isinstance(e, openai.BadRequestError):
+        if is_context_length_error(e):
+            return ERROR_CONTEXT_LENGTH
+        return ERROR_BAD_REQUEST
+    if isinstance(e, openai.APIStatusError) and e.status_code >= 500:
+        return ERROR_SERVER
+    if isinstance(e, TypeError):
+        # null of response
+        return ERROR_EMPTY
+    return ERROR_UNKNOWN
+
+
+class RetryState(object):
+    """ the retries of one chat """
+    def __init__(self, policy, deadline:float=None):
+        """
+        :deadline: seconds from now, None or 0 for no deadline.
+        """
+        self.policy = policy
+        self.start_time = time.time()
+        self.deadline_time = self.start_time + deadline if deadline else None
+        self.retry_count = 0
+        # key is class of error, value is count
+        self.error_counts = {}
+        self.last_error_class = None
+
+    def get_remaining_seconds(self) -> float|None:
+        """ seconds to the deadline, None for no deadline """
+        if self.deadline_time is None:
+            return None
+        return max(0.0, self.deadline_time - time.time())
+
+    def get_error_count(self, error_class:str) -> int:
+        return self.error_counts.get(error_class, 0)
+
+    def next_delay(self, e:Exception) -> float|None:
+        """ record the error, return seconds to wait before the next try, None to give up """
+        error_class = classify_error(e)
+        self.last_error_class = error_class
+        self.error_counts[error_class] = self.error_counts.get(error_class, 0) + 1
+
+        if self.retry_count >= self.policy.max_retries:
+            return None
+        if self.error_counts[error_class] > self.policy.get_budget(error_class):
+            return None
+
+        delay = self.policy.get_delay(self.retry_count, e)
+        remaining = self.get_remaining_seconds()
+        if remaining is not None and delay >= remaining:
+            return None
+
+        self.retry_count += 1
+        return delay
+
+
+class RetryPolicy(object):
+    """ when and how long to wait for the next try of chat.
+
+    Subclass it or give budgets to change the behaviour, see LLMModel.retry_policy.
+    """
+    def __init__(
+            self,
+            max_retries:int=10,
+            base_delay:float=2.0,
+            max_delay:float=60.0,
+            jitter:float=0.5,
+            budgets:dict=None,
+        ):
+        """
+        :max_retries: the total retries of one chat;
+        :base_delay: seconds of the first retry, it is doubled for each retry;
+        :max_delay: the cap of delay, include of Retry-After;
+        :jitter: 0.0 ~ 1.0, the delay is random in [delay*(1-jitter), delay];
+        :budgets: dict, max retries of each class of errors, see DEFAULT_BUDGETS.
+        """
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.budgets = dict(DEFAULT_BUDGETS)
+        if budgets:
+            self.budgets.update(budgets)
+
+    @classmethod
+    def from_env(cls):
+        """ return a policy by env """
+        return cls(
+            max_retries=int(os.getenv("LLM_RETRY_MAX", 10)),
+            base_delay=float(os.getenv("LLM_RETRY_BASE_DELAY", 2.0)),
+            max_delay=float(os.getenv("LLM_RETRY_MAX_DELAY", 60.0)),
+        )
+
+    def get_budget(self, error_class:str) -> int:
+        return self.budgets.get(error_class, 0)
+
+    def is_retryable(self, e:Exception) -> bool:
+        """ False if the error can never succeed by retry """
+        return self.get_budget(classify_error(e)) > 0
+
+    def get_delay(self, retry_count:int, e:Exception=None) -> float:
+        """ return seconds before the retry, Retry-After of server first """
+        if e is not None:
+            retry_after = get_retry_after(e)
+            if retry_after is not None:
+                return min(retry_after, self.max_delay)
+
+        delay = min(self.max_delay, self.base_delay * (2 ** retry_count))
+        if self.jitter > 0:
+            delay = random.uniform(delay * (1 - self.jitter), delay)
+        return delay
+
+    def new_state(self, deadline:float=None) -> RetryState:
+        """ for one chat """
+        return RetryState(self, deadline=deadline)
+
+
+def get_chat_deadline() -> float|None:
+    """ env LLM_CHAT_DEADLINE, None for no deadline """
+    deadline = float(os.getenv("LLM_CHAT_DEADLINE", 0) or 0)
+    return deadline if deadline > 0 else None
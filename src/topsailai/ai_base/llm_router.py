@@ -0,0 +1,435 @@
+'''
+  Author: DawsonLin
+  Email: lin_dongsen@126.com
+  Created: 2026-10-17
+  Purpose: route requests to the healthiest endpoint of MODEL_SETTINGS
+  Env:
+    @LLM_ROUTING_MODE: health (default), sticky or random;
+      sticky: the same session keeps the same endpoint to hit the prefix cache of provider, failover only on errors;
+'''
+
+import os
+import time
+import random
+import asyncio
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager, asynccontextmanager
+
+import openai
+
+from topsailai.logger.log_chat import logger
+from topsailai.context.token import parse_usage
+
+
+ROUTING_MODE_HEALTH = "health"
+ROUTING_MODE_RANDOM = "random"
+ROUTING_MODE_STICKY = "sticky"
+
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_OPEN = "open"
+CIRCUIT_HALF_OPEN = "half_open"
+
+
+def get_routing_mode() -> str:
+    """ return routing mode from env """
+    return os.getenv("LLM_ROUTING_MODE", ROUTING_MODE_HEALTH).strip().lower() or ROUTING_MODE_HEALTH
+
+def get_endpoint_key(model_config:dict) -> tuple:
+    """ return (api_key, api_base) """
+    return (model_config.get("api_key") or "", model_config.get("api_base") or "")
+
+def get_retry_after(e:Exception) -> float|None:
+    """ return seconds from the header 'Retry-After' of the error, None if no found """
+    response = getattr(e, "response", None)
+    if response is None:
+        return None
+    try:
+        value = response.headers.get("retry-after-ms")
+        if value:
+            return max(0.0, float(value) / 1000)
+        value = response.headers.get("retry-after")
+        if value:
+            return max(0.0, float(value))
+    except Exception:
+        pass
+    return None
+
+def is_endpoint_error(e:Exception) -> bool:
+    """ True if the error is about the health of endpoint """
+    if isinstance(e, (openai.RateLimitError, openai.InternalServerError, openai.APIConnectionError)):
+        return True
+    if isinstance(e, openai.APIStatusError) and e.status_code >= 500:
+        return True
+    return False
+
+
+class EndpointStat(object):
+    """ health of one endpoint """
+
+    # variables
+    ewma_alpha = 0.3
+    failure_threshold = 5
+    circuit_open_seconds = 30
+    rate_limit_cooldown = 10
+
+    def __init__(self, key:tuple):
+        self.key = key
+
+        # EWMA of latency (seconds), 0 for unknown
+        self.ewma_latency = 0.0
+        # EWMA of error, 0.0 ~ 1.0
+        self.error_rate = 0.0
+
+        self.request_count = 0
+        self.error_count = 0
+        self.rate_limit_count = 0
+        self.inflight_count = 0
+
+        # circuit breaker
+        self.consecutive_failures = 0
+        self.circuit_state = CIRCUIT_CLOSED
+        self.circuit_opened_at = 0
+        # timestamp, the probe of half open is in flight until it, no other request is sent
+        self.probe_until = 0
+
+        # timestamp, no request before it
+        self.cooldown_until = 0
+
+        # prompt cache of provider
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+
+    @property
+    def cache_hit_rate(self) -> float:
+        """ cached_tokens / prompt_tokens """
+        if self.prompt_tokens <= 0:
+            return 0.0
+        return float(self.cached_tokens) / self.prompt_tokens
+
+    def on_usage(self, usage:dict):
+        """ update stat by the usage of response """
+        self.prompt_tokens += usage["prompt_tokens"]
+        self.cached_tokens += usage["cached_tokens"]
+        return
+
+    def _update_error_rate(self, value:float):
+        self.error_rate = self.ewma_alpha * value + (1 - self.ewma_alpha) * self.error_rate
+
+    def on_success(self, latency:float):
+        """ update stat for a success request """
+        self.request_count += 1
+        if self.ewma_latency <= 0:
+            self.ewma_latency = latency
+        else:
+            self.ewma_latency = self.ewma_alpha * latency + (1 - self.ewma_alpha) * self.ewma_latency
+        self._update_error_rate(0.0)
+        self.consecutive_failures = 0
+        self.circuit_state = CIRCUIT_CLOSED
+        self.probe_until = 0
+        return
+
+    def on_failure(self, e:Exception):
+        """ update stat for a failed request """
+        now_ts = time.time()
+        self.request_count += 1
+        self.error_count += 1
+        self._update_error_rate(1.0)
+        self.consecutive_failures += 1
+
+        if isinstance(e, openai.RateLimitError):
+            self.rate_limit_count += 1
+            cooldown = get_retry_after(e)
+            if cooldown is None:
+                cooldown = self.rate_limit_cooldown
+            self.cooldown_until = max(self.cooldown_until, now_ts + cooldown)
+
+        if self.circuit_state == CIRCUIT_HALF_OPEN \
+            or self.consecutive_failures >= self.failure_threshold:
+            if self.circuit_state != CIRCUIT_OPEN:
+                logger.warning(f"circuit is open: api_base={self.key[1]}, failures={self.consecutive_failures}")
+            self.circuit_state = CIRCUIT_OPEN
+            self.circuit_opened_at = now_ts
+            self.probe_until = 0
+        return
+
+    def is_available(self, now_ts:float) -> bool:
+        """ True if the endpoint can accept a request now, no side effect """
+        if self.cooldown_until > now_ts:
+            return False
+        if self.circuit_state == CIRCUIT_OPEN \
+            and now_ts - self.circuit_opened_at < self.circuit_open_seconds:
+            return False
+        if self.circuit_state != CIRCUIT_CLOSED and self.probe_until > now_ts:
+            # the probe is in flight
+            return False
+        return True
+
+    def on_selected(self, now_ts:float):
+        """ the endpoint is chosen for a request, it is the only probe if the circuit is not closed """
+        if self.circuit_state == CIRCUIT_CLOSED or not self.is_available(now_ts):
+            return
+        if self.circuit_state == CIRCUIT_OPEN:
+            logger.info(f"circuit is half open: api_base={self.key[1]}")
+            self.circuit_state = CIRCUIT_HALF_OPEN
+        # the probe is released by its result, or after a while if the result is not an endpoint error
+        self.probe_until = now_ts + self.circuit_open_seconds
+        return
+
+    def get_available_time(self) -> float:
+        """ return timestamp when the endpoint becomes available """
+        available_time = self.cooldown_until
+        if self.circuit_state == CIRCUIT_OPEN:
+            available_time = max(available_time, self.circuit_opened_at + self.circuit_open_seconds)
+        return available_time
+
+    @property
+    def score(self) -> float:
+        """ lower is better """
+        return self.ewma_latency * (1 + 10 * self.error_rate) * (1 + self.inflight_count)
+
+    def to_dict(self) -> dict:
+        """ return dict, api_key is masked """
+        return dict(
+            api_key=self.key[0][:7],
+            api_base=self.key[1],
+            ewma_latency=round(self.ewma_latency, 3),
+            error_rate=round(self.error_rate, 3),
+            request_count=self.request_count,
+            error_count=self.error_count,
+            rate_limit_count=self.rate_limit_count,
+            inflight_count=self.inflight_count,
+            circuit_state=self.circuit_state,
+            cooldown_seconds=round(max(0, self.cooldown_until - time.time()), 3),
+            prompt_tokens=self.prompt_tokens,
+            cached_tokens=self.cached_tokens,
+            cache_hit_rate=round(self.cache_hit_rate, 3),
+        )
+
+
+class EndpointRouter(object):
+    """ choose the healthiest endpoint by EWMA latency, error rate, cooldown and circuit breaker.
+
+    The stats are shared in this process, so all of LLMModel instances learn from each other.
+    """
+    def __init__(self, explore_ratio:float=0.05, max_affinity_count:int=10000):
+        """
+        :explore_ratio: the chance to pick a random available endpoint, it keeps stats fresh.
+        :max_affinity_count: the max count of sessions for sticky mode, the oldest one is dropped.
+        """
+        self.explore_ratio = explore_ratio
+        self.max_affinity_count = max_affinity_count
+        self.rlock = threading.RLock()
+
+        # key is (api_key, api_base), value is EndpointStat
+        self.stats = {}
+
+        # key is affinity_key (e.g. session_id), value is (api_key, api_base)
+        self.affinity = OrderedDict()
+
+        # sticky mode
+        self.sticky_hit_count = 0
+        self.sticky_miss_count = 0
+
+    def get_stat(self, model_config:dict) -> EndpointStat:
+        """ return EndpointStat """
+        key = get_endpoint_key(model_config)
+        with self.rlock:
+            stat = self.stats.get(key)
+            if stat is None:
+                stat = EndpointStat(key)
+                self.stats[key] = stat
+            return stat
+
+    def choose(self, model_configs:list[dict], mode:str=None, affinity_key:str=None) -> dict:
+        """ return one of model_configs
+
+        :affinity_key: for sticky mode, e.g. session_id.
+        """
+        assert model_configs, "no endpoint to choose"
+        if len(model_configs) == 1:
+            return model_configs[0]
+
+        mode = mode or get_routing_mode()
+        if mode == ROUTING_MODE_RANDOM:
+            return random.choice(model_configs)
+
+        if mode == ROUTING_MODE_STICKY and affinity_key:
+            return self._choose_sticky(model_configs, affinity_key)
+
+        return self._choose_healthiest(model_configs)
+
+    def _choose_sticky(self, model_configs:list[dict], affinity_key:str) -> dict:
+        """ keep the same endpoint for the affinity_key until it is failed """
+        now_ts = time.time()
+        with self.rlock:
+            endpoint_key = self.affinity.get(affinity_key)
+            if endpoint_key:
+                for model_config in model_configs:
+                    if get_endpoint_key(model_config) != endpoint_key:
+                        continue
+                    if self.get_stat(model_config).is_available(now_ts):
+                        self.affinity.move_to_end(affinity_key)
+                        self.sticky_hit_count += 1
+                        return self._select(model_config, now_ts)
+                    break
+
+            self.sticky_miss_count += 1
+            model_config = self._choose_healthiest(model_configs)
+            self.affinity[affinity_key] = get_endpoint_key(model_config)
+            self.affinity.move_to_end(affinity_key)
+            while len(self.affinity) > self.max_affinity_count:
+                self.affinity.popitem(last=False)
+            return model_config
+
+    def unbind(self, affinity_key:str):
+        """ the affinity_key will choose a new endpoint next time """
+        with self.rlock:
+            self.affinity.pop(affinity_key, None)
+
+    def _select(self, model_config:dict, now_ts:float) -> dict:
+        """ the endpoint is chosen, e.g. a circuit of open turns to half open for one probe """
+        with self.rlock:
+            self.get_stat(model_config).on_selected(now_ts)
+        return model_config
+
+    def _choose_healthiest(self, model_configs:list[dict]) -> dict:
+        """ return the endpoint with the best score """
+        now_ts = time.time()
+        with self.rlock:
+            candidates = [
+                model_config for model_config in model_configs
+                if self.get_stat(model_config).is_available(now_ts)
+            ]
+            if not candidates:
+                # all of endpoints are unavailable, choose the one which recovers first
+                return min(model_configs, key=lambda x: self.get_stat(x).get_available_time())
+
+            # unknown endpoint first
+            for model_config in candidates:
+                if self.get_stat(model_config).request_count == 0:
+                    return self._select(model_config, now_ts)
+
+            if self.explore_ratio > 0 and random.random() < self.explore_ratio:
+                return self._select(random.choice(candidates), now_ts)
+
+            return self._select(min(candidates, key=lambda x: self.get_stat(x).score), now_ts)
+
+    def report_success(self, model_config:dict, latency:float):
+        """ a request is done """
+        with self.rlock:
+            self.get_stat(model_config).on_success(latency)
+
+    def report_failure(self, model_config:dict, e:Exception):
+        """ a request is failed """
+        if not is_endpoint_error(e):
+            return
+        with self.rlock:
+            self.get_stat(model_config).on_failure(e)
+
+    def report_usage(self, model_config:dict, usage):
+        """ record prompt/cached tokens from the usage of response """
+        usage = parse_usage(usage)
+        if not usage:
+            return
+        with self.rlock:
+            self.get_stat(model_config).on_usage(usage)
+
+    @contextmanager
+    def ctxm_track(self, model_config:dict, affinity_key:str=None):
+        """ track latency and errors of a request to this endpoint.
+
+        :affinity_key: it will be unbound if the endpoint is failed.
+        """
+        stat = self.get_stat(model_config)
+        with self.rlock:
+            stat.inflight_count += 1
+        start_time = time.time()
+        try:
+            yield
+        except Exception as e:
+            self.report_failure(model_config, e)
+            if affinity_key and is_endpoint_error(e):
+                self.unbind(affinity_key)
+            raise
+        else:
+            self.report_success(model_config, time.time() - start_time)
+        finally:
+            with self.rlock:
+                stat.inflight_count -= 1
+        return
+
+    def get_stats(self) -> list[dict]:
+        """ return per-endpoint stats for monitoring """
+        with self.rlock:
+            return [stat.to_dict() for stat in self.stats.values()]
+
+    def get_cache_stats(self) -> dict:
+        """ return stats of sticky routing and prompt cache """
+        with self.rlock:
+            prompt_tokens = sum(stat.prompt_tokens for stat in self.stats.values())
+            cached_tokens = sum(stat.cached_tokens for stat in self.stats.values())
+            return dict(
+                sticky_hit_count=self.sticky_hit_count,
+                sticky_miss_count=self.sticky_miss_count,
+                affinity_count=len(self.affinity),
+                prompt_tokens=prompt_tokens,
+                cached_tokens=cached_tokens,
+                cache_hit_rate=round(float(cached_tokens) / prompt_tokens, 3) if prompt_tokens else 0.0,
+            )
+
+
+class EndpointLimiter(object):
+    """ limit the in-flight requests of each endpoint, e.g. for a batch of chats """
+    def __init__(self, max_count:int):
+        """
+        :max_count: max in-flight requests of one endpoint, 0 for no limit.
+        """
+        self.max_count = max_count
+        self.rlock = threading.RLock()
+
+        # key is (api_key, api_base), value is threading.Semaphore or asyncio.Semaphore
+        self.semaphores = {}
+        self.async_semaphores = {}
+
+    def _get_semaphore(self, semaphores:dict, model_config:dict, semaphore_cls):
+        key = get_endpoint_key(model_config)
+        with self.rlock:
+            semaphore = semaphores.get(key)
+            if semaphore is None:
+                semaphore = semaphore_cls(self.max_count)
+                semaphores[key] = semaphore
+            return semaphore
+
+    @contextmanager
+    def ctxm_acquire(self, model_config:dict):
+        """ block until the endpoint has a free slot """
+        if self.max_count <= 0:
+            yield
+            return
+        with self._get_semaphore(self.semaphores, model_config, threading.Semaphore):
+            yield
+        return
+
+    @asynccontextmanager
+    async def actxm_acquire(self, model_config:dict):
+        """ asyncio version of ctxm_acquire """
+        if self.max_count <= 0:
+            yield
+            return
+        async with self._get_semaphore(self.async_semaphores, model_config, asyncio.Semaphore):
+            yield
+        return
+
+
+# init
+RouterInstance = EndpointRouter()
+
+
+def get_endpoint_stats() -> list[dict]:
+    """ return per-endpoint stats for monitoring """
+    return RouterInstance.get_stats()
+
+def get_cache_stats() -> dict:
+    """ return stats of sticky routing and prompt cache """
+    return RouterInstance.get_cache_stats()
@@ -0,0 +1,223 @@
+'''
+  Author: DawsonLin
+  Email: lin_dongsen@126.com
+  Created: 2026-10-17
+  Purpose: structured output (response_format) for the steps of agent, and the stats of parsing
+  Env:
+    @LLM_STRUCTURED_OUTPUT: 0 (default, disabled), auto, json_schema or json_object;
+      auto: json_schema first, it falls back per endpoint if the endpoint rejects it;
+      a 400/422 without a known message is retried once without response_format,
+      the endpoint drops response_format if the retry works for MAX_GENERIC_REJECTIONS times in a row;
+'''
+
+import os
+import threading
+
+import openai
+
+from topsailai.logger.log_chat import logger
+from topsailai.ai_base.llm_router import get_endpoint_key
+
+
+# levels of structured output, from the strictest
+LEVEL_JSON_SCHEMA = "json_schema"
+LEVEL_JSON_OBJECT = "json_object"
+LEVEL_NONE = ""
+LEVELS = (LEVEL_JSON_SCHEMA, LEVEL_JSON_OBJECT, LEVEL_NONE)
+
+# the steps are wrapped in an object, a json object is required by response_format
+STEPS_KEY = "steps"
+STEPS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        STEPS_KEY: {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "step_name": {"type": "string"},
+                    "raw_text": {"type": "string"},
+                    "tool_call": {"type": "string"},
+                    "tool_args": {"type": "object"},
+                },
+                "required": ["step_name"],
+            },
+        },
+    },
+    "required": [STEPS_KEY],
+}
+
+# the messages of BadRequestError when response_format is not supported
+UNSUPPORTED_KEYWORDS = (
+    "response_format",
+    "json_schema",
+    "json_object",
+    "structured output",
+)
+
+# a 400/422 without a known message may be a bad request of other reasons,
+# the endpoint drops response_format after these rejections in a row
+MAX_GENERIC_REJECTIONS = 3
+
+# reasons of parse failures
+PARSE_NULL = "null"
+PARSE_INVALID_JSON = "invalid_json"
+
+
+def get_structured_mode() -> str:
+    """ env LLM_STRUCTURED_OUTPUT, LEVEL_NONE if it is disabled (default) """
+    mode = os.getenv("LLM_STRUCTURED_OUTPUT", "0").strip().lower()
+    if mode in ("0", "", "none", "off"):
+        return LEVEL_NONE
+    if mode in (LEVEL_JSON_SCHEMA, LEVEL_JSON_OBJECT):
+        return mode
+    return LEVEL_JSON_SCHEMA
+
+def get_response_format(level:str) -> dict|None:
+    """ return the parameter response_format of chat """
+    if level == LEVEL_JSON_SCHEMA:
+        return {
+            "type": "json_schema",
+            "json_schema": {"name": "agent_steps", "schema": STEPS_SCHEMA, "strict": False},
+        }
+    if level == LEVEL_JSON_OBJECT:
+        return {"type": "json_object"}
+    return None
+
+def unwrap_steps(obj):
+    """ {"steps": [...]} -> [...], other objects are returned as they are
+
+    A json object is required by response_format, the model may choose another key in json_object mode.
+    It is only for the responses of structured requests.
+    """
+    if not isinstance(obj, dict) or "step_name" in obj:
+        return obj
+    if isinstance(obj.get(STEPS_KEY), list):
+        return obj[STEPS_KEY]
+    if len(obj) == 1:
+        value = list(obj.values())[0]
+        if isinstance(value, list):
+            return value
+    return obj
+
+def is_unsupported_error(e:Exception) -> bool:
+    """ True if the endpoint rejects response_format """
+    if not isinstance(e, (openai.BadRequestError, openai.UnprocessableEntityError)):
+        return False
+    message = str(e).lower()
+    for keyword in UNSUPPORTED_KEYWORDS:
+        if keyword in message:
+            return True
+    return False
+
+
+class StructuredOutputRegistry(object):
+    """ the supported level of structured output of each endpoint, it is learned from errors """
+    def __init__(self):
+        self.rlock = threading.RLock()
+        # key is (api_key, api_base), value is level
+        self.levels = {}
+        # key is (api_key, api_base), value is count of the generic rejections in a row
+        self.rejection_counts = {}
+
+    def get_level(self, model_config:dict, max_level:str) -> str:
+        """ return the level to use for the endpoint """
+        if max_level == LEVEL_NONE:
+            return LEVEL_NONE
+        with self.rlock:
+            level = self.levels.get(get_endpoint_key(model_config), max_level)
+        # the lower one of them
+        return LEVELS[max(LEVELS.index(level), LEVELS.index(max_level))]
+
+    def downgrade(self, model_config:dict, level:str, next_level:str=None) -> str:
+        """ the level is rejected by the endpoint, return the next level """
+        if next_level is None:
+            next_level = LEVELS[min(len(LEVELS) - 1, LEVELS.index(level) + 1)]
+        key = get_endpoint_key(model_config)
+        with self.rlock:
+            self.levels[key] = next_level
+        logger.warning(f"structured output is downgraded: api_base={key[1]}, {level or None} -> {next_level or None}")
+        return next_level
+
+    def add_rejection(self, model_config:dict, level:str) -> str:
+        """ the level is rejected without a known message, and the retry without response_format works.
+
+        return the level for the endpoint, it is LEVEL_NONE after MAX_GENERIC_REJECTIONS in a row.
+        """
+        key = get_endpoint_key(model_config)
+        with self.rlock:
+            count = self.rejection_counts.get(key, 0) + 1
+            self.rejection_counts[key] = count
+        if count < MAX_GENERIC_REJECTIONS:
+            logger.warning(f"structured output is rejected: api_base={key[1]}, {level}, count={count}")
+            return level
+        return self.downgrade(model_config, level, LEVEL_NONE)
+
+    def add_accepted(self, model_config:dict):
+        """ the endpoint accepts response_format """
+        with self.rlock:
+            self.rejection_counts.pop(get_endpoint_key(model_config), None)
+
+    def clear(self):
+        with self.rlock:
+            self.levels.clear()
+            self.rejection_counts.clear()
+
+
+class ParseStat(object):
+    """ counters of parsing the responses """
+    def __init__(self):
+        self.rlock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        with self.rlock:
+            # requests with response_format
+            self.structured_count = 0
+            # parsed as it is
+            self.clean_count = 0
+            # parsed after fixing the mistakes of LLM
+            self.repaired_count = 0
+            # key is reason, value is count
+            self.failure_counts = {}
+            # key is reason, value is count of the retried calls
+            self.retry_counts = {}
+
+    def add_structured(self):
+        with self.rlock:
+            self.structured_count += 1
+
+    def add_parsed(self, repaired:bool):
+        with self.rlock:
+            if repaired:
+                self.repaired_count += 1
+            else:
+                self.clean_count += 1
+
+    def add_failure(self, reason:str):
+        with self.rlock:
+            self.failure_counts[reason] = self.failure_counts.get(reason, 0) + 1
+
+    def add_retry(self, reason:str):
+        with self.rlock:
+            self.retry_counts[reason] = self.retry_counts.get(reason, 0) + 1
+
+    def to_dict(self) -> dict:
+        with self.rlock:
+            return dict(
+                structured_count=self.structured_count,
+                clean_count=self.clean_count,
+                repaired_count=self.repaired_count,
+                failure_counts=dict(self.failure_counts),
+                retry_counts=dict(self.retry_counts),
+            )
+
+
+# init
+StructuredOutputRegistryInstance = StructuredOutputRegistry()
+ParseStatInstance = ParseStat()
+
+
+def get_parse_stats() -> dict:
+    """ return the counters of parsing, include of the retries by parse failures """
+    return ParseStatInstance.to_dict()
@@ -0,0 +1,391 @@
+'''
+  Author: DawsonLin
+  Email: lin_dongsen@126.com
+  Created: 2026-10-17
+  Purpose: offline OpenAI-compatible stub server, it replays recorded responses for benchmarking.
+
+  Example:
+    server = StubLLMServer(load_recorded_responses("dump.AgentReAct.xxx.msg"), StubConfig(latency=0.2))
+    server.start()
+    os.environ["OPENAI_API_BASE"] = server.base_url
+    ...
+    server.stop()
+'''
+
+import os
+import time
+import random
+import threading
+from collections import deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import simplejson
+
+from topsailai.logger.log_chat import logger
+from topsailai.ai_base.constants import ROLE_ASSISTANT
+from topsailai.utils.json_tool import json_load, to_json_str
+
+
+ERROR_RATE_LIMIT = "rate_limit"
+ERROR_INTERNAL_SERVER = "internal_server"
+
+
+def load_recorded_responses(file_path:str) -> list[str]:
+    """ read the assistant contents from a file of PromptBase.dump_messages, in order """
+    with open(file_path, encoding="utf-8") as fd:
+        messages = json_load(fd.read())
+
+    result = []
+    for msg in messages:
+        if msg.get("role") != ROLE_ASSISTANT:
+            continue
+        content = msg.get("content")
+        if not content:
+            continue
+        if not isinstance(content, str):
+            content = to_json_str(content)
+        result.append(content)
+    return result
+
+
+class StubConfig(object):
+    """ behavior of the stub server """
+    def __init__(
+            self,
+            latency:float=0.0,
+            tokens_per_second:float=0.0,
+            rate_limit_ratio:float=0.0,
+            server_error_ratio:float=0.0,
+            errors:list=None,
+            retry_after:int=1,
+            seed:int=None,
+            prefix_cache:bool=True,
+            response_format:bool=True,
+            stop:bool=True,
+        ):
+        """
+        :latency: seconds, before the first byte;
+        :tokens_per_second: speed of output, 0 for no limit;
+        :rate_limit_ratio: 0.0 ~ 1.0, chance of 429 (RateLimitError);
+        :server_error_ratio: 0.0 ~ 1.0, chance of 500 (InternalServerError);
+        :errors: list, a fixed sequence of injected errors for the first requests,
+            item is ERROR_RATE_LIMIT, ERROR_INTERNAL_SERVER or None (no error);
+        :retry_after: seconds, the header 'Retry-After' of 429;
+        :seed: for random errors;
+        :prefix_cache: simulate the prefix cache of provider, the usage has cached_tokens;
+        :response_format: support response_format (json steps are wrapped in {"steps": [...]}),
+            False to reject it with 400 like the old servers;
+        :stop: support the parameter stop, False to reject it with 400 like the reasoning models (e.g. o1).
+        """
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.rate_limit_ratio = rate_limit_ratio
+        self.server_error_ratio = server_error_ratio
+        self.errors = list(errors or [])
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.prefix_cache = prefix_cache
+        self.response_format = response_format
+        self.stop = stop
+
+
+class StubStat(object):
+    """ counters of the stub server """
+    def __init__(self):
+        self.request_count = 0
+        self.stream_count = 0
+        self.rate_limit_count = 0
+        self.server_error_count = 0
+        self.completion_tokens = 0
+
+        # requests with response_format, and the rejected ones
+        self.structured_count = 0
+        self.rejected_count = 0
+
+        # the prefix cache
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+
+        # saved by the stop sequences of request, and the rejected requests with stop
+        self.stop_rejected_count = 0
+        self.stopped_count = 0
+        self.stopped_tokens = 0
+
+        # the client closes the stream early
+        self.aborted_count = 0
+        self.unsent_tokens = 0
+
+    def to_dict(self) -> dict:
+        return dict(self.__dict__)
+
+
+def split_tokens(content:str, token_size:int=4) -> list[str]:
+    """ split content into pieces, about 4 chars for one token """
+    return [content[i:i+token_size] for i in range(0, len(content), token_size)] or [""]
+
+
+class StubLLMServer(object):
+    """ OpenAI-compatible stand-in for /v1/chat/completions, streaming and non-streaming.
+
+    The response of a request is chosen by the count of assistant messages in the request,
+    so every agent (session) replays the recording from its own beginning.
+    """
+    def __init__(self, responses:list[str], config:StubConfig=None, host:str="127.0.0.1", port:int=0):
+        assert responses, "missing responses"
+        self.responses = responses
+        self.config = config or StubConfig()
+        self.stat = StubStat()
+        self.rlock = threading.RLock()
+
+        # the recent prompts for the prefix cache
+        self.recent_prompts = deque(maxlen=16)
+
+        self.httpd = ThreadingHTTPServer((host, port), self._build_handler())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        """ serve in a background thread """
+        self.thread = threading.Thread(
+            target=self.httpd.serve_forever, name="StubLLMServer", daemon=True,
+        )
+        self.thread.start()
+        logger.info(f"stub llm server is running: {self.base_url}")
+        return self
+
+    def stop(self):
+        """ shutdown the server """
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self.thread:
+            self.thread.join()
+        return
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *_):
+        self.stop()
+
+    def choose_response(self, messages:list) -> str:
+        """ the n-th assistant turn gets the n-th recorded response """
+        turn = sum(1 for msg in messages if msg.get("role") == ROLE_ASSISTANT)
+        return self.responses[turn % len(self.responses)]
+
+    def choose_error(self) -> str|None:
+        """ return the injected error for this request """
+        with self.rlock:
+            if self.config.errors:
+                return self.config.errors.pop(0)
+            value = self.config.random.random()
+        if value < self.config.rate_limit_ratio:
+            return ERROR_RATE_LIMIT
+        if value < self.config.rate_limit_ratio + self.config.server_error_ratio:
+            return ERROR_INTERNAL_SERVER
+        return None
+
+    def get_cached_tokens(self, prompt:str) -> int:
+        """ tokens of the longest common prefix with a recent prompt """
+        if not self.config.prefix_cache:
+            return 0
+        with self.rlock:
+            recent_prompts = list(self.recent_prompts)
+            self.recent_prompts.append(prompt)
+        prefix_len = 0
+        for recent_prompt in recent_prompts:
+            prefix_len = max(prefix_len, len(os.path.commonprefix([prompt, recent_prompt])))
+        return prefix_len // 4
+
+    def apply_response_format(self, content:str, response_format:dict) -> str:
+        """ a json object is required by response_format, the steps are wrapped """
+        if not response_format:
+            return content
+        try:
+            obj = simplejson.loads(content)
+        except Exception:
+            return content
+        if isinstance(obj, list):
+            return simplejson.dumps({"steps": obj}, ensure_ascii=False)
+        return content
+
+    def apply_stop(self, content:str, stop) -> str:
+        """ cut the content at the first stop sequence, like the real server """
+        if not stop:
+            return content
+        if isinstance(stop, str):
+            stop = [stop]
+        positions = [content.find(x) for x in stop if x and x in content]
+        if not positions:
+            return content
+        new_content = content[:min(positions)]
+        with self.rlock:
+            self.stat.stopped_count += 1
+            self.stat.stopped_tokens += len(split_tokens(content)) - len(split_tokens(new_content))
+        return new_content
+
+    def _build_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # headers and body are written separately, no delayed ACK of Nagle
+            disable_nagle_algorithm = True
+
+            def log_message(self, *_):
+                return
+
+            def _send_json(self, code:int, data:dict, headers:dict=None):
+                body = simplejson.dumps(data).encode("utf-8")
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for k, v in (headers or {}).items():
+                    self.send_header(k, str(v))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self._send_json(404, {"error": {"message": f"no found {self.path}"}})
+                    return
+                length = int(self.headers.get("Content-Length") or 0)
+                body = simplejson.loads(self.rfile.read(length) or b"{}")
+                server.handle_chat(self, body)
+
+        return Handler
+
+    def handle_chat(self, handler, body:dict):
+        """ reply one request of chat completions """
+        with self.rlock:
+            self.stat.request_count += 1
+
+        if self.config.latency > 0:
+            time.sleep(self.config.latency)
+
+        error = self.choose_error()
+        if error == ERROR_RATE_LIMIT:
+            with self.rlock:
+                self.stat.rate_limit_count += 1
+            handler._send_json(
+                429,
+                {"error": {"message": "rate limit (stub)", "type": "rate_limit_error"}},
+                headers={"Retry-After": self.config.retry_after},
+            )
+            return
+        if error == ERROR_INTERNAL_SERVER:
+            with self.rlock:
+                self.stat.server_error_count += 1
+            handler._send_json(500, {"error": {"message": "internal server error (stub)"}})
+            return
+
+        if "stop" in body and not self.config.stop:
+            with self.rlock:
+                self.stat.stop_rejected_count += 1
+            handler._send_json(
+                400,
+                {"error": {
+                    "message": "Unsupported parameter: 'stop' is not supported with this model. (stub)",
+                    "type": "invalid_request_error",
+                }},
+            )
+            return
+
+        response_format = body.get("response_format")
+        if response_format:
+            with self.rlock:
+                self.stat.structured_count += 1
+                if not self.config.response_format:
+                    self.stat.rejected_count += 1
+            if not self.config.response_format:
+                handler._send_json(
+                    400,
+                    {"error": {"message": "response_format is not supported (stub)", "type": "invalid_request_error"}},
+                )
+                return
+
+        messages = body.get("messages") or []
+        content = self.choose_response(messages)
+        content = self.apply_response_format(content, response_format)
+        content = self.apply_stop(content, body.get("stop"))
+        tokens = split_tokens(content)
+        prompt = simplejson.dumps(messages)
+        prompt_tokens = len(prompt) // 4
+        cached_tokens = self.get_cached_tokens(prompt)
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(tokens),
+            "total_tokens": prompt_tokens + len(tokens),
+            "prompt_tokens_details": {"cached_tokens": cached_tokens},
+        }
+        with self.rlock:
+            self.stat.completion_tokens += len(tokens)
+            self.stat.prompt_tokens += prompt_tokens
+            self.stat.cached_tokens += cached_tokens
+
+        base = {
+            "id": f"stub-{self.stat.request_count}",
+            "created": int(time.time()),
+            "model": body.get("model") or "stub",
+        }
+
+        if not body.get("stream"):
+            if self.config.tokens_per_second > 0:
+                time.sleep(len(tokens) / self.config.tokens_per_second)
+            data = dict(base, object="chat.completion", usage=usage, choices=[
+                {
+                    "index": 0,
+                    "finish_reason": "stop",
+                    "message": {"role": "assistant", "content": content},
+                }
+            ])
+            handler._send_json(200, data)
+            return
+
+        with self.rlock:
+            self.stat.stream_count += 1
+        self._send_stream(handler, body, base, tokens, usage)
+        return
+
+    def _send_stream(self, handler, body:dict, base:dict, tokens:list[str], usage:dict):
+        """ reply in server-sent events """
+        handler.send_response(200)
+        handler.send_header("Content-Type", "text/event-stream")
+        handler.send_header("Connection", "close")
+        handler.end_headers()
+
+        def _write(data):
+            handler.wfile.write(f"data: {simplejson.dumps(data)}\n\n".encode("utf-8"))
+            handler.wfile.flush()
+
+        interval = 0
+        if self.config.tokens_per_second > 0:
+            interval = 1.0 / self.config.tokens_per_second
+
+        sent_count = 0
+        try:
+            for token in tokens:
+                if interval:
+                    time.sleep(interval)
+                _write(dict(base, object="chat.completion.chunk", choices=[
+                    {"index": 0, "finish_reason": None, "delta": {"role": "assistant", "content": token}}
+                ]))
+                sent_count += 1
+            _write(dict(base, object="chat.completion.chunk", choices=[
+                {"index": 0, "finish_reason": "stop", "delta": {}}
+            ]))
+            if (body.get("stream_options") or {}).get("include_usage"):
+                _write(dict(base, object="chat.completion.chunk", choices=[], usage=usage))
+            handler.wfile.write(b"data: [DONE]\n\n")
+            handler.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # the client aborts the stream
+            with self.rlock:
+                self.stat.aborted_count += 1
+                self.stat.unsent_tokens += len(tokens) - sent_count
+        handler.close_connection = True
+        return
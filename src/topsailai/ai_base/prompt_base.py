@@ -32,9 +32,15 @@ from topsailai.utils.thread_local_tool import (
     get_agent_name,
 )
 from topsailai.utils.thread_local_tool import get_session_id
-from topsailai.context.token import count_tokens
+from topsailai.context.token import (
+    MessagesTokenCounter,
+    count_messages_tokens,
+)
 from topsailai.context.ctx_manager import get_managers_by_env
-from topsailai.context.prompt_env import generate_prompt_for_env
+from topsailai.context.prompt_env import (
+    generate_prompt_for_env,
+    generate_prompt_for_tail,
+)
 
 
 class ThresholdContextHistory(object):
@@ -65,12 +71,16 @@ class ThresholdContextHistory(object):
             return True
         return False
 
-    def is_exceeded(self, messages:list):
-        """ return bool. True for exceeded """
+    def is_exceeded(self, messages:list, token_count:int=None):
+        """ return bool. True for exceeded
+
+        :token_count: the tokens of messages, it is counted if None.
+        """
         if self.exceed_msg_len(len(messages)):
             return True
-        token_count_now = count_tokens(str(messages))
-        if self.exceed_ratio(token_count_now):
+        if token_count is None:
+            token_count = count_messages_tokens(messages)
+        if self.exceed_ratio(token_count):
             return True
         return False
 
@@ -81,14 +91,18 @@ class PromptBase(object):
     # define flags
     flag_dump_messages = False
 
-    def __init__(self, system_prompt:str, tool_prompt:str=""):
+    def __init__(self, system_prompt:str, tool_prompt:str="", model_name:str=None):
         """
         Args:
             system_prompt (str):
             tool_prompt (str, optional): User give it. Defaults to "".
             tools_name (list, optional): Internal tools. Defaults to None (no need any tools).
+            model_name (str, optional): for the tokenizer. Defaults to None (TOKEN_ENCODING).
         """
         assert system_prompt, "missing system_prompt"
+
+        # running total of tokens of context messages
+        self.token_counter = MessagesTokenCounter(model_name)
         self.system_prompt = system_prompt
 
         # Only write it in AI Agent
@@ -99,7 +113,7 @@ class PromptBase(object):
         self.hooks_ctx_history = get_managers_by_env() # list[ChatHistoryBase]
 
         # context messages
-        self.messages = []
+        self._messages = []
         self.reset_messages(to_suppress_log=True)
 
         # set flags
@@ -110,6 +124,22 @@ class PromptBase(object):
         self.hooks_after_init_prompt = []
         self.hooks_after_new_session = []
 
+    @property
+    def messages(self) -> list:
+        """ context messages """
+        return self._messages
+
+    @messages.setter
+    def messages(self, messages:list):
+        self._messages = messages
+        self.token_counter.reset()
+        self.token_counter.sync(messages)
+
+    @property
+    def token_count(self) -> int:
+        """ tokens of context messages, only the changed messages are counted """
+        return self.token_counter.sync(self._messages)
+
     def call_hooks_ctx_history(self):
         """ let context messages become to history messages. remember these messages. """
         if not self.hooks_ctx_history:
@@ -124,14 +154,76 @@ class PromptBase(object):
                     logger.error(f"failed to call hook add_session_message: {traceback.format_exc()}")
 
         # check threshold, link messages to reduce content
-        if self.threshold_ctx_history.is_exceeded(self.messages):
+        if self.threshold_ctx_history.is_exceeded(self.messages, self.token_count):
             for hook in self.hooks_ctx_history:
                 try:
                     hook.link_messages(self.messages)
                 except Exception:
                     logger.error(f"failed to call hook link_messages: {traceback.format_exc()}")
+            # the messages are archived in place
+            self.token_counter.sync(self.messages)
         return
 
+    def get_header_count(self) -> int:
+        """ count of the leading system messages (system, env, tool), they are never compacted """
+        count = 0
+        for msg in self.messages:
+            if msg["role"] != ROLE_SYSTEM:
+                break
+            count += 1
+        return count
+
+    def fit_context_window(self, budget:int, keep_count:int=11) -> bool:
+        """ compact the context messages before sending them if the tokens exceed budget.
+
+        The older messages are archived by hooks_ctx_history first,
+        then the oldest messages are dropped if it is still over budget.
+        The header and the task message (the first user message) are always kept.
+
+        :budget: max tokens of the prompt, see LLMModel.get_prompt_budget;
+        :keep_count: the latest messages are always kept, the same window as link_messages.
+
+        return True if the messages are compacted.
+        """
+        token_count = self.token_count
+        if budget <= 0 or token_count <= budget:
+            return False
+        logger.warning(f"context is over budget: tokens={token_count}, budget={budget}")
+
+        for hook in self.hooks_ctx_history or []:
+            try:
+                hook.link_messages(self.messages)
+            except Exception:
+                logger.error(f"failed to call hook link_messages: {traceback.format_exc()}")
+        token_count = self.token_count
+        if token_count <= budget:
+            logger.info(f"context is compacted by archiving: tokens={token_count}")
+            return True
+
+        # drop the oldest messages after the task message
+        index_start = self.get_header_count()
+        if index_start < len(self.messages) and self.messages[index_start]["role"] == ROLE_USER:
+            index_start += 1
+        index_end = index_start
+        max_end = len(self.messages) - keep_count
+        note_tokens = 50
+        while index_end < max_end and token_count + note_tokens > budget:
+            token_count -= self.token_counter.items[index_end][2]
+            index_end += 1
+        # no orphaned tool message
+        while index_end < max_end and self.messages[index_end]["role"] == ROLE_TOOL:
+            index_end += 1
+        if index_end <= index_start:
+            return False
+
+        drop_count = index_end - index_start
+        self.messages[index_start:index_end] = [
+            {"role": ROLE_USER, "content": f"[{drop_count} earlier messages are dropped to fit the context window]"},
+        ]
+        token_count = self.token_count
+        logger.warning(f"context is compacted by dropping {drop_count} messages: tokens={token_count}")
+        return True
+
     def append_message(self, msg:dict, to_suppress_log=False):
         """ append a message to context """
         if not to_suppress_log:
@@ -142,6 +234,7 @@ class PromptBase(object):
         #    logger.warning("duplicate message")
 
         self.messages.append(msg)
+        self.token_counter.append(msg)
         self.call_hooks_ctx_history()
 
     def init_prompt(self):
@@ -187,10 +280,28 @@ class PromptBase(object):
             self.append_message({"role": ROLE_SYSTEM, "content": self.tool_prompt}, to_suppress_log)
 
     def update_message_for_env(self):
-        """ update env info """
-        self.messages[1] = {"role": ROLE_SYSTEM, "content": generate_prompt_for_env()}
+        """ update env info, the message is kept if nothing is changed (prefix cache of provider) """
+        content = generate_prompt_for_env()
+        if self.messages[1].get("content") == content:
+            return
+        self.messages[1] = {"role": ROLE_SYSTEM, "content": content}
+        self.token_counter.replace(1, self.messages[1])
         return
 
+    def get_messages_for_chat(self) -> list:
+        """ return the messages to send, the volatile env info is at the tail for PROMPT_ENV_MODE=tail.
+
+        It is added to the last message, not a system message after the history,
+        many servers accept the system messages only at the start.
+        """
+        tail_prompt = generate_prompt_for_tail()
+        if not tail_prompt or not self.messages:
+            return self.messages
+        last_msg = self.messages[-1]
+        if last_msg["role"] in (ROLE_USER, ROLE_TOOL) and isinstance(last_msg.get("content"), str):
+            return self.messages[:-1] + [dict(last_msg, content=f"{last_msg['content']}\n\n[{tail_prompt}]")]
+        return self.messages + [{"role": ROLE_USER, "content": f"[{tail_prompt}]"}]
+
     def add_user_message(self, content):
         """ the message from human """
         if content is None:
@@ -207,13 +318,17 @@ class PromptBase(object):
         print_step(content)
         self.append_message({"role": ROLE_ASSISTANT, "content": content, "tool_calls": tool_calls})
 
-    def add_tool_message(self, content):
-        """ the message from tool call """
+    def add_tool_message(self, content, tool_call_id:str=None):
+        """ the message from tool call
+
+        :tool_call_id: default is the first unanswered tool call of the last assistant message.
+        """
         if content is None:
             return
         content = self.hook_format_content(content)
         print_step(content)
-        tool_call_id = self.get_tool_call_id()
+        if not tool_call_id:
+            tool_call_id = self.get_tool_call_id()
         if tool_call_id:
             self.append_message({"role": ROLE_TOOL, "content": content, "tool_call_id": tool_call_id})
         else:
@@ -221,11 +336,17 @@ class PromptBase(object):
         return
 
     def get_tool_call_id(self):
-        """ get id from the last message """
-        last_message = self.messages[-1]
-        tool_calls = last_message.get("tool_calls")
-        if tool_calls:
-            return tool_calls[0].id
+        """ get the first unanswered id of tool calls from the last assistant message """
+        answered_ids = set()
+        for msg in reversed(self.messages):
+            if msg.get("role") == ROLE_TOOL:
+                answered_ids.add(msg.get("tool_call_id"))
+                continue
+            for tool_call in msg.get("tool_calls") or []:
+                tool_call_id = tool_call.get("id") if isinstance(tool_call, dict) else tool_call.id
+                if tool_call_id not in answered_ids:
+                    return tool_call_id
+            return None
         return None
 
     def dump_messages(self):
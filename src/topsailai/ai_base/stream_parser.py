@@ -0,0 +1,342 @@
+'''
+  Author: DawsonLin
+  Email: lin_dongsen@126.com
+  Created: 2026-10-17
+  Purpose: incremental parser of steps for a streaming response of LLM.
+    It emits each step (thought/action/final_answer) as soon as the step is closed,
+    both for the topsailai format and the json format.
+
+  Example:
+    parser = StepStreamParser(on_step=lambda index, step: print(index, step))
+    for delta in stream:
+        parser.feed(delta)
+        if parser.is_done:
+            # the rest of stream is useless, e.g. a hallucinated observation
+            break
+    parser.finish()
+'''
+
+import simplejson
+
+from topsailai.logger.log_chat import logger
+from topsailai.utils.format_tool import TOPSAILAI_FORMAT_PREFIX
+
+
+FORMAT_UNKNOWN = ""
+FORMAT_TOPSAILAI = "topsailai"
+FORMAT_JSON = "json"
+
+# the steps which are written before the marker without a newline by mistake, see format_tool.fix_llm_mistakes
+MISTAKE_STEP_KEYS = ("thought", "action")
+
+
+def is_complete_json(text:str) -> bool:
+    """ True if text is a complete json object (or a code block of it) """
+    text = text.strip()
+    if text.startswith("```"):
+        lines = text.split("\n")
+        if len(lines) < 3 or not text.endswith("```"):
+            return False
+        text = "\n".join(lines[1:-1]).strip()
+    if not text.startswith("{") or not text.endswith("}"):
+        return False
+    try:
+        simplejson.loads(text)
+    except Exception:
+        return False
+    return True
+
+
+class StepStreamParser(object):
+    """ feed the deltas of a stream, get the completed steps.
+
+    The steps are the same as the result of `_format_response` for the whole content,
+    but the final parsing is still the source of truth.
+    """
+    def __init__(self, on_step=None, stop_step_names=()):
+        """
+        :on_step: func(index:int, step:dict), it is called when a step is closed.
+        :stop_step_names: the response is complete after one of these steps (e.g. action),
+            it makes `is_done` True, and the steps after it are ignored.
+        """
+        self.on_step = on_step
+        self.stop_step_names = tuple(stop_step_names or ())
+        self.reset()
+
+    def reset(self):
+        """ for a new stream """
+        self.format = FORMAT_UNKNOWN
+        self.steps = []
+        self._chunks = []
+
+        # count of chars which are parsed, and the position after the stop step
+        self._fed_count = 0
+        self._offset = 0
+        self.done_offset = None
+
+        # topsailai format
+        self._line_parts = []
+        self._step_name = None
+        self._step_lines = []
+        self._step_emitted = False
+
+        # json format
+        self._head = []
+        self._skip_line = False
+        self._depth = 0
+        self._base_depth = 0
+        self._in_string = False
+        self._escape = False
+        self._obj_chars = []
+        self._json_done = False
+        return
+
+    @property
+    def content(self) -> str:
+        """ the whole content of stream """
+        return "".join(self._chunks)
+
+    @property
+    def is_done(self) -> bool:
+        """ True if a stop step is closed """
+        return self.done_offset is not None
+
+    def get_done_content(self) -> str:
+        """ return the content until the stop step, it can be parsed as a whole response """
+        content = self.content
+        if self.done_offset is None:
+            return content
+        result = content[:self.done_offset]
+        if self.format == FORMAT_JSON:
+            if self._base_depth == 1:
+                result += "]"
+            if result.lstrip().startswith("```"):
+                result += "\n```"
+        return result.strip()
+
+    def _emit(self, step:dict):
+        if self.done_offset is not None:
+            # ignore the steps after the stop step
+            return
+        if step.get("step_name") in self.stop_step_names:
+            self.done_offset = self._offset
+        index = len(self.steps)
+        self.steps.append(step)
+        if self.on_step is None:
+            return
+        try:
+            self.on_step(index, step)
+        except Exception as e:
+            logger.exception(f"failed to handle step: {e}")
+        return
+
+    def feed(self, delta:str) -> list[dict]:
+        """ return the steps closed by this delta """
+        if not delta:
+            return []
+        count = len(self.steps)
+        self._chunks.append(delta)
+
+        if self.format == FORMAT_UNKNOWN:
+            self._head.append(delta)
+            head = "".join(self._head)
+            if not self._detect_format(head):
+                return []
+            self._head = []
+            delta = head
+
+        if self.format == FORMAT_JSON:
+            self._feed_json(delta)
+        else:
+            self._feed_lines(delta)
+        return self.steps[count:]
+
+    def finish(self) -> list[dict]:
+        """ the stream is ended, return the rest of steps """
+        count = len(self.steps)
+        if self.format == FORMAT_UNKNOWN and self._head:
+            # short content, e.g. only one line
+            head = "".join(self._head)
+            self._head = []
+            if head.lstrip().startswith(("[", "{", "```")):
+                self.format = FORMAT_JSON
+                self._feed_json(head)
+            else:
+                self.format = FORMAT_TOPSAILAI
+                self._feed_lines(head)
+
+        if self.format == FORMAT_TOPSAILAI:
+            self._offset = self._fed_count
+            if self._line_parts:
+                line = "".join(self._line_parts)
+                self._line_parts = []
+                self._handle_line(line)
+            self._close_step()
+        return self.steps[count:]
+
+    def _detect_format(self, head:str) -> bool:
+        """ True if the format is known """
+        text = head.lstrip()
+        if not text:
+            return False
+        if text[0] in ("[", "{"):
+            self.format = FORMAT_JSON
+            return True
+        if len(text) < 3 and "```".startswith(text):
+            return False
+        if text.startswith("```"):
+            # ```json\n[...]\n``` or ```\ntopsailai.xxx
+            if "\n" not in text:
+                return False
+            body = text.split("\n", 1)[1].lstrip()
+            if not body:
+                return False
+            self.format = FORMAT_TOPSAILAI if body.startswith(TOPSAILAI_FORMAT_PREFIX) else FORMAT_JSON
+            return True
+        if len(text) < len(TOPSAILAI_FORMAT_PREFIX) and TOPSAILAI_FORMAT_PREFIX.startswith(text):
+            return False
+        # the lines before the first marker are ignored
+        self.format = FORMAT_TOPSAILAI
+        return True
+
+    ###########################################################################
+    # topsailai format
+    ###########################################################################
+
+    def _feed_lines(self, delta:str):
+        while delta:
+            pos = delta.find("\n")
+            if pos < 0:
+                self._line_parts.append(delta)
+                self._fed_count += len(delta)
+                return
+            self._line_parts.append(delta[:pos])
+            line = "".join(self._line_parts)
+            self._line_parts = []
+            delta = delta[pos+1:]
+            self._fed_count += pos + 1
+            self._offset = self._fed_count
+            self._handle_line(line)
+        return
+
+    def _handle_line(self, line:str):
+        if not line.startswith(TOPSAILAI_FORMAT_PREFIX):
+            # case: xxx{step_name}
+            for step_key in MISTAKE_STEP_KEYS:
+                marker = TOPSAILAI_FORMAT_PREFIX + step_key
+                if line.endswith(marker):
+                    self._handle_line(line[:-len(marker)])
+                    self._handle_line(marker)
+                    return
+
+            if self._step_name is None:
+                return
+            self._step_lines.append(line)
+            if self._step_name == "action" and not self._step_emitted \
+                and is_complete_json("\n".join(self._step_lines)):
+                # the tool call is ready, no need to wait for the next marker
+                self._emit_step()
+            return
+
+        self._close_step()
+        self._step_name = line[len(TOPSAILAI_FORMAT_PREFIX):].strip()
+        self._step_lines = []
+        self._step_emitted = False
+        return
+
+    def _emit_step(self):
+        self._step_emitted = True
+        self._emit(
+            {
+                "step_name": self._step_name,
+                "raw_text": "\n".join(self._step_lines).strip(),
+            }
+        )
+        return
+
+    def _close_step(self):
+        if self._step_name is None:
+            return
+        if not self._step_emitted:
+            self._emit_step()
+        self._step_name = None
+        self._step_lines = []
+        return
+
+    ###########################################################################
+    # json format
+    ###########################################################################
+
+    def _feed_json(self, delta:str):
+        for char in delta:
+            if self._json_done:
+                return
+            self._fed_count += 1
+
+            if self._skip_line:
+                # the line of ```json
+                if char == "\n":
+                    self._skip_line = False
+                continue
+
+            if self._depth == 0 and not self._in_string:
+                if char == "`":
+                    self._skip_line = True
+                    continue
+                if char == "[":
+                    self._depth = 1
+                    self._base_depth = 1
+                    continue
+                if char == "{":
+                    # a single step
+                    self._base_depth = 0
+                elif char == "]":
+                    self._json_done = True
+                    continue
+                else:
+                    continue
+
+            if self._depth == self._base_depth and self._base_depth == 1 and not self._in_string:
+                if char == "]":
+                    self._json_done = True
+                    continue
+                if char != "{":
+                    # ',' or blank between steps
+                    continue
+
+            self._obj_chars.append(char)
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+
+            if char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+                if self._depth == self._base_depth:
+                    self._offset = self._fed_count
+                    self._close_json_step()
+        return
+
+    def _close_json_step(self):
+        text = "".join(self._obj_chars)
+        self._obj_chars = []
+        if self._base_depth == 0:
+            self._json_done = True
+        try:
+            step = simplejson.loads(text)
+        except Exception:
+            # let the final parsing handle it
+            self._json_done = True
+            return
+        if isinstance(step, dict):
+            self._emit(step)
+        return
@@ -0,0 +1,133 @@
+'''
+  Author: DawsonLin
+  Email: lin_dongsen@126.com
+  Created: 2026-10-17
+  Purpose: the execution layer of tools, with timeout and cooperative cancellation
+  Env:
+    @TOOL_TIMEOUT: seconds, default is 0 for no timeout; a tool can have its own timeout in TOOLS_META;
+
+  A tool declares its timeout in TOOLS_META, e.g.
+    TOOLS_META = dict(
+        read_file={"timeout": 60},
+        WritingAssistant={"timeout": 0},  # no timeout, e.g. a sub agent
+    )
+  A tool which has an argument 'timeout' is given (timeout + grace) for this call.
+
+  On timeout, the cancel event of the tool is set (see thread_local_tool.is_cancelled),
+  the commands of utils.cmd_tool.exec_cmd kill their process group on it.
+  The agent gets an observation of timeout, and it can start a background job instead (see job_tool).
+  The cancellation is cooperative: a python tool which does not check it (e.g. a sub agent)
+  keeps running in background after the timeout, so such a tool should have {"timeout": 0}.
+'''
+
+import os
+import time
+import inspect
+import threading
+import functools
+from concurrent.futures import Future
+
+from topsailai.logger import logger
+from topsailai.utils.thread_local_tool import (
+    get_thread_vars,
+    ctxm_set_thread_vars,
+    ctxm_set_cancel_event,
+)
+from topsailai.context.tool_cache import ToolCacheInstance
+
+
+def get_call_timeout(tool_func, tool_args:dict) -> float|None:
+    """ the argument 'timeout' of this call, None if the tool has no such argument """
+    timeout = tool_args.get("timeout")
+    if timeout in (None, ""):
+        return None
+    try:
+        if "timeout" not in inspect.signature(tool_func).parameters:
+            return None
+        return float(timeout)
+    except (TypeError, ValueError):
+        return None
+
+
+class ToolRunner(object):
+    """ run a tool with timeout, the result is memoized if the tool is cacheable """
+    def __init__(self, timeout:float=0, grace:float=5):
+        self.timeout = timeout
+        # seconds, for the tool to stop after cancellation
+        self.grace = grace
+
+        # stat
+        self.call_count = 0
+        self.timeout_count = 0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            timeout=float(os.getenv("TOOL_TIMEOUT", 0)),
+        )
+
+    def get_timeout(self, tool_func, tool_args:dict, tool_meta:dict=None) -> float:
+        """ seconds, 0 for no timeout """
+        timeout = float((tool_meta or {}).get("timeout", self.timeout) or 0)
+        call_timeout = get_call_timeout(tool_func, tool_args)
+        if call_timeout is not None and call_timeout > 0:
+            # the tool stops itself, give it a little longer
+            timeout = call_timeout + self.grace
+        return max(timeout, 0)
+
+    def call(self, tool_name:str, tool_func, tool_args:dict, tool_meta:dict=None):
+        """ return the result of tool_func(**tool_args), or a message of timeout """
+        self.call_count += 1
+        func = functools.partial(ToolCacheInstance.call, tool_name, tool_func, tool_args, tool_meta)
+        timeout = self.get_timeout(tool_func, tool_args, tool_meta)
+        if not timeout:
+            return func()
+
+        future = Future()
+        cancel_event = threading.Event()
+        thread_vars = get_thread_vars()
+
+        def _run():
+            with ctxm_set_thread_vars(thread_vars), ctxm_set_cancel_event(cancel_event):
+                try:
+                    future.set_result(func())
+                except BaseException as e:
+                    future.set_exception(e)
+
+        # a daemon thread, the agent is not blocked by a tool which ignores the cancellation
+        start_time = time.time()
+        threading.Thread(target=_run, name=f"tool:{tool_name}", daemon=True).start()
+        try:
+            return future.result(timeout=timeout)
+        except TimeoutError:
+            if future.done():
+                # the tool raises TimeoutError itself
+                raise
+
+        cancel_event.set()
+        self.timeout_count += 1
+        logger.warning(f"tool timeout: {tool_name}, {timeout}s, it is cancelled")
+        try:
+            future.result(timeout=self.grace)
+        except Exception:
+            pass
+        return (
+            f"timeout: the tool '{tool_name}' is not done in {int(time.time() - start_time)}s, it is cancelled. "
+            "Try a smaller task, or run a long command as a background job (job_tool.start_job)."
+        )
+
+    def to_dict(self) -> dict:
+        return dict(
+            timeout=self.timeout,
+            call_count=self.call_count,
+            timeout_count=self.timeout_count,
+        )
+
+
+# init
+ToolRunnerInstance = ToolRunner.from_env()
+
+
+def get_tool_runner_stats() -> dict:
+    """ return the counters of the tool runner """
+    return ToolRunnerInstance.to_dict()
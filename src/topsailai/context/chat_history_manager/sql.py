@@ -27,12 +27,13 @@
         If the count is 0 for a particular msg_id, that msg_id should be deleted from chat_history_messages.
 '''
 
-from sqlalchemy import create_engine, Column, String, Text, DateTime, Integer, ForeignKey, PrimaryKeyConstraint
+from sqlalchemy import Column, String, Text, DateTime, Integer, ForeignKey, PrimaryKeyConstraint
 from sqlalchemy.orm import declarative_base, sessionmaker, relationship
 from datetime import datetime, timedelta
 
 from .__base import ChatHistoryBase, ChatHistoryMessageData
 from topsailai.logger.log_chat import logger
+from topsailai.context.sql_engine import get_engine, create_tables
 
 
 Base = declarative_base()
@@ -105,8 +106,8 @@ class ChatHistorySQLAlchemy(ChatHistoryBase):
         """
         super(ChatHistorySQLAlchemy, self).__init__()
         self.conn = conn
-        self.engine = create_engine(conn)
-        Base.metadata.create_all(self.engine)
+        self.engine = get_engine(conn)
+        create_tables(self.engine, Base.metadata)
         self.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
 
     def add_message(self, msg: ChatHistoryMessageData):
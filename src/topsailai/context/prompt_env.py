@@ -3,6 +3,13 @@
   Email: lin_dongsen@126.com
   Created: 2025-12-11
   Purpose:
+  Env:
+    @PROMPT_ENV_MODE: the layout of env info, default is stable;
+      dynamic: the env message (messages[1]) has the current time, it is rewritten for each turn;
+      stable: the env message has the current day, it is rewritten only if it is changed,
+        so the prefix cache of provider is kept;
+      tail: the env message is static, the current time (to the minute) is added to the last message
+        of request only, so the prefix cache is kept and the agent still knows the time of day;
 '''
 import os
 
@@ -12,6 +19,19 @@ from topsailai.utils import (
 )
 
 
+ENV_MODE_DYNAMIC = "dynamic"
+ENV_MODE_STABLE = "stable"
+ENV_MODE_TAIL = "tail"
+
+
+def get_env_mode() -> str:
+    """ return PROMPT_ENV_MODE """
+    mode = os.getenv("PROMPT_ENV_MODE", ENV_MODE_STABLE).strip().lower()
+    if mode not in (ENV_MODE_DYNAMIC, ENV_MODE_STABLE, ENV_MODE_TAIL):
+        return ENV_MODE_STABLE
+    return mode
+
+
 def get_system_info() -> dict:
     """ system key info """
     result = {}
@@ -42,9 +62,17 @@ class _Base(object):
 
 class CurrentDate(_Base):
     """ prompt about of current date """
+    def __init__(self, with_time:bool=True):
+        """
+        :with_time: False for the day only, it is stable for the prefix cache.
+        """
+        self.with_time = with_time
+
     @property
     def prompt(self) -> str:
         """ return date info """
+        if not self.with_time:
+            return f"""CurrentDate: {time_tool.get_current_day()}"""
         return f"""CurrentDate: {time_tool.get_current_date(True)}"""
 
 class CurrentSystem(_Base):
@@ -60,8 +88,12 @@ class CurrentSystem(_Base):
                 result += f"- {k}:{v}\n"
         return result
 
-def generate_prompt_for_env() -> str:
-    """ return env info """
+def generate_prompt_for_env(mode:str=None) -> str:
+    """ return env info
+
+    :mode: PROMPT_ENV_MODE, default is from env.
+    """
+    mode = mode or get_env_mode()
 
     env_prompt = os.getenv("ENV_PROMPT") or ""
     if env_prompt:
@@ -70,10 +102,18 @@ def generate_prompt_for_env() -> str:
             with open(env_prompt, encoding="utf-8") as fd:
                 env_prompt = fd.read()
 
-    return "# Environment\n" + "\n".join(
-        [
-            CurrentDate().prompt,
-            CurrentSystem().prompt,
-            env_prompt,
-        ]
-    )
+    items = []
+    if mode != ENV_MODE_TAIL:
+        items.append(CurrentDate(with_time=(mode == ENV_MODE_DYNAMIC)).prompt)
+    items.append(CurrentSystem().prompt)
+    items.append(env_prompt)
+    return "# Environment\n" + "\n".join(items)
+
+def generate_prompt_for_tail(mode:str=None) -> str:
+    """ return the volatile env info for the tail of request, empty if it is not tail mode.
+    The time is to the minute, so the requests of the same minute are the same (e.g. response cache).
+    """
+    mode = mode or get_env_mode()
+    if mode != ENV_MODE_TAIL:
+        return ""
+    return f"CurrentDate: {time_tool.get_current_date()[:16]}"
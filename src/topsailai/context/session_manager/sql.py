@@ -12,11 +12,12 @@
       - create_time, creation time of this record; default is local time;
 '''
 
-from sqlalchemy import create_engine, Column, String, Text, DateTime
+from sqlalchemy import Column, String, Text, DateTime
 from sqlalchemy.orm import declarative_base, sessionmaker
 from datetime import datetime, timedelta
 
 from topsailai.context.chat_history_manager.sql import ChatHistorySQLAlchemy
+from topsailai.context.sql_engine import get_engine, create_tables
 from topsailai.logger.log_chat import logger
 
 from .__base import SessionStorageBase, SessionData
@@ -61,8 +62,8 @@ class SessionSQLAlchemy(SessionStorageBase):
             conn (str): Database connection string.
         """
         super(SessionSQLAlchemy, self).__init__()
-        self.engine = create_engine(conn)
-        Base.metadata.create_all(self.engine)
+        self.engine = get_engine(conn)
+        create_tables(self.engine, Base.metadata)
         self.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
 
         self.chat_history = ChatHistorySQLAlchemy(conn)
@@ -0,0 +1,61 @@
+'''
+  Author: DawsonLin
+  Email: lin_dongsen@126.com
+  Created: 2026-10-17
+  Purpose: shared SQLAlchemy engines, one for each database connection string.
+    The managers of sessions and messages are created for each message,
+    the engine (connection pool) and the tables check are reused.
+    The in-memory databases are never shared.
+'''
+
+import os
+import threading
+
+from sqlalchemy import create_engine
+
+g_rlock = threading.RLock()
+
+# key is conn, value is engine
+g_engines = {}
+
+# (id of shared engine, id of metadata) of the created tables
+g_created_tables = set()
+
+
+def is_memory_conn(conn:str) -> bool:
+    """ e.g. sqlite:// or sqlite:///:memory: """
+    return conn.startswith("sqlite") and (conn.rstrip("/").endswith(":") or ":memory:" in conn)
+
+def get_engine(conn:str):
+    """ return the shared engine of conn """
+    if is_memory_conn(conn):
+        return create_engine(conn)
+    with g_rlock:
+        engine = g_engines.get(conn)
+        if engine is None:
+            engine = create_engine(conn)
+            g_engines[conn] = engine
+        return engine
+
+def create_tables(engine, metadata):
+    """ create the tables of metadata once for a shared engine """
+    with g_rlock:
+        is_shared = any(engine is shared_engine for shared_engine in g_engines.values())
+        key = (id(engine), id(metadata))
+        if is_shared and key in g_created_tables:
+            return
+        metadata.create_all(engine)
+        if is_shared:
+            g_created_tables.add(key)
+    return
+
+def dispose_engines_in_child():
+    """ the pooled connections of parent must not be used by a forked child, see agent daemon """
+    for engine in list(g_engines.values()):
+        engine.dispose(close=False)
+    return
+
+
+# init
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=dispose_engines_in_child)
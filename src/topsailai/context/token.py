@@ -3,10 +3,18 @@
   Email: lin_dongsen@126.com
   Created: 2025-10-22
   Purpose:
+  Env:
+    @TOKEN_ENCODING: tiktoken encoding for unknown models, default is cl100k_base;
+    @CONTEXT_WINDOW: int, tokens of the context window of model, it overrides MODEL_CONTEXT_WINDOWS;
 '''
 
-import time
+import os
+import queue
+import atexit
+import functools
 import threading
+import contextvars
+from collections import OrderedDict
 
 import tiktoken
 
@@ -14,6 +22,73 @@ from topsailai.logger.log_chat import logger
 from topsailai.utils.print_tool import print_step
 
 
+# default encoding for the models which are unknown to tiktoken, e.g. DeepSeek
+DEFAULT_ENCODING_NAME = "cl100k_base"
+
+# the overhead of one message, e.g. role and separators
+TOKENS_PER_MESSAGE = 4
+
+# a rough count if no encoder is available (e.g. offline)
+CHARS_PER_TOKEN = 4
+
+# tokens of the context window, key is the prefix of model name (lower case), the longest prefix wins
+MODEL_CONTEXT_WINDOWS = {
+    "gpt-3.5": 16385,
+    "gpt-4": 8192,
+    "gpt-4-turbo": 128000,
+    "gpt-4o": 128000,
+    "gpt-4.1": 1047576,
+    "gpt-5": 400000,
+    "o1": 200000,
+    "o3": 200000,
+    "o4": 200000,
+    "claude": 200000,
+    "deepseek": 128000,
+    "qwen": 131072,
+    "glm": 128000,
+    "kimi": 131072,
+    "moonshot": 131072,
+    "minimax": 1000000,
+}
+DEFAULT_CONTEXT_WINDOW = 128000
+
+
+def get_default_encoding_name() -> str:
+    """ env TOKEN_ENCODING, default is cl100k_base """
+    return os.getenv("TOKEN_ENCODING") or DEFAULT_ENCODING_NAME
+
+@functools.lru_cache(maxsize=32)
+def get_encoding(encoding_name:str=DEFAULT_ENCODING_NAME):
+    """ return the cached encoder, None if it is unavailable """
+    try:
+        return tiktoken.get_encoding(encoding_name)
+    except Exception as e:
+        logger.warning(f"failed to get encoding [{encoding_name}], tokens are estimated: {e}")
+        return None
+
+@functools.lru_cache(maxsize=128)
+def get_encoding_for_model(model_name:str=None):
+    """ return the cached encoder of model, the default encoding for unknown model """
+    if model_name:
+        try:
+            return tiktoken.encoding_for_model(model_name)
+        except KeyError:
+            pass
+        except Exception as e:
+            logger.warning(f"failed to get encoding for model [{model_name}]: {e}")
+    return get_encoding(get_default_encoding_name())
+
+def _count_by_encoding(encoding, text) -> int:
+    if not text:
+        return 0
+    if encoding is None:
+        return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+    try:
+        return len(encoding.encode(text, disallowed_special=()))
+    except Exception as e:
+        logger.warning(f"failed to count tokens: {e}")
+        return 0
+
 def count_tokens(text, encoding_name="cl100k_base"):
     """
     计算文本的token数量
@@ -25,17 +100,7 @@ def count_tokens(text, encoding_name="cl100k_base"):
     Returns:
         int: token数量
     """
-    try:
-        # 获取编码器
-        encoding = tiktoken.get_encoding(encoding_name)
-
-        # 编码文本并计算token数量
-        tokens = encoding.encode(text)
-        return len(tokens)
-
-    except Exception as e:
-        logger.warning(f"failed to count tokens: {e}")
-        return 0
+    return _count_by_encoding(get_encoding(encoding_name), text)
 
 def count_tokens_for_model(text, model_name="gpt-4"):
     """
@@ -48,33 +113,356 @@ def count_tokens_for_model(text, model_name="gpt-4"):
     Returns:
         int: token数量
     """
-    try:
-        # 获取模型的编码器
-        encoding = tiktoken.encoding_for_model(model_name)
+    return _count_by_encoding(get_encoding_for_model(model_name), text)
+
+
+def get_context_window(model_name:str=None) -> int:
+    """ return tokens of the context window of model, env CONTEXT_WINDOW first """
+    context_window = os.getenv("CONTEXT_WINDOW")
+    if context_window:
+        return int(context_window)
+
+    # e.g. "DeepSeek-V3.1-Terminus", "openai/gpt-4o"
+    name = (model_name or "").lower().rsplit("/", 1)[-1]
+    matched = ""
+    for prefix in MODEL_CONTEXT_WINDOWS:
+        if name.startswith(prefix) and len(prefix) > len(matched):
+            matched = prefix
+    if matched:
+        return MODEL_CONTEXT_WINDOWS[matched]
+    return DEFAULT_CONTEXT_WINDOW
+
+
+class MessageTokenMemo(object):
+    """ LRU of token counts, the key is the content of message """
+    def __init__(self, max_count:int=10000):
+        self.max_count = max_count
+        self.lock = threading.Lock()
+        self.counts = OrderedDict()
+        self.hit_count = 0
+        self.miss_count = 0
+
+    def count(self, content:str, model_name:str=None) -> int:
+        """ return tokens of content """
+        key = (model_name, content)
+        with self.lock:
+            count = self.counts.get(key)
+            if count is not None:
+                self.counts.move_to_end(key)
+                self.hit_count += 1
+                return count
+            self.miss_count += 1
+
+        count = count_tokens_for_model(content, model_name)
+
+        with self.lock:
+            self.counts[key] = count
+            while len(self.counts) > self.max_count:
+                self.counts.popitem(last=False)
+        return count
+
+    def clear(self):
+        with self.lock:
+            self.counts.clear()
+            self.hit_count = 0
+            self.miss_count = 0
+
+
+# init
+MessageTokenMemoInstance = MessageTokenMemo()
+
+
+def count_message_tokens(msg:dict, model_name:str=None) -> int:
+    """ return tokens of one message, it is memoized by content """
+    content = msg.get("content")
+    if content is None:
+        content = ""
+    elif not isinstance(content, str):
+        content = str(content)
+    count = TOKENS_PER_MESSAGE + MessageTokenMemoInstance.count(content, model_name)
+    tool_calls = msg.get("tool_calls")
+    if tool_calls:
+        count += MessageTokenMemoInstance.count(str(tool_calls), model_name)
+    return count
+
+def count_messages_tokens(messages:list, model_name:str=None) -> int:
+    """ return tokens of messages """
+    return sum(count_message_tokens(msg, model_name) for msg in messages)
+
+
+class MessagesTokenCounter(object):
+    """ running total of tokens of a message list.
+
+    It remembers the message object and its content at each index,
+    so only appended or changed messages are counted again.
+    """
+    def __init__(self, model_name:str=None):
+        self.model_name = model_name
+        # list of (msg, content, tokens), aligned with messages
+        self.items = []
+        self.total = 0
+
+    def set_model(self, model_name:str):
+        """ change tokenizer, count again """
+        if model_name == self.model_name:
+            return
+        self.model_name = model_name
+        messages = [item[0] for item in self.items]
+        self.reset()
+        self.sync(messages)
+
+    def _new_item(self, msg:dict) -> tuple:
+        return (msg, msg.get("content"), count_message_tokens(msg, self.model_name))
+
+    def reset(self):
+        """ no message """
+        self.items = []
+        self.total = 0
+
+    def append(self, msg:dict):
+        """ a message is appended """
+        item = self._new_item(msg)
+        self.items.append(item)
+        self.total += item[2]
+
+    def replace(self, index:int, msg:dict):
+        """ a message is replaced """
+        item = self._new_item(msg)
+        self.total += item[2] - self.items[index][2]
+        self.items[index] = item
+
+    def sync(self, messages:list) -> int:
+        """ count the changed messages, e.g. they are archived in place. return total """
+        if len(self.items) > len(messages):
+            for item in self.items[len(messages):]:
+                self.total -= item[2]
+            del self.items[len(messages):]
+
+        for index, msg in enumerate(messages):
+            if index >= len(self.items):
+                self.append(msg)
+                continue
+            old_msg, old_content, _ = self.items[index]
+            if old_msg is msg and old_content is msg.get("content"):
+                continue
+            self.replace(index, msg)
+        return self.total
 
-        # 编码文本并计算token数量
-        tokens = encoding.encode(text)
-        return len(tokens)
 
-    except Exception as e:
-        logger.warning(f"failed to count tokens: {e}")
-        return 0
+def _get_field(obj, name, default=None):
+    """ get field from dict or object """
+    if obj is None:
+        return default
+    if isinstance(obj, dict):
+        return obj.get(name, default)
+    return getattr(obj, name, default)
 
+def parse_usage(usage) -> dict|None:
+    """ parse the usage of response.
 
-class TokenStat(threading.Thread):
-    """ tracking token stat """
-    def __init__(self, llm_id:str, lifetime:int=86400):
-        """ define keys.
+    Args:
+        usage: response.usage, object or dict, it can be None.
 
-        :lifetime: seconds, it <= 0 for forever.
+    Returns:
+        dict|None: keys are prompt_tokens, completion_tokens, cached_tokens; None if no usage.
+    """
+    if usage is None:
+        return None
+
+    prompt_tokens = _get_field(usage, "prompt_tokens") or 0
+    completion_tokens = _get_field(usage, "completion_tokens") or 0
+
+    # openai: usage.prompt_tokens_details.cached_tokens
+    cached_tokens = _get_field(_get_field(usage, "prompt_tokens_details"), "cached_tokens")
+    if cached_tokens is None:
+        # deepseek: usage.prompt_cache_hit_tokens
+        cached_tokens = _get_field(usage, "prompt_cache_hit_tokens")
+
+    return dict(
+        prompt_tokens=int(prompt_tokens),
+        completion_tokens=int(completion_tokens),
+        cached_tokens=int(cached_tokens or 0),
+    )
+
+
+def is_usage_empty(usage:dict|None) -> bool:
+    """ True if the provider returns no usage """
+    if not usage:
+        return True
+    return usage["prompt_tokens"] <= 0 and usage["completion_tokens"] <= 0
+
+
+def get_cached_ratio(prompt_tokens:int, cached_tokens:int) -> float:
+    """ cached_tokens / prompt_tokens, the hit rate of the prefix cache of provider """
+    if prompt_tokens <= 0:
+        return 0.0
+    return round(float(cached_tokens) / prompt_tokens, 3)
+
+
+class UsageStat(object):
+    """ totals of usage, per model, per agent and per session, shared in this process """
+    def __init__(self, max_session_count:int=10000):
+        self.max_session_count = max_session_count
+        self.rlock = threading.RLock()
+        self.total = self.new_counter()
+        # key is model_name, value is counter
+        self.models = {}
+        # key is agent_name, value is counter
+        self.agents = {}
+        # key is session_id, value is counter, the oldest session is dropped
+        self.sessions = OrderedDict()
+
+    @staticmethod
+    def new_counter() -> dict:
+        return dict(
+            call_count=0,
+            prompt_tokens=0,
+            completion_tokens=0,
+            cached_tokens=0,
+            estimated_count=0,
+        )
+
+    @staticmethod
+    def _add_to(counter:dict, usage:dict, estimated:bool):
+        counter["call_count"] += 1
+        counter["prompt_tokens"] += usage["prompt_tokens"]
+        counter["completion_tokens"] += usage["completion_tokens"]
+        counter["cached_tokens"] += usage["cached_tokens"]
+        if estimated:
+            counter["estimated_count"] += 1
+
+    def add(self, usage:dict, model_name:str=None, agent_name:str=None, session_id:str=None, estimated:bool=False):
+        """ record the usage of one call
+
+        :estimated: True if it is counted by local tokenization.
         """
-        self._start_time = int(time.time())
-        self._end_time = 0
-        if lifetime > 0:
-            self._end_time = self._start_time + lifetime + 60
-        self._last_msg_time = 0
+        with self.rlock:
+            self._add_to(self.total, usage, estimated)
+            if model_name:
+                self._add_to(self.models.setdefault(model_name, self.new_counter()), usage, estimated)
+            if agent_name:
+                self._add_to(self.agents.setdefault(agent_name, self.new_counter()), usage, estimated)
+            if session_id:
+                counter = self.sessions.get(session_id)
+                if counter is None:
+                    counter = self.new_counter()
+                    self.sessions[session_id] = counter
+                self.sessions.move_to_end(session_id)
+                self._add_to(counter, usage, estimated)
+                while len(self.sessions) > self.max_session_count:
+                    self.sessions.popitem(last=False)
+        return
+
+    @staticmethod
+    def _to_dict(counter:dict) -> dict:
+        result = dict(counter)
+        result["cached_ratio"] = get_cached_ratio(counter["prompt_tokens"], counter["cached_tokens"])
+        return result
+
+    def get_stats(self) -> dict:
+        """ return dict, keys are total, models, agents, sessions """
+        with self.rlock:
+            return dict(
+                total=self._to_dict(self.total),
+                models={k: self._to_dict(v) for k, v in self.models.items()},
+                agents={k: self._to_dict(v) for k, v in self.agents.items()},
+                sessions={k: self._to_dict(v) for k, v in self.sessions.items()},
+            )
+
+    def get_session_stat(self, session_id:str) -> dict|None:
+        """ return the counter of session """
+        with self.rlock:
+            counter = self.sessions.get(session_id)
+            return self._to_dict(counter) if counter else None
+
+
+# init
+UsageStatInstance = UsageStat()
+
+
+def get_usage_stats() -> dict:
+    """ return totals of usage, per model, per agent and per session """
+    return UsageStatInstance.get_stats()
+
+
+class TokenWorker(object):
+    """ one thread of this process for the local tokenization of all TokenStat.
+
+    It blocks on a queue, so an idle process costs no CPU,
+    and the count of threads does not grow with the count of LLMModel.
+    """
+    def __init__(self, max_queue_size:int=1000):
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.lock = threading.Lock()
+        self.thread = None
+        self.dropped_count = 0
+
+    def _ensure_started(self):
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive():
+                return
+            self.thread = threading.Thread(target=self._run, name="TokenWorker", daemon=True)
+            self.thread.start()
+        return
+
+    def submit(self, token_stat, msgs, content:str, labels:dict):
+        """ count tokens of msgs and content in background, then record them to token_stat """
+        self._ensure_started()
+        try:
+            self.queue.put_nowait((token_stat, msgs, content, labels))
+        except queue.Full:
+            self.dropped_count += 1
+            logger.warning(f"token worker is busy, dropped: {self.dropped_count}")
+        return
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    break
+                token_stat, msgs, content, labels = item
+                token_stat.count_locally(msgs, content, labels)
+            except Exception as e:
+                logger.exception(f"failed to count tokens: {e}")
+            finally:
+                self.queue.task_done()
+        logger.info("TokenWorker is exited")
+        return
+
+    def join(self):
+        """ wait for the submitted items """
+        if self.thread is not None:
+            self.queue.join()
+        return
+
+    def shutdown(self, timeout:float=5):
+        """ process the rest of items, then stop the thread """
+        with self.lock:
+            thread = self.thread
+            self.thread = None
+        if thread is None or not thread.is_alive():
+            return
+        self.queue.put(None)
+        thread.join(timeout)
+        return
+
+
+# init
+TokenWorkerInstance = TokenWorker()
+atexit.register(TokenWorkerInstance.shutdown)
+
+
+# tuple (token_stat, msgs) of the call in this thread or asyncio task, the concurrent calls
+# of one LLMModel (e.g. chat_many) do not take the msgs of each other
+g_pending_msgs = contextvars.ContextVar("token_pending_msgs", default=None)
+
+
+class TokenStat(object):
+    """ tracking token stat of one LLMModel, the tokenization is done by TokenWorkerInstance """
+    def __init__(self, llm_id:str):
+        self.name = f"TokenStat:{llm_id}"
 
-        super(TokenStat, self).__init__(name=f"TokenStat:{llm_id}", daemon=1)
         self.total_count = 0
         self.current_count = 0
 
@@ -83,11 +471,19 @@ class TokenStat(threading.Thread):
 
         self.msg_count = 0
 
-        self.buffer = None
-        self.rlock = threading.RLock()
+        # from the usage of response, or local tokenization if no usage
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached_tokens = 0
+        self.usage_count = 0
+        self.estimated_count = 0
+        self.last_usage = None
+
+        # response cache of LLM
+        self.cache_hit_count = 0
+        self.cache_miss_count = 0
 
-        self.flag_running = True
-        self.start()
+        self.rlock = threading.RLock()
 
 
     def output_token_stat(self):
@@ -99,74 +495,109 @@ class TokenStat(threading.Thread):
                 total_text_len=self.total_text_len,
                 current_text_len=self.current_text_len,
                 msg_count=self.msg_count,
+                prompt_tokens=self.prompt_tokens,
+                completion_tokens=self.completion_tokens,
+                cached_tokens=self.cached_tokens,
+                cached_ratio=get_cached_ratio(self.prompt_tokens, self.cached_tokens),
+                usage_count=self.usage_count,
+                estimated_count=self.estimated_count,
+                last_usage=self.last_usage,
+                cache_hit_count=self.cache_hit_count,
+                cache_miss_count=self.cache_miss_count,
             )
         msg = f"[token_stat] {info}"
         print_step(msg)
         logger.info(msg)
         return
 
-    def add_msgs(self, msgs):
-        """ the msgs will be sent to LLM, save it to buffer for token calc """
+    def add_cache_result(self, is_hit:bool):
+        """ count hit/miss of response cache """
         with self.rlock:
-            self.buffer = msgs
+            if is_hit:
+                self.cache_hit_count += 1
+            else:
+                self.cache_miss_count += 1
 
+    def add_msgs(self, msgs):
+        """ the msgs will be sent to LLM, they are tokenized only if the response has no usage """
+        # they are tokenized only if no usage
+        g_pending_msgs.set((self, msgs))
+        with self.rlock:
             self.msg_count = len(msgs)
             self.current_count = 0
             self.current_text_len = 0
 
-            self._last_msg_time = int(time.time())
-
-    def run(self):
-        self.flag_running = True
-
-        # control frequence
-        count_freq = 0
-        need_freq = False
-        if self._end_time:
-            need_freq = True
-
-        # idle time
-        max_idle_time = 600
-
-        def check():
-            """ return bool """
+    def drop_msgs(self):
+        """ no token is used, e.g. the response is from cache """
+        self.pop_msgs()
 
-            # check lifetime
-            if self._end_time:
-                now_ts = int(time.time())
-                if self._end_time < now_ts:
-                    # end life
-                    if now_ts - self._last_msg_time > max_idle_time:
-                        logger.info("quit due to lifetime is reached")
-                        return False
-                    # LLM may be using by some tools.
+    def pop_msgs(self):
+        """ return the msgs of the current call, None if no found """
+        pending = g_pending_msgs.get()
+        if pending is None or pending[0] is not self:
+            return None
+        g_pending_msgs.set(None)
+        return pending[1]
 
-            return True
+    def add_usage(self, usage, content:str=None, labels:dict=None) -> dict|None:
+        """ record the usage of response.
 
-        while self.flag_running:
+        :usage: response.usage, None if the provider returns no usage.
+        :content: the content of response, for local tokenization.
+        :labels: dict, model_name, agent_name and session_id for UsageStat.
 
-            if need_freq:
-                count_freq += 1
-                # interval is 10 second.
-                if count_freq > 1000:
-                    count_freq = 0
-                    if not check():
-                        break
-
-            time.sleep(0.01)
-            buffer = self.buffer
-            if not buffer:
-                continue
-
-            with self.rlock:
-                self.buffer = None
-
-                if not isinstance(buffer, str):
-                    buffer = str(buffer)
+        return the parsed usage, None if it is left to local tokenization.
+        """
+        parsed = parse_usage(usage)
+        msgs = self.pop_msgs()
+        if is_usage_empty(parsed):
+            if msgs:
+                TokenWorkerInstance.submit(self, msgs, content or "", labels or {})
+            return None
+        self._record(parsed, labels)
+        return parsed
+
+    def add_dropped_usage(self, usage, labels:dict=None) -> dict|None:
+        """ record the usage of a response which is dropped, e.g. the loser of a hedged request.
+
+        The msgs of the current call are kept, it is not counted if the provider returns no usage.
+        """
+        parsed = parse_usage(usage)
+        if is_usage_empty(parsed):
+            return None
+        self._record(parsed, labels)
+        return parsed
 
-                self.current_text_len = len(buffer)
-                self.current_count = count_tokens(buffer)
-                self.total_count += self.current_count
-                self.total_text_len += self.current_text_len
+    def _record(self, usage:dict, labels:dict=None, estimated:bool=False):
+        with self.rlock:
+            self.last_usage = usage
+            self.current_count = usage["prompt_tokens"]
+            self.total_count += usage["prompt_tokens"]
+            self.prompt_tokens += usage["prompt_tokens"]
+            self.completion_tokens += usage["completion_tokens"]
+            self.cached_tokens += usage["cached_tokens"]
+            if estimated:
+                self.estimated_count += 1
+            else:
+                self.usage_count += 1
+        UsageStatInstance.add(usage, estimated=estimated, **(labels or {}))
+        return
 
-        logger.info(f"TokenStat is exited: {self.name}")
+    def count_locally(self, msgs, content:str, labels:dict):
+        """ fallback, the provider returns no usage; it is called by TokenWorker """
+        if isinstance(msgs, str):
+            prompt_tokens = count_tokens(msgs)
+            text_len = len(msgs)
+        else:
+            prompt_tokens = count_messages_tokens(msgs)
+            text_len = sum(len(str(msg.get("content") or "")) for msg in msgs)
+        usage = dict(
+            prompt_tokens=prompt_tokens,
+            completion_tokens=count_tokens(content) if content else 0,
+            cached_tokens=0,
+        )
+        with self.rlock:
+            self.current_text_len = text_len
+            self.total_text_len += self.current_text_len
+        self._record(usage, labels, estimated=True)
+        return
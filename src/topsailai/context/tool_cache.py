@@ -0,0 +1,190 @@
+'''
+  Author: DawsonLin
+  Email: lin_dongsen@126.com
+  Created: 2026-10-17
+  Purpose: session-scoped cache of tool results, for the idempotent tools (e.g. read_file)
+  Env:
+    @TOOL_CACHE: 1 for enabled (default), 0 for disabled;
+    @TOOL_CACHE_TTL: seconds, default is 300, a tool can have its own ttl in TOOLS_META;
+    @TOOL_CACHE_MAX_ENTRIES: default is 1024, the least recently used entries are evicted;
+
+  A tool declares itself cacheable in TOOLS_META, e.g.
+    TOOLS_META = dict(
+        read_file={"cache": {"path_args": ["file_path"]}},
+        check_files_existing={"cache": {"path_args": "*", "ttl": 60}},
+    )
+  :path_args: the arguments which are paths, "*" for all; an entry is stale if mtime/size of a path is changed.
+'''
+
+import os
+import time
+import threading
+from collections import OrderedDict
+
+import simplejson
+
+from topsailai.logger.log_chat import logger
+from topsailai.utils.thread_local_tool import (
+    get_agent_name,
+    get_agent_object,
+    get_session_id,
+)
+
+
+def is_tool_cache_enabled() -> bool:
+    """ env TOOL_CACHE """
+    return os.getenv("TOOL_CACHE", "1") != "0"
+
+def get_scope() -> str|None:
+    """ the session of cache, None if no session and no agent """
+    session_id = get_session_id()
+    if session_id and session_id != "None":
+        return f"session:{session_id}"
+    agent = get_agent_object()
+    if agent is not None:
+        return f"agent:{id(agent)}"
+    return None
+
+def normalize_path(path) -> str|None:
+    if not isinstance(path, str) or not path:
+        return None
+    return os.path.abspath(os.path.expanduser(path))
+
+def get_fingerprint(path:str) -> tuple|None:
+    """ (mtime_ns, size) of path, None if no found """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+class ToolCacheEntry(object):
+    def __init__(self, value, fingerprints:dict, ttl:float):
+        self.value = value
+        # key is path, value is fingerprint
+        self.fingerprints = fingerprints
+        self.expire_at = time.time() + ttl if ttl > 0 else None
+
+    def is_valid(self) -> bool:
+        if self.expire_at is not None and time.time() > self.expire_at:
+            return False
+        for path, fingerprint in self.fingerprints.items():
+            if get_fingerprint(path) != fingerprint:
+                return False
+        return True
+
+
+class ToolCache(object):
+    """ memoized results of the cacheable tools, per session """
+    def __init__(self, ttl:float=300, max_entries:int=1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.rlock = threading.RLock()
+        # key is (scope, agent_name, tool_name, args), value is ToolCacheEntry
+        self.entries = OrderedDict()
+
+        # stat
+        self.hit_count = 0
+        self.miss_count = 0
+        self.invalidated_count = 0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            ttl=float(os.getenv("TOOL_CACHE_TTL", 300)),
+            max_entries=int(os.getenv("TOOL_CACHE_MAX_ENTRIES", 1024)),
+        )
+
+    @staticmethod
+    def get_paths(cache_meta:dict, tool_args:dict) -> list[str]:
+        path_args = cache_meta.get("path_args") or []
+        if path_args == "*":
+            values = list(tool_args.values())
+        else:
+            values = [tool_args.get(name) for name in path_args]
+        return [path for path in map(normalize_path, values) if path]
+
+    def get(self, key:tuple):
+        """ return (True, value) if hit """
+        with self.rlock:
+            entry = self.entries.get(key)
+            if entry is not None and not entry.is_valid():
+                del self.entries[key]
+                entry = None
+            if entry is None:
+                self.miss_count += 1
+                return (False, None)
+            self.entries.move_to_end(key)
+            self.hit_count += 1
+            return (True, entry.value)
+
+    def put(self, key:tuple, value, fingerprints:dict, ttl:float):
+        with self.rlock:
+            self.entries[key] = ToolCacheEntry(value, fingerprints, ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def call(self, tool_name:str, tool_func, tool_args:dict, tool_meta:dict=None):
+        """ return the result of tool_func(**tool_args), it is memoized if the tool is cacheable """
+        cache_meta = (tool_meta or {}).get("cache")
+        scope = get_scope()
+        if not cache_meta or scope is None or not is_tool_cache_enabled():
+            return tool_func(**tool_args)
+
+        try:
+            args_key = simplejson.dumps(tool_args, sort_keys=True, ensure_ascii=False)
+        except TypeError:
+            return tool_func(**tool_args)
+        key = (scope, get_agent_name(), tool_name, args_key)
+        is_hit, value = self.get(key)
+        if is_hit:
+            logger.info(f"tool cache hit: {tool_name} {args_key}")
+            return value
+
+        # the fingerprints are taken before the call, a change during the call makes it stale
+        fingerprints = {path: get_fingerprint(path) for path in self.get_paths(cache_meta, tool_args)}
+        value = tool_func(**tool_args)
+        if value is not None:
+            self.put(key, value, fingerprints, float(cache_meta.get("ttl", self.ttl)))
+        return value
+
+    def invalidate_path(self, path:str):
+        """ drop the entries of this path, e.g. it is written """
+        path = normalize_path(path)
+        if not path:
+            return
+        with self.rlock:
+            keys = [key for key, entry in self.entries.items() if path in entry.fingerprints]
+            for key in keys:
+                del self.entries[key]
+            self.invalidated_count += len(keys)
+        return
+
+    def clear(self, scope:str=None):
+        """ drop the entries of a scope, or all """
+        with self.rlock:
+            if scope is None:
+                self.entries.clear()
+                return
+            for key in [key for key in self.entries if key[0] == scope]:
+                del self.entries[key]
+
+    def to_dict(self) -> dict:
+        with self.rlock:
+            return dict(
+                entry_count=len(self.entries),
+                hit_count=self.hit_count,
+                miss_count=self.miss_count,
+                invalidated_count=self.invalidated_count,
+            )
+
+
+# init
+ToolCacheInstance = ToolCache.from_env()
+
+
+def get_tool_cache_stats() -> dict:
+    """ return the counters of the tool cache """
+    return ToolCacheInstance.to_dict()
@@ -0,0 +1,8 @@
+'''
+  Author: DawsonLin
+  Email: lin_dongsen@126.com
+  Created: 2026-10-17
+  Purpose: a long-lived local daemon, the CLI runs in a process forked from it without cold start.
+    client: thin, only the standard library is imported;
+    server: the warm daemon, see cli/agent_daemon.py;
+'''
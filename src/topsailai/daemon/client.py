@@ -0,0 +1,178 @@
+'''
+  Author: DawsonLin
+  Email: lin_dongsen@126.com
+  Created: 2026-10-17
+  Purpose: the thin client of agent daemon, a CLI runs in the warm daemon instead of a cold python process.
+  Env:
+    @AGENT_DAEMON: 1 for using the daemon if it is running, 0 for disabled (default);
+    @AGENT_DAEMON_SOCKET: the unix socket, default is $XDG_RUNTIME_DIR/topsailai/agent_daemon.sock,
+      or /tmp/topsailai-<uid>/agent_daemon.sock without XDG_RUNTIME_DIR;
+
+  The request carries the env (API keys) and the terminal of user, so the client only connects a socket
+  which is owned by the user, in a folder of mode 0700 owned by the user, no symlink (see check_socket_path).
+
+  Protocol, one JSON per line over the unix socket:
+    client -> daemon: {"script", "argv", "env", "cwd"}, with the fds of stdin/stdout/stderr (SCM_RIGHTS);
+    daemon -> client: {"pid"} once the script is started, or {"error"} if it is refused;
+    client -> daemon: {"signal": "SIGINT"} for Ctrl-C;
+    daemon -> client: {"exit"} at last.
+  The output of script is written to the fds of client directly, so it is streamed.
+'''
+
+import os
+import sys
+import json
+import stat
+import signal
+import socket
+
+# the bytes of a request
+MAX_REQUEST_SIZE = 4 * 1024 * 1024
+
+# True in the process forked by the daemon, the CLI runs there itself
+g_in_daemon = False
+
+
+def get_socket_path() -> str:
+    """ env AGENT_DAEMON_SOCKET """
+    socket_path = os.getenv("AGENT_DAEMON_SOCKET")
+    if socket_path:
+        return socket_path
+    runtime_dir = os.getenv("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return os.path.join(runtime_dir, "topsailai", "agent_daemon.sock")
+    return f"/tmp/topsailai-{os.getuid()}/agent_daemon.sock"
+
+def is_daemon_enabled() -> bool:
+    """ env AGENT_DAEMON """
+    return os.getenv("AGENT_DAEMON", "0") == "1"
+
+def check_socket_dir(folder:str) -> str:
+    """ return the reason if the folder is not private to the user, empty string if it is fine """
+    try:
+        st = os.lstat(folder)
+    except FileNotFoundError:
+        return f"no found such as folder: {folder}"
+    if stat.S_ISLNK(st.st_mode):
+        return f"the folder is a symlink: {folder}"
+    if not stat.S_ISDIR(st.st_mode):
+        return f"not a folder: {folder}"
+    if st.st_uid != os.getuid():
+        return f"the folder is owned by uid {st.st_uid}: {folder}"
+    if stat.S_IMODE(st.st_mode) != 0o700:
+        return f"the mode of folder is {oct(stat.S_IMODE(st.st_mode))}, expect 0o700: {folder}"
+    return ""
+
+def check_socket_path(socket_path:str) -> str:
+    """ return the reason if the socket may be of another user, empty string if it is fine """
+    reason = check_socket_dir(os.path.dirname(os.path.abspath(socket_path)))
+    if reason:
+        return reason
+    try:
+        st = os.lstat(socket_path)
+    except FileNotFoundError:
+        return f"no found such as socket: {socket_path}"
+    if not stat.S_ISSOCK(st.st_mode):
+        return f"not a socket: {socket_path}"
+    if st.st_uid != os.getuid():
+        return f"the socket is owned by uid {st.st_uid}: {socket_path}"
+    return ""
+
+def send_message(sock:socket.socket, msg:dict, fds:list=None):
+    """ send a line of JSON, with the fds if any """
+    data = (json.dumps(msg, ensure_ascii=False) + "\n").encode("utf-8")
+    if fds:
+        sent = socket.send_fds(sock, [data], fds)
+        data = data[sent:]
+    if data:
+        sock.sendall(data)
+    return
+
+def read_messages(sock:socket.socket):
+    """ yield the lines of JSON until the socket is closed """
+    with sock.makefile("r", encoding="utf-8") as sock_file:
+        for line in sock_file:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+    return
+
+def connect(socket_path:str=None) -> socket.socket|None:
+    """ return the socket of daemon, None if it is not running or it is not safe """
+    socket_path = socket_path or get_socket_path()
+    if not os.path.lexists(socket_path):
+        return None
+    reason = check_socket_path(socket_path)
+    if reason:
+        print(f"agent daemon is ignored: {reason}", file=sys.stderr)
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except OSError:
+        sock.close()
+        return None
+    return sock
+
+def run_by_daemon(script_path:str, argv:list, fds:tuple=(0, 1, 2), socket_path:str=None) -> int|None:
+    """ run a CLI script in the daemon, return the exit code, None if the daemon can not run it.
+
+    :script_path: the script in the cli folder, e.g. __file__;
+    :fds: the stdin, stdout and stderr of the script.
+    """
+    if g_in_daemon or not is_daemon_enabled():
+        return None
+    sock = connect(socket_path)
+    if sock is None:
+        return None
+
+    with sock:
+        request = dict(
+            script=os.path.basename(script_path),
+            argv=list(argv),
+            env=dict(os.environ),
+            cwd=os.getcwd(),
+        )
+        try:
+            send_message(sock, request, fds=list(fds))
+        except OSError:
+            return None
+
+        messages = read_messages(sock)
+        msg = next(messages, None)
+        if not msg or "pid" not in msg:
+            if msg and msg.get("error"):
+                print(f"agent daemon: {msg['error']}", file=sys.stderr)
+            return None
+
+        def _forward_signal(signum, _):
+            try:
+                send_message(sock, {"signal": signal.Signals(signum).name})
+            except OSError:
+                pass
+
+        old_handler = None
+        try:
+            old_handler = signal.signal(signal.SIGINT, _forward_signal)
+        except ValueError:
+            # not the main thread
+            pass
+        try:
+            for msg in messages:
+                if "exit" in msg:
+                    return int(msg["exit"])
+        finally:
+            if old_handler is not None:
+                signal.signal(signal.SIGINT, old_handler)
+
+    # the process is gone without exit code
+    return 1
+
+def exit_if_served_by_daemon(script_path:str):
+    """ the hook of a CLI script, call it before the heavy imports.
+    The process exits with the code of script if the daemon runs it, or it goes on as usual.
+    """
+    code = run_by_daemon(script_path, sys.argv[1:])
+    if code is not None:
+        sys.exit(code)
+    return
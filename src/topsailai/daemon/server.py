@@ -0,0 +1,324 @@
+'''
+  Author: DawsonLin
+  Email: lin_dongsen@126.com
+  Created: 2026-10-17
+  Purpose: the agent daemon, it keeps the heavy modules warm (openai, sqlalchemy, tiktoken, tools, prompts)
+    and forks a process for each CLI request, the process runs the script with the env, cwd and
+    stdin/stdout/stderr of client. So a task starts in milliseconds, and the tasks are isolated.
+  Env:
+    @AGENT_DAEMON_SOCKET: the unix socket, see daemon.client;
+
+  The env which is read at import (e.g. TOOL_CACHE) is taken from the daemon, restart it after changing them.
+'''
+
+import os
+import re
+import sys
+import json
+import time
+import errno
+import runpy
+import select
+import signal
+import socket
+import atexit
+import threading
+import importlib
+import traceback
+
+from topsailai.daemon import client
+from topsailai.daemon.client import (
+    get_socket_path,
+    check_socket_dir,
+    send_message,
+    read_messages,
+    MAX_REQUEST_SIZE,
+)
+
+# the modules imported by the daemon before serving
+DEFAULT_WARM_MODULES = (
+    "openai",
+    "sqlalchemy",
+    "dotenv",
+    # scan the tools
+    "topsailai.tools",
+    "topsailai.ai_base.agent_base",
+    "topsailai.ai_base.agent_types.react",
+    "topsailai.context.ctx_manager",
+    # run 'uname -a' for the env prompt
+    "topsailai.context.prompt_env",
+)
+
+# the scripts in the cli folder
+PATTERN_SCRIPT = re.compile(r"^[A-Za-z_]\w*\.py$")
+
+
+def warm_up_resources():
+    """ load the token encoder and the session database """
+    from topsailai.context import token, ctx_manager
+    token.get_encoding_for_model(os.getenv("OPENAI_MODEL"))
+    ctx_manager.get_session_manager()
+    return
+
+def recv_request(conn:socket.socket) -> tuple[dict|None, list]:
+    """ return tuple (request:dict, fds:list), request is None if the client sends nothing (e.g. a status check) """
+    data = b""
+    fds = []
+    while b"\n" not in data:
+        chunk, chunk_fds, _, _ = socket.recv_fds(conn, 65536, 3)
+        fds += chunk_fds
+        if not chunk:
+            break
+        data += chunk
+        if len(data) > MAX_REQUEST_SIZE:
+            break
+    if not data and not fds:
+        return (None, [])
+    if b"\n" not in data:
+        for fd in fds:
+            os.close(fd)
+        raise ValueError("incomplete request")
+    return (json.loads(data.split(b"\n", 1)[0]), fds)
+
+def get_exit_code(e:SystemExit) -> int:
+    if e.code is None:
+        return 0
+    if isinstance(e.code, int):
+        return e.code
+    print(e.code, file=sys.stderr)
+    return 1
+
+
+class AgentDaemon(object):
+    """ a pre-forking server of the CLI scripts """
+    def __init__(self, socket_path:str=None, cli_dir:str=None, warm_modules:tuple=DEFAULT_WARM_MODULES, warm_resources:bool=True):
+        self.socket_path = socket_path or get_socket_path()
+        self.cli_dir = os.path.abspath(cli_dir or os.path.join(os.path.dirname(__file__), "..", "..", "..", "cli"))
+        self.warm_modules = warm_modules
+        self.warm_resources = warm_resources
+
+        self.sock = None
+        self.stopped = False
+        # pid of the running children
+        self.children = set()
+
+        # stat
+        self.request_count = 0
+        self.refused_count = 0
+
+    def warm_up(self):
+        """ import the heavy modules once, the children share them """
+        start_time = time.time()
+        for name in self.warm_modules or ():
+            try:
+                importlib.import_module(name)
+            except Exception as e:
+                print(f"failed to warm up module [{name}]: {e}", file=sys.stderr)
+        if self.warm_resources:
+            try:
+                warm_up_resources()
+            except Exception as e:
+                print(f"failed to warm up resources: {e}", file=sys.stderr)
+        print(f"agent daemon is warmed up in {time.time() - start_time:.2f}s", file=sys.stderr)
+        return
+
+    def listen(self):
+        """ bind the unix socket, only the user can connect it """
+        folder = os.path.dirname(os.path.abspath(self.socket_path))
+        if not os.path.lexists(folder):
+            os.makedirs(os.path.dirname(folder), exist_ok=True)
+            os.mkdir(folder, mode=0o700)
+            os.chmod(folder, 0o700)
+        # the clients refuse it too, the folder must be private
+        reason = check_socket_dir(folder)
+        if reason:
+            raise Exception(f"the folder of socket is not safe, {reason}")
+        if os.path.lexists(self.socket_path):
+            sock = client.connect(self.socket_path)
+            if sock is not None:
+                sock.close()
+                raise Exception(f"agent daemon is running: {self.socket_path}")
+            # stale
+            os.unlink(self.socket_path)
+
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        old_umask = os.umask(0o177)
+        try:
+            self.sock.bind(self.socket_path)
+        finally:
+            os.umask(old_umask)
+        self.sock.listen(64)
+        print(f"agent daemon is listening: {self.socket_path}", file=sys.stderr)
+        return
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+            try:
+                os.unlink(self.socket_path)
+            except FileNotFoundError:
+                pass
+        return
+
+    def stop(self, *_):
+        self.stopped = True
+
+    def reap_children(self):
+        for pid in list(self.children):
+            try:
+                done_pid, _ = os.waitpid(pid, os.WNOHANG)
+            except ChildProcessError:
+                done_pid = pid
+            if done_pid:
+                self.children.discard(pid)
+        return
+
+    def get_script_path(self, script:str) -> str|None:
+        """ the script must be in the cli folder """
+        if not isinstance(script, str) or not PATTERN_SCRIPT.match(script):
+            return None
+        script_path = os.path.join(self.cli_dir, script)
+        if not os.path.isfile(script_path):
+            return None
+        return script_path
+
+    def check_peer(self, conn:socket.socket) -> bool:
+        """ only the same user, if the platform tells """
+        if not hasattr(socket, "SO_PEERCRED"):
+            return True
+        creds = conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, 12)
+        uid = int.from_bytes(creds[4:8], sys.byteorder)
+        return uid == os.getuid()
+
+    def handle(self, conn:socket.socket):
+        """ fork a child for the request """
+        fds = []
+        try:
+            if not self.check_peer(conn):
+                raise ValueError("permission denied")
+            request, fds = recv_request(conn)
+            if request is None:
+                conn.close()
+                return
+            script_path = self.get_script_path(request.get("script"))
+            if script_path is None:
+                raise ValueError(f"no found such as script: {request.get('script')}")
+            if len(fds) != 3:
+                raise ValueError("missing stdin/stdout/stderr")
+        except Exception as e:
+            self.refused_count += 1
+            try:
+                send_message(conn, {"error": str(e)})
+            except OSError:
+                pass
+            for fd in fds:
+                os.close(fd)
+            conn.close()
+            return
+
+        self.request_count += 1
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                code = self.run_in_child(conn, request, script_path, fds)
+            finally:
+                os._exit(code)
+
+        self.children.add(pid)
+        for fd in fds:
+            os.close(fd)
+        conn.close()
+        return
+
+    def run_in_child(self, conn:socket.socket, request:dict, script_path:str, fds:list) -> int:
+        """ run the script as __main__, return the exit code """
+        client.g_in_daemon = True
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        self.sock.close()
+
+        for target_fd, fd in enumerate(fds):
+            os.dup2(fd, target_fd)
+            os.close(fd)
+        sys.stdin = open(0, "r", closefd=False)
+        sys.stdout = open(1, "w", buffering=1, closefd=False)
+        sys.stderr = open(2, "w", buffering=1, closefd=False)
+
+        os.environ.clear()
+        os.environ.update(request.get("env") or {})
+        sys.argv = [script_path] + list(request.get("argv") or [])
+
+        code = 0
+        done_event = threading.Event()
+        try:
+            os.chdir(request.get("cwd") or self.cli_dir)
+            send_message(conn, {"pid": os.getpid()})
+            threading.Thread(target=self.watch_client, args=(conn, done_event), name="watch_client", daemon=True).start()
+            runpy.run_path(script_path, run_name="__main__")
+        except SystemExit as e:
+            code = get_exit_code(e)
+        except KeyboardInterrupt:
+            code = 130
+        except BaseException:
+            traceback.print_exc()
+            code = 1
+
+        try:
+            atexit._run_exitfuncs()
+        except Exception:
+            pass
+        for stream in (sys.stdout, sys.stderr):
+            try:
+                stream.flush()
+            except Exception:
+                pass
+        done_event.set()
+        try:
+            send_message(conn, {"exit": code})
+        except OSError:
+            pass
+        return code
+
+    @staticmethod
+    def watch_client(conn:socket.socket, done_event:threading.Event):
+        """ the signals of client; the task is interrupted if the client is gone """
+        try:
+            for msg in read_messages(conn):
+                signame = msg.get("signal")
+                if signame in ("SIGINT", "SIGTERM") and not done_event.is_set():
+                    os.kill(os.getpid(), getattr(signal, signame))
+        except (OSError, ValueError):
+            pass
+        if not done_event.is_set():
+            os.kill(os.getpid(), signal.SIGINT)
+        return
+
+    def serve_forever(self, need_warm_up:bool=True):
+        """ serve in this thread until SIGTERM/SIGINT """
+        if need_warm_up:
+            self.warm_up()
+        self.listen()
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        try:
+            while not self.stopped:
+                try:
+                    readable, _, _ = select.select([self.sock], [], [], 1.0)
+                except InterruptedError:
+                    continue
+                except OSError as e:
+                    if e.errno == errno.EINTR:
+                        continue
+                    raise
+                self.reap_children()
+                if readable:
+                    conn, _ = self.sock.accept()
+                    self.handle(conn)
+        finally:
+            self.close()
+            print(f"agent daemon is stopped: requests={self.request_count}, refused={self.refused_count}", file=sys.stderr)
+        return
@@ -42,6 +42,13 @@ TOOLS = module_tool.get_function_map("topsailai.tools", "TOOLS")
 # }
 TOOLS_INFO = module_tool.get_function_map("topsailai.tools", "TOOLS_INFO")
 
+# key is tool_name, value is dict
+# Value Example:
+# {
+#     "parallel": True,   # safe to run with other tool calls of the same response, e.g. read-only
+# }
+TOOLS_META = module_tool.get_function_map("topsailai.tools", "TOOLS_META")
+
 
 TOOL_PROMPT = """
 ---
@@ -88,6 +95,10 @@ def expand_plugin_tools():
         if _tools_info:
             TOOLS_INFO.update(_tools_info)
 
+        _tools_meta = module_tool.get_external_function_map(plugin_path, "TOOLS_META")
+        if _tools_meta:
+            TOOLS_META.update(_tools_meta)
+
     return
 
 def generate_tool_info(tool_name, tool_description):
@@ -103,6 +114,11 @@ def generate_tool_info(tool_name, tool_description):
     }
     return result
 
+def is_tool_parallel(tool_name:str) -> bool:
+    """ True if the tool is safe to run concurrently with others, see TOOLS_META """
+    meta = TOOLS_META.get(tool_name) or {}
+    return bool(meta.get("parallel"))
+
 def get_tools_for_chat(tools_name:list[str]) -> dict:
     """ return tools info """
     result = {}
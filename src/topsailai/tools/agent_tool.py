@@ -409,3 +409,10 @@ TOOLS = dict(
     ProgrammingAssistant=agent_programmer,
     WritingAssistantMultiTasks=async_multitasks_agent_writer2,
 )
+
+TOOLS_META = dict(
+    # a sub agent works for a long time, no timeout
+    WritingAssistant={"timeout": 0},
+    ProgrammingAssistant={"timeout": 0},
+    WritingAssistantMultiTasks={"timeout": 0},
+)
@@ -0,0 +1,109 @@
+'''
+  Author: DawsonLin
+  Email: lin_dongsen@126.com
+  Created: 2026-10-17
+  Purpose: batch the independent tool calls of one action, for the text format (no native parallel tool calls)
+  Env:
+    @TOOL_PARALLEL_WORKERS: default is 8, max calls running at the same time;
+'''
+
+import functools
+
+from topsailai.logger import logger
+from topsailai.utils import (
+    env_tool,
+    json_tool,
+)
+from topsailai.utils.thread_tool import run_with_barriers
+from topsailai.utils.thread_local_tool import (
+    get_agent_object,
+)
+from topsailai.ai_base.tool_runner import ToolRunnerInstance
+
+TOOL_NAME_MULTI_CALL = "batch_tool.multi_call"
+
+# the cap of calls in one multi_call
+MAX_CALL_COUNT = 16
+
+
+def get_available_tools() -> dict:
+    """ the tools of the current agent, or all of internal tools """
+    agent = get_agent_object()
+    tools = getattr(agent, "available_tools", None)
+    if tools is None:
+        from topsailai.tools import TOOLS
+        tools = TOOLS
+    return tools
+
+def _call_tool(tool_name:str, tool_func, tool_args:dict):
+    # it is imported here, topsailai.tools is loading this module
+    from topsailai.tools import TOOLS_META
+    try:
+        return ToolRunnerInstance.call(tool_name, tool_func, tool_args, TOOLS_META.get(tool_name))
+    except Exception as e:
+        logger.exception(e)
+        return f"error: {e}"
+
+def multi_call(calls:list):
+    """ call many independent tools in one action, they run concurrently if they are safe to.
+    Use it to batch the actions which do not depend on each other, e.g. reading several files.
+
+    Args:
+        calls (list): list of dict, max 16 items, each item has
+            - tool_call (str), a tool name
+            - tool_args (dict)
+
+    Return a dict, key is "[index] tool_call", value is the result of the tool or the error.
+
+    Example:
+        calls = [
+            {"tool_call": "file_tool.read_file", "tool_args": {"file_path": "/tmp/1.txt"}},
+            {"tool_call": "file_tool.read_file", "tool_args": {"file_path": "/tmp/2.txt"}}
+        ]
+    """
+    if isinstance(calls, str):
+        calls = json_tool.safe_json_load(calls)
+    if isinstance(calls, dict):
+        calls = [calls]
+    if not isinstance(calls, list) or not calls:
+        return "illegal calls, it must be a list of {tool_call, tool_args}"
+    if len(calls) > MAX_CALL_COUNT:
+        return f"too many calls, max is {MAX_CALL_COUNT}"
+
+    # it is imported here, topsailai.tools is loading this module
+    from topsailai.tools import is_tool_parallel
+
+    tools = get_available_tools()
+    keys = []
+    values = []
+    tasks = []
+    for index, call in enumerate(calls):
+        if not isinstance(call, dict):
+            call = {}
+        tool_name = call.get("tool_call")
+        tool_args = call.get("tool_args") or {}
+        if isinstance(tool_args, str):
+            tool_args = json_tool.safe_json_load(tool_args) or {}
+
+        keys.append(f"[{index}] {tool_name}")
+        values.append(None)
+        tool_func = tools.get(tool_name) if tool_name else None
+        if tool_name == TOOL_NAME_MULTI_CALL:
+            values[index] = "multi_call cannot be nested"
+        elif tool_func is None:
+            values[index] = f"no found such as tool: {tool_name}"
+        else:
+            tasks.append((index, functools.partial(_call_tool, tool_name, tool_func, tool_args), is_tool_parallel(tool_name)))
+
+    rets = run_with_barriers(
+        [(func, parallel) for _, func, parallel in tasks],
+        max_workers=env_tool.get_tool_parallel_workers(),
+        thread_name_prefix="multi_call",
+    )
+    for (index, _, _), ret in zip(tasks, rets):
+        values[index] = ret
+    return dict(zip(keys, values))
+
+TOOLS = dict(
+    multi_call=multi_call,
+)
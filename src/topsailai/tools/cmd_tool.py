@@ -1,5 +1,7 @@
+import subprocess
+
 from topsailai.utils.text_tool import safe_decode
-from topsailai.utils.cmd_tool import exec_cmd as exec_command
+from topsailai.utils.cmd_tool import exec_cmd as exec_command, CmdCancelled
 from topsailai.utils.json_tool import safe_json_load
 from topsailai.context import ctx_safe
 
@@ -49,12 +51,14 @@ def format_return(cmd_string:str, t:tuple):
 
     return _format_return(cmd_string, t)
 
-def exec_cmd(cmd:str|list, no_need_stderr:bool=False):
+def exec_cmd(cmd:str|list, no_need_stderr:bool=False, timeout:int=None):
     """ execute command
 
     Args:
         cmd (str|list): str for shell, example "echo hello" or ["echo", "hello"]
         no_need_stderr (bool, optional): if True, stderr still be null. Defaults to False.
+        timeout (int, optional): seconds, the command and its children are killed after it.
+            For a long command, use job_tool.start_job instead.
 
     Returns:
         tuple: (code, stdout, stderr)
@@ -68,10 +72,16 @@ def exec_cmd(cmd:str|list, no_need_stderr:bool=False):
     if not isinstance(cmd, str) and not isinstance(cmd, list):
         return "illegal cmd"
 
-    result = exec_command(
-        cmd,
-        no_need_stderr=no_need_stderr,
-    )
+    try:
+        result = exec_command(
+            cmd,
+            no_need_stderr=no_need_stderr,
+            timeout=timeout or None,
+        )
+    except subprocess.TimeoutExpired as e:
+        result = (-1, e.output or b"", safe_decode(e.stderr or b"") + f"\ntimeout after {timeout}s, the command is killed")
+    except CmdCancelled as e:
+        result = (-1, e.stdout, safe_decode(e.stderr) + f"\n{e}")
 
     cmd_string = " ".join(cmd) if isinstance(cmd, list) else cmd
 
@@ -35,3 +35,7 @@ def retrieve_msg(msg_id:str):
 TOOLS = dict(
     retrieve_msg=retrieve_msg,
 )
+
+TOOLS_META = dict(
+    retrieve_msg={"parallel": True},
+)
@@ -11,6 +11,7 @@ import os
 import traceback
 
 from topsailai.context import ctx_safe
+from topsailai.context.tool_cache import ToolCacheInstance
 from topsailai.utils import text_tool
 from topsailai.utils import print_tool
 
@@ -38,6 +39,8 @@ def write_file(file_path:str, content:str):
             fd.write(content)
     except Exception as e:
         return str(e)
+    finally:
+        ToolCacheInstance.invalidate_path(file_path)
     return ""
 
 def _do_step_read_bytes(fd, size:int):
@@ -135,6 +138,8 @@ def append_file(file_path: str, content: str):
             fd.write(content)
     except Exception as e:
         return str(e)
+    finally:
+        ToolCacheInstance.invalidate_path(file_path)
     return ""
 
 def exists_file(file_path:str):
@@ -190,6 +195,12 @@ TOOLS = dict(
     mkdirs=mkdirs,
 )
 
+# the read-only tools can run concurrently, and their results are cached in a session
+TOOLS_META = dict(
+    read_file={"parallel": True, "cache": {"path_args": ["file_path"]}},
+    check_files_existing={"parallel": True, "cache": {"path_args": "*"}},
+)
+
 TOOLS_INFO = dict(
     check_files_existing={
         "type": "function",
@@ -0,0 +1,73 @@
+'''
+  Author: DawsonLin
+  Email: lin_dongsen@126.com
+  Created: 2026-10-17
+  Purpose: run a long command in background, and poll it later
+'''
+
+from topsailai.utils.job_tool import JobManagerInstance
+from topsailai.context import ctx_safe
+
+
+def _format_job(job, tail:int=0) -> dict:
+    info = job.to_dict(tail=tail)
+    if "output" in info:
+        info["output"] = ctx_safe.truncate_message(info["output"]).strip()
+    return info
+
+def start_job(cmd:str|list, timeout:int=3600):
+    """ start a long command in background (e.g. build, test, download), return a job handle at once.
+    Then use job_tool.poll_job to check it, instead of waiting in cmd_tool.exec_cmd.
+
+    Args:
+        cmd (str|list): str for shell, example "make test" or ["make", "test"]
+        timeout (int, optional): seconds, the job is killed after it. Defaults to 3600, 0 for no timeout.
+
+    Return dict, e.g. {"job_id": "job-1", "status": "running", ...}
+    """
+    try:
+        job = JobManagerInstance.start(cmd, timeout=timeout)
+    except Exception as e:
+        return f"error: {e}"
+    return _format_job(job)
+
+def poll_job(job_id:str, tail:int=3000):
+    """ get the status and the last output of a background job.
+
+    Args:
+        job_id (str): from job_tool.start_job
+        tail (int, optional): the last bytes of output. Defaults to 3000.
+
+    Return dict, status is one of running/done/timeout/cancelled, returncode is null if running.
+    """
+    job = JobManagerInstance.get(job_id)
+    if job is None:
+        return f"no found such as job: {job_id}"
+    return _format_job(job, tail=tail or 3000)
+
+def cancel_job(job_id:str):
+    """ kill a background job, include of its child processes.
+
+    Args:
+        job_id (str): from job_tool.start_job
+    """
+    job = JobManagerInstance.cancel(job_id)
+    if job is None:
+        return f"no found such as job: {job_id}"
+    return _format_job(job)
+
+def list_jobs():
+    """ list the background jobs """
+    return [_format_job(job) for job in JobManagerInstance.list()]
+
+TOOLS = dict(
+    start_job=start_job,
+    poll_job=poll_job,
+    cancel_job=cancel_job,
+    list_jobs=list_jobs,
+)
+
+TOOLS_META = dict(
+    poll_job={"parallel": True},
+    list_jobs={"parallel": True},
+)
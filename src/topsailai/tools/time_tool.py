@@ -29,3 +29,8 @@ TOOLS = dict(
     get_local_date=get_local_date,
     get_local_time=get_local_time,
 )
+
+TOOLS_META = dict(
+    get_local_date={"parallel": True},
+    get_local_time={"parallel": True},
+)
@@ -6,10 +6,24 @@
 '''
 
 import os
+import time
+import signal
 import socket
 import subprocess
 
 from .text_tool import safe_decode
+from .thread_local_tool import get_cancel_event
+
+# seconds, how often a running command checks the cancel event
+POLL_SECONDS = 0.2
+
+
+class CmdCancelled(Exception):
+    """ the command is cancelled, its process group is killed """
+    def __init__(self, message:str, stdout=b"", stderr=b""):
+        super().__init__(message)
+        self.stdout = stdout
+        self.stderr = stderr
 
 
 def build_env(d:dict=None):
@@ -36,10 +50,66 @@ def build_env(d:dict=None):
     return env
 
 
-def exec_cmd(cmd:str|list, no_need_stderr:bool=False, timeout:int=None):
+def kill_process_group(p:subprocess.Popen, grace:float=3.0):
+    """Kill the process group of a command, include of its children (e.g. curl of a shell).
+
+    SIGTERM first, then SIGKILL after the leader exits or grace seconds.
+
+    Args:
+        p (subprocess.Popen): started with start_new_session=True
+        grace (float): seconds to wait for SIGTERM
+    """
+    for sig in (signal.SIGTERM, signal.SIGKILL):
+        try:
+            os.killpg(p.pid, sig)
+        except (ProcessLookupError, PermissionError):
+            break
+        if sig == signal.SIGTERM:
+            try:
+                p.wait(timeout=grace)
+            except subprocess.TimeoutExpired:
+                pass
+    return
+
+def wait_process(p:subprocess.Popen, timeout:float=None, cancel_event=None) -> tuple:
+    """Wait for a command, kill its process group on timeout or cancellation.
+
+    Args:
+        p (subprocess.Popen): started with start_new_session=True, stdout and stderr are PIPE
+        timeout (float, optional): seconds, None for no timeout
+        cancel_event (threading.Event, optional): the command is killed once it is set
+
+    Returns:
+        tuple: (stdout, stderr) as bytes
+
+    Raises:
+        subprocess.TimeoutExpired: on timeout, with the output so far
+        CmdCancelled: on cancellation
+    """
+    deadline = time.time() + timeout if timeout else None
+    while True:
+        wait_seconds = None if cancel_event is None else POLL_SECONDS
+        if deadline is not None:
+            remaining = max(0, deadline - time.time())
+            wait_seconds = remaining if wait_seconds is None else min(wait_seconds, remaining)
+        try:
+            return p.communicate(timeout=wait_seconds)
+        except subprocess.TimeoutExpired:
+            pass
+
+        if cancel_event is not None and cancel_event.is_set():
+            kill_process_group(p)
+            stdout, stderr = p.communicate()
+            raise CmdCancelled("the command is cancelled", stdout=stdout, stderr=stderr)
+        if deadline is not None and time.time() >= deadline:
+            kill_process_group(p)
+            stdout, stderr = p.communicate()
+            raise subprocess.TimeoutExpired(p.args, timeout, output=stdout, stderr=stderr)
+
+def exec_cmd(cmd:str|list, no_need_stderr:bool=False, timeout:int=None, cancel_event=None):
     """Execute a shell command and return the result.
 
-    This function runs a command using subprocess.run, capturing stdout and stderr.
+    This function runs a command in a new process group, capturing stdout and stderr.
     It automatically handles encoding of output and allows suppressing stderr output.
 
     Args:
@@ -47,8 +117,12 @@ def exec_cmd(cmd:str|list, no_need_stderr:bool=False, timeout:int=None):
         no_need_stderr (bool): If True, stderr will be returned as empty string.
                                Defaults to False.
         timeout (int, optional): Timeout in seconds. If the command does not finish
-                                 within this time, a subprocess.TimeoutExpired
-                                 exception will be raised. Defaults to None.
+                                 within this time, its process group is killed and a
+                                 subprocess.TimeoutExpired exception will be raised.
+                                 Defaults to None.
+        cancel_event (threading.Event, optional): Kill the command once it is set, and
+                                 raise CmdCancelled. Defaults to the cancel event of the
+                                 running tool (see ToolRunner).
 
     Returns:
         tuple: (return_code, stdout, stderr) where stdout and stderr are strings.
@@ -62,20 +136,22 @@ def exec_cmd(cmd:str|list, no_need_stderr:bool=False, timeout:int=None):
         (2, "", "")
     """
     env = build_env()
-    result = subprocess.run(
+    if cancel_event is None:
+        cancel_event = get_cancel_event()
+    p = subprocess.Popen(
         cmd,
         env=env,
         shell=isinstance(cmd, str),
-        check=False,
         stdout=subprocess.PIPE,
         stderr=subprocess.PIPE,
         text=False,
-        timeout=timeout,
+        start_new_session=True,
     )
+    stdout, stderr = wait_process(p, timeout=timeout, cancel_event=cancel_event)
     return (
-        result.returncode,
-        safe_decode(result.stdout),
-        "" if no_need_stderr else safe_decode(result.stderr),
+        p.returncode,
+        safe_decode(stdout),
+        "" if no_need_stderr else safe_decode(stderr),
     )
 
 def exec_cmd_in_remote(cmd:str, remote:str, port=22, timeout:int=None):
@@ -49,6 +49,32 @@ def is_chat_multi_line() -> bool:
         return False
     return True
 
+def is_agent_stream() -> bool:
+    """Check if streaming mode of the agent loop is enabled.
+
+    Streaming mode is determined by the AGENT_STREAM environment variable:
+    - AGENT_STREAM="0" or not set: The whole response is parsed at the end (returns False)
+    - AGENT_STREAM="1" or any other value: The steps are parsed from the stream,
+      and a tool action starts before the stream ends (returns True)
+
+    Returns:
+        bool: True if streaming mode is enabled, False otherwise
+    """
+    if os.getenv("AGENT_STREAM", "0") == "0":
+        return False
+    return True
+
+def get_tool_parallel_workers() -> int:
+    """Get the max tool calls running at the same time.
+
+    It is determined by the TOOL_PARALLEL_WORKERS environment variable, default is 8, 1 for sequential.
+    It works for the tool calls of one response and the calls of batch_tool.multi_call.
+
+    Returns:
+        int: max workers, at least 1
+    """
+    return max(1, int(os.getenv("TOOL_PARALLEL_WORKERS", 8)))
+
 
 class EnvironmentReader(object):
 
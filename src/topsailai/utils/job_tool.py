@@ -0,0 +1,158 @@
+'''
+  Author: DawsonLin
+  Email: lin_dongsen@126.com
+  Created: 2026-10-17
+  Purpose: background jobs of commands, the agent polls them by job id
+  Env:
+    @TOOL_JOB_MAX_COUNT: default is 16, max jobs running at the same time;
+'''
+
+import os
+import time
+import atexit
+import tempfile
+import threading
+import subprocess
+
+from .cmd_tool import build_env, kill_process_group
+from .text_tool import safe_decode
+
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_TIMEOUT = "timeout"
+STATUS_CANCELLED = "cancelled"
+
+
+class Job(object):
+    def __init__(self, job_id:str, cmd:str|list, proc:subprocess.Popen, log_path:str, timeout:float=None):
+        self.job_id = job_id
+        self.cmd = cmd
+        self.proc = proc
+        # stdout and stderr
+        self.log_path = log_path
+        self.timeout = timeout
+        self.started_at = time.time()
+        self.ended_at = None
+        self.status = STATUS_RUNNING
+
+    def read_output(self, tail:int=3000) -> str:
+        """ the last 'tail' bytes of output, all if tail <= 0 """
+        try:
+            with open(self.log_path, "rb") as fd:
+                if tail and tail > 0:
+                    fd.seek(0, os.SEEK_END)
+                    fd.seek(max(0, fd.tell() - tail))
+                return safe_decode(fd.read())
+        except OSError:
+            return ""
+
+    def to_dict(self, tail:int=0) -> dict:
+        ended_at = self.ended_at or time.time()
+        info = dict(
+            job_id=self.job_id,
+            cmd=self.cmd,
+            status=self.status,
+            returncode=self.proc.returncode,
+            seconds=round(ended_at - self.started_at, 1),
+        )
+        if tail:
+            info["output"] = self.read_output(tail)
+        return info
+
+
+class JobManager(object):
+    """ start commands in their own process group, the output goes to a file """
+    def __init__(self, max_count:int=16, log_dir:str=None):
+        self.max_count = max_count
+        self.log_dir = log_dir
+        self.rlock = threading.RLock()
+        # key is job_id, value is Job
+        self.jobs = {}
+        self.seq = 0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_count=int(os.getenv("TOOL_JOB_MAX_COUNT", 16)),
+        )
+
+    def get_log_dir(self) -> str:
+        if not self.log_dir:
+            self.log_dir = tempfile.mkdtemp(prefix="topsailai_jobs_")
+        return self.log_dir
+
+    def get_running_count(self) -> int:
+        with self.rlock:
+            return len([job for job in self.jobs.values() if job.status == STATUS_RUNNING])
+
+    def start(self, cmd:str|list, timeout:float=None) -> Job:
+        """ start a job, raise Exception if too many jobs are running """
+        with self.rlock:
+            if self.get_running_count() >= self.max_count:
+                raise Exception(f"too many running jobs, max is {self.max_count}")
+            self.seq += 1
+            job_id = f"job-{self.seq}"
+
+        log_path = os.path.join(self.get_log_dir(), f"{job_id}.log")
+        with open(log_path, "wb") as fd:
+            proc = subprocess.Popen(
+                cmd,
+                env=build_env(),
+                shell=isinstance(cmd, str),
+                stdin=subprocess.DEVNULL,
+                stdout=fd,
+                stderr=subprocess.STDOUT,
+                start_new_session=True,
+            )
+        job = Job(job_id, cmd, proc, log_path, timeout=timeout)
+        with self.rlock:
+            self.jobs[job_id] = job
+        threading.Thread(target=self._wait, args=(job,), name=f"wait:{job_id}", daemon=True).start()
+        return job
+
+    def _wait(self, job:Job):
+        try:
+            job.proc.wait(timeout=job.timeout or None)
+        except subprocess.TimeoutExpired:
+            self._kill(job, STATUS_TIMEOUT)
+            return
+        with self.rlock:
+            if job.status == STATUS_RUNNING:
+                job.status = STATUS_DONE
+                job.ended_at = time.time()
+        return
+
+    def _kill(self, job:Job, status:str):
+        with self.rlock:
+            if job.status != STATUS_RUNNING:
+                return
+            job.status = status
+        kill_process_group(job.proc)
+        job.proc.wait()
+        job.ended_at = time.time()
+        return
+
+    def get(self, job_id:str) -> Job|None:
+        with self.rlock:
+            return self.jobs.get(job_id)
+
+    def cancel(self, job_id:str) -> Job|None:
+        """ kill the process group of a job """
+        job = self.get(job_id)
+        if job is not None:
+            self._kill(job, STATUS_CANCELLED)
+        return job
+
+    def list(self) -> list[Job]:
+        with self.rlock:
+            return list(self.jobs.values())
+
+    def cancel_all(self):
+        for job in self.list():
+            self._kill(job, STATUS_CANCELLED)
+        return
+
+
+# init
+JobManagerInstance = JobManager.from_env()
+atexit.register(JobManagerInstance.cancel_all)
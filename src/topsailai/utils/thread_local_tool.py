@@ -1,4 +1,4 @@
-import threading
+import contextvars
 from contextlib import contextmanager
 
 # Define static variables for thread-local storage keys
@@ -6,8 +6,14 @@ KEY_AGENT_NAME = "agent_name"
 KEY_SESSION_ID = "session_id"
 KEY_AGENT_OBJECT = "agent_object"
 
-# Define a thread-local storage object
-g_thr_local = threading.local()
+# Define a context-local storage object, a dict of name to value.
+# It is local to each thread and to each asyncio task (a task copies the context when it is created),
+# so many agents can run in one thread, see AgentRun.arun.
+# The dict is replaced on each change, it is never shared by two contexts.
+g_ctx_vars = contextvars.ContextVar("topsailai_thread_vars", default=None)
+
+def _get_vars() -> dict:
+    return g_ctx_vars.get() or {}
 
 # Limit the depth of recursive calls for agent.
 MAX_AGENT_DEEP = 3
@@ -16,6 +22,9 @@ KEY_AGENT_DEEP = "agent_deep" # value is number for count
 # Flag debug
 KEY_FLAG_DEBUG = "flag_debug" # 0 is disabled
 
+# threading.Event, it is set if the running tool is cancelled, e.g. timeout
+KEY_CANCEL_EVENT = "cancel_event"
+
 
 def set_thread_var(name, value):
     """Set a variable in thread-local storage.
@@ -24,7 +33,9 @@ def set_thread_var(name, value):
         name: Variable name to set
         value: Value to store
     """
-    setattr(g_thr_local, name, value)
+    thread_vars = dict(_get_vars())
+    thread_vars[name] = value
+    g_ctx_vars.set(thread_vars)
     return
 
 def rid_all_thread_vars():
@@ -33,8 +44,33 @@ def rid_all_thread_vars():
     This clears all thread-specific data, useful for cleanup
     when a thread is being reused or terminated.
     """
-    for k in list(g_thr_local.__dict__.keys()):
-        delattr(g_thr_local, k)
+    g_ctx_vars.set({})
+    return
+
+def get_thread_vars() -> dict:
+    """Get a copy of all variables in thread-local storage.
+
+    Returns:
+        dict: name to value, it can be given to ctxm_set_thread_vars in another thread
+    """
+    return dict(_get_vars())
+
+@contextmanager
+def ctxm_set_thread_vars(thread_vars:dict):
+    """Context manager to carry the thread-local variables into a worker thread.
+
+    Args:
+        thread_vars: the result of get_thread_vars
+    """
+    old_vars = get_thread_vars()
+    for k, v in thread_vars.items():
+        set_thread_var(k, v)
+    try:
+        yield
+    finally:
+        rid_all_thread_vars()
+        for k, v in old_vars.items():
+            set_thread_var(k, v)
     return
 
 def get_thread_var(name, default=None):
@@ -47,7 +83,7 @@ def get_thread_var(name, default=None):
     Returns:
         The stored value or default if not found
     """
-    return getattr(g_thr_local, name, default)
+    return _get_vars().get(name, default)
 
 def unset_thread_var(name):
     """Remove a specific variable from thread-local storage.
@@ -55,8 +91,11 @@ def unset_thread_var(name):
     Args:
         name: Variable name to remove
     """
-    if hasattr(g_thr_local, name):
-        delattr(g_thr_local, name)
+    thread_vars = _get_vars()
+    if name in thread_vars:
+        thread_vars = dict(thread_vars)
+        del thread_vars[name]
+        g_ctx_vars.set(thread_vars)
     return
 
 def incr_agent_deep():
@@ -169,3 +208,40 @@ def get_agent_object():
         object: Current agent object, or None if not set
     """
     return get_thread_var(KEY_AGENT_OBJECT)
+
+@contextmanager
+def ctxm_set_cancel_event(cancel_event):
+    """Context manager to give a cancel event to the running tool.
+
+    A long tool can check is_cancelled() and stop early, see ToolRunner.
+
+    Args:
+        cancel_event: threading.Event
+    """
+    old_event = get_thread_var(KEY_CANCEL_EVENT)
+    set_thread_var(KEY_CANCEL_EVENT, cancel_event)
+    try:
+        yield
+    finally:
+        if old_event is not None:
+            set_thread_var(KEY_CANCEL_EVENT, old_event)
+        else:
+            unset_thread_var(KEY_CANCEL_EVENT)
+    return
+
+def get_cancel_event():
+    """Get the cancel event of the running tool.
+
+    Returns:
+        threading.Event: or None if the tool can not be cancelled
+    """
+    return get_thread_var(KEY_CANCEL_EVENT)
+
+def is_cancelled() -> bool:
+    """Check if the running tool is cancelled.
+
+    Returns:
+        bool: True if it should stop
+    """
+    cancel_event = get_cancel_event()
+    return cancel_event is not None and cancel_event.is_set()
@@ -6,6 +6,12 @@
 '''
 
 import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from topsailai.utils.thread_local_tool import (
+    get_thread_vars,
+    ctxm_set_thread_vars,
+)
 
 def wait_thrs(thrs: list):
     """
@@ -29,3 +35,52 @@ def is_main_thread():
         False
     """
     return threading.current_thread() is threading.main_thread()
+
+def run_with_barriers(tasks:list, max_workers:int=8, thread_name_prefix:str="barrier") -> list:
+    """Run the tasks in order, the consecutive parallel ones run concurrently.
+
+    Args:
+        tasks (list): list of tuple (func, parallel:bool), func has no argument.
+            A task which is not parallel is a barrier, it runs alone after the tasks before it.
+        max_workers (int): max tasks running at the same time, 1 for sequential.
+        thread_name_prefix (str): name of worker threads.
+
+    Returns:
+        list: the results of tasks, in order. The exception of a task is raised.
+
+    Note:
+        The thread-local variables (agent, session) are carried into the worker threads.
+    """
+    results = [None] * len(tasks)
+    thread_vars = get_thread_vars()
+
+    def _call(func):
+        with ctxm_set_thread_vars(thread_vars):
+            return func()
+
+    def _run_group(group:list):
+        if len(group) == 1 or max_workers <= 1:
+            for i in group:
+                results[i] = tasks[i][0]()
+            return
+        with ThreadPoolExecutor(
+                max_workers=min(max_workers, len(group)),
+                thread_name_prefix=thread_name_prefix,
+            ) as executor:
+            futures = [(i, executor.submit(_call, tasks[i][0])) for i in group]
+        for i, future in futures:
+            results[i] = future.result()
+        return
+
+    group = []
+    for i, (_, parallel) in enumerate(tasks):
+        if parallel:
+            group.append(i)
+            continue
+        if group:
+            _run_group(group)
+            group = []
+        _run_group([i])
+    if group:
+        _run_group(group)
+    return results
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+  Benchmark for AgentRun._run against the offline stub server.
+
+  It measures the overhead of the agent loop, the retry behaviour and the throughput,
+  without any network.
+
+  Usage:
+    python tests/benchmark/bench_agent_loop.py
+    python tests/benchmark/bench_agent_loop.py -r dump.AgentReAct.xxx.msg -l 0.2 -t 100 -n 5 -c 4
+    python tests/benchmark/bench_agent_loop.py --rate_limit_ratio 0.1
+    python tests/benchmark/bench_agent_loop.py --stream -t 200
+    python tests/benchmark/bench_agent_loop.py --stream -t 200 --format topsailai --tail 400
+    python tests/benchmark/bench_agent_loop.py -l 0.5 --env_mode dynamic
+'''
+
+import os
+import sys
+import time
+import argparse
+import threading
+
+workspace_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, workspace_root + "/src")
+
+# text format, no tool_calls, no debug print
+os.environ["USE_TOOL_CALLS"] = "0"
+os.environ["DEBUG"] = "0"
+os.environ.pop("MODEL_SETTINGS", None)
+os.environ.pop("CONTEXT_HISTORY_MANAGERS", None)
+
+from topsailai.utils import json_tool, format_tool
+from topsailai.ai_base.llm_stub import (
+    StubLLMServer,
+    StubConfig,
+    load_recorded_responses,
+)
+
+
+def get_synthetic_responses(turns:int, fmt:str="json", tail:int=0) -> list[str]:
+    """ some actions, then final_answer.
+
+    :tail: chars of a hallucinated observation after each action.
+    """
+    responses = []
+    for i in range(turns):
+        steps = [
+            {"step_name": "thought", "raw_text": f"step {i}, I need to know the date."},
+            {"step_name": "action", "tool_call": "time_tool.get_local_date", "tool_args": {}},
+        ]
+        if tail > 0:
+            steps.append({"step_name": "observation", "raw_text": "x" * tail})
+        responses.append(steps)
+    responses.append([
+        {"step_name": "thought", "raw_text": "I know the answer."},
+        {"step_name": "final_answer", "raw_text": "done"},
+    ])
+
+    if fmt == "topsailai":
+        return [
+            format_tool.to_topsailai_format(
+                json_tool.json_dump(steps), key_name="step_name", value_name="raw_text",
+            ).strip()
+            for steps in responses
+        ]
+    return [json_tool.json_dump(steps) for steps in responses]
+
+def get_params():
+    parser = argparse.ArgumentParser(description="benchmark for the agent loop")
+    parser.add_argument("-r", "--record", dest="record", type=str, default=None,
+                        help="a file of dump messages, default is synthetic responses")
+    parser.add_argument("--turns", dest="turns", type=int, default=10,
+                        help="turns of synthetic responses")
+    parser.add_argument("-l", "--latency", dest="latency", type=float, default=0.0)
+    parser.add_argument("-t", "--tokens_per_second", dest="tokens_per_second", type=float, default=0.0)
+    parser.add_argument("--rate_limit_ratio", dest="rate_limit_ratio", type=float, default=0.0)
+    parser.add_argument("--server_error_ratio", dest="server_error_ratio", type=float, default=0.0)
+    parser.add_argument("-n", "--runs", dest="runs", type=int, default=3, help="runs of each worker")
+    parser.add_argument("-c", "--concurrency", dest="concurrency", type=int, default=1)
+    parser.add_argument("-s", "--seed", dest="seed", type=int, default=1)
+    parser.add_argument("--stream", dest="stream", action="store_true", default=False,
+                        help="streaming agent loop, AGENT_STREAM=1")
+    parser.add_argument("--format", dest="format", type=str, default="json", choices=["json", "topsailai"],
+                        help="format of synthetic responses")
+    parser.add_argument("--tail", dest="tail", type=int, default=0,
+                        help="chars of a hallucinated observation after each action")
+    parser.add_argument("--no_early_stop", dest="no_early_stop", action="store_true", default=False,
+                        help="LLM_EARLY_STOP=0")
+    parser.add_argument("--env_mode", dest="env_mode", type=str, default="stable",
+                        choices=["dynamic", "stable", "tail"], help="PROMPT_ENV_MODE")
+    return parser.parse_args()
+
+def run_agent() -> float:
+    """ return seconds """
+    from topsailai.ai_base.agent_base import AgentRun
+    from topsailai.ai_base.agent_types import react
+
+    agent = AgentRun(
+        react.SYSTEM_PROMPT,
+        tools=None,
+        agent_name=react.AGENT_NAME,
+        tool_kits=["time_tool.get_local_date"],
+    )
+    start_time = time.time()
+    answer = agent.run(react.Step4ReAct(), "what is the date?")
+    assert answer is not None, "agent is failed"
+    return time.time() - start_time
+
+def main():
+    args = get_params()
+    os.environ["AGENT_STREAM"] = "1" if args.stream else "0"
+    os.environ["LLM_EARLY_STOP"] = "0" if args.no_early_stop else "1"
+    os.environ["PROMPT_ENV_MODE"] = args.env_mode
+    responses = load_recorded_responses(args.record) if args.record \
+        else get_synthetic_responses(args.turns, fmt=args.format, tail=args.tail)
+    config = StubConfig(
+        latency=args.latency,
+        tokens_per_second=args.tokens_per_second,
+        rate_limit_ratio=args.rate_limit_ratio,
+        server_error_ratio=args.server_error_ratio,
+        seed=args.seed,
+    )
+
+    with StubLLMServer(responses, config) as server:
+        os.environ["OPENAI_API_BASE"] = server.base_url
+        os.environ["OPENAI_API_KEY"] = "stub"
+
+        durations = []
+        lock = threading.Lock()
+
+        def _worker():
+            for _ in range(args.runs):
+                seconds = run_agent()
+                with lock:
+                    durations.append(seconds)
+
+        start_time = time.time()
+        thrs = [threading.Thread(target=_worker) for _ in range(args.concurrency)]
+        for thr in thrs:
+            thr.start()
+        for thr in thrs:
+            thr.join()
+        total_seconds = time.time() - start_time
+
+        stat = server.stat.to_dict()
+
+    runs = len(durations)
+    assert runs, "no run is done"
+    requests = stat["request_count"]
+    model_seconds = requests * args.latency
+    if args.tokens_per_second > 0:
+        model_seconds += (stat["completion_tokens"] - stat["unsent_tokens"]) / args.tokens_per_second
+    agent_seconds = sum(durations)
+
+    print(f"runs: {runs}, concurrency: {args.concurrency}, turns/run: {len(responses)}")
+    print(f"stub: {stat}")
+    print(f"total: {total_seconds:.3f}s, throughput: {runs / total_seconds:.2f} runs/s, {requests / total_seconds:.2f} req/s")
+    print(f"per run: avg={agent_seconds / runs:.3f}s, min={min(durations):.3f}s, max={max(durations):.3f}s")
+    print(f"retries: {requests - runs * len(responses)}")
+    saved_tokens = stat["stopped_tokens"] + stat["unsent_tokens"]
+    saved_seconds = saved_tokens / args.tokens_per_second if args.tokens_per_second > 0 else 0.0
+    print(f"early stop: saved {saved_tokens} output tokens (stop sequences: {stat['stopped_tokens']}, "
+          f"aborted streams: {stat['unsent_tokens']}), about {saved_seconds:.3f}s of generation")
+    cached_ratio = stat["cached_tokens"] / stat["prompt_tokens"] if stat["prompt_tokens"] else 0.0
+    print(f"prefix cache ({args.env_mode}): cached {stat['cached_tokens']} of {stat['prompt_tokens']} prompt tokens, "
+          f"ratio={cached_ratio:.3f}")
+    print(f"agent-loop overhead: {(agent_seconds - model_seconds) / max(1, requests) * 1000:.2f} ms/request")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+  Benchmark for LLMModel.build_parameters_for_chat as a session grows.
+
+  It compares the legacy way (deepcopy and format all of messages each turn)
+  with the memoized formatting, the per-turn overhead should stay flat.
+
+  Usage:
+    python tests/benchmark/bench_format_messages.py
+    python tests/benchmark/bench_format_messages.py -m 800 -s 100
+'''
+
+import os
+import sys
+import copy
+import time
+import argparse
+
+workspace_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, workspace_root + "/src")
+
+os.environ["DEBUG"] = "0"
+os.environ.pop("MODEL_SETTINGS", None)
+os.environ.setdefault("OPENAI_API_KEY", "bench")
+
+from topsailai.utils import json_tool, format_tool
+from topsailai.ai_base import llm_base
+
+
+def legacy_format_messages(messages, key_name, value_name):
+    """ the way before memoizing, for comparing """
+    messages = copy.deepcopy(messages)
+    if format_tool.TOPSAILAI_FORMAT_PREFIX not in messages[0]["content"]:
+        return messages
+    for msg in messages[2:]:
+        if msg["content"][0] in ["[", "{"]:
+            new_content = format_tool.to_topsailai_format(
+                msg["content"], key_name=key_name, value_name=value_name,
+            )
+            if new_content:
+                msg["content"] = new_content.strip()
+    return messages
+
+def new_turn(i:int) -> list[dict]:
+    """ one assistant message and one observation """
+    return [
+        {
+            "role": "assistant",
+            "content": json_tool.json_dump([
+                {"step_name": "thought", "raw_text": f"turn {i}, I need to read the file. " * 5},
+                {"step_name": "action", "tool_call": "file_tool.read_file", "tool_args": {"file_path": f"/tmp/{i}.txt"}},
+            ]),
+        },
+        {
+            "role": "user",
+            "content": json_tool.json_dump(
+                {"step_name": "observation", "raw_text": f"content of file {i}\n" * 20}
+            ),
+        },
+    ]
+
+def get_params():
+    parser = argparse.ArgumentParser(description="benchmark for formatting messages")
+    parser.add_argument("-m", "--max_messages", dest="max_messages", type=int, default=600)
+    parser.add_argument("-s", "--step", dest="step", type=int, default=100, help="print every N messages")
+    parser.add_argument("-r", "--repeat", dest="repeat", type=int, default=5, help="average of N calls")
+    return parser.parse_args()
+
+def main():
+    args = get_params()
+    llm_model = llm_base.LLMModel()
+    messages = [
+        {"role": "system", "content": "output steps in topsailai format, e.g. topsailai.thought"},
+        {"role": "user", "content": "the task"},
+    ]
+
+    print(f"{'messages':>10} {'legacy ms/turn':>16} {'memoized ms/turn':>18}")
+    i = 0
+    while len(messages) < args.max_messages:
+        messages.extend(new_turn(i))
+        i += 1
+
+        if len(messages) % args.step >= 2:
+            # the new turn is formatted, as a real session
+            llm_model.build_parameters_for_chat(messages)
+            continue
+
+        start_time = time.perf_counter()
+        for _ in range(args.repeat):
+            legacy_format_messages(messages, key_name="step_name", value_name="raw_text")
+        legacy_ms = (time.perf_counter() - start_time) * 1000 / args.repeat
+
+        start_time = time.perf_counter()
+        for _ in range(args.repeat):
+            llm_model.build_parameters_for_chat(messages)
+        memoized_ms = (time.perf_counter() - start_time) * 1000 / args.repeat
+
+        print(f"{len(messages):>10} {legacy_ms:>16.3f} {memoized_ms:>18.3f}")
+
+    cache = llm_base.FormattedContentCacheInstance
+    print(f"cache: hit={cache.hit_count}, miss={cache.miss_count}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+  Unit tests for ai_base agent_base
+'''
+
+import pytest
+import sys
+import os
+import time
+import asyncio
+import threading
+workspace_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if workspace_root not in sys.path:
+    sys.path.insert(0, workspace_root)
+    sys.path.insert(0, workspace_root + "/src")
+from topsailai import tools as tools_mod
+from topsailai.utils.json_tool import json_dump
+from topsailai.ai_base.llm_stub import StubLLMServer, StubConfig
+from topsailai.ai_base.agent_base import AgentRun, ToolCallBatch
+from topsailai.ai_base.agent_types import react
+from topsailai.utils.thread_local_tool import (
+    ctxm_give_agent_name,
+    get_agent_name,
+    get_agent_object,
+)
+
+
+class SlowTools(object):
+    """ the tools sleep, and record the max concurrency """
+    def __init__(self, seconds=0.2):
+        self.seconds = seconds
+        self.current = 0
+        self.max_current = 0
+        self.calls = []
+        self.rlock = threading.Lock()
+
+    def read(self, name=""):
+        with self.rlock:
+            self.current += 1
+            self.max_current = max(self.max_current, self.current)
+        time.sleep(self.seconds)
+        with self.rlock:
+            self.current -= 1
+            self.calls.append(name)
+        return f"content of {name}"
+
+    def write(self, name=""):
+        with self.rlock:
+            self.calls.append(f"write {name}")
+        return "ok"
+
+
+@pytest.fixture
+def slow_tools(monkeypatch):
+    monkeypatch.setitem(tools_mod.TOOLS_META, "t.read", {"parallel": True})
+    slow_tools = SlowTools()
+    return slow_tools
+
+
+def new_action(tool_call, name):
+    return {"step_name": "action", "tool_call": tool_call, "tool_args": {"name": name}}
+
+
+class Step4Batch(react.Step4ReAct):
+    """ the stream goes on after an action, so the consecutive actions run as a batch """
+    stop_step_names = ("final_answer",)
+
+    def _execute(self, step, tools, response, index, rsp_msg_obj=None, **kwargs):
+        if step.get("tool_call") == "t.finish":
+            self.code = self.CODE_TASK_FINAL
+            self.result = "finished"
+            return
+        return super()._execute(step, tools, response, index, rsp_msg_obj=rsp_msg_obj, **kwargs)
+
+
+class TestToolCallBatch:
+    def test_parallel(self, slow_tools):
+        tools = {"t.read": slow_tools.read}
+        steps = [new_action("t.read", f"f{i}") for i in range(4)]
+        start_time = time.time()
+        results = ToolCallBatch(react.Step4ReAct(), tools).run(steps, steps, 0)
+        assert time.time() - start_time < slow_tools.seconds * 3
+        assert slow_tools.max_current == 4
+        assert [ret.tool_msg["raw_text"] for ret in results] == [f"content of f{i}" for i in range(4)]
+
+    def test_barrier(self, slow_tools):
+        tools = {"t.read": slow_tools.read, "t.write": slow_tools.write}
+        steps = [
+            new_action("t.read", "a"),
+            new_action("t.read", "b"),
+            new_action("t.write", "c"),
+            new_action("t.read", "d"),
+        ]
+        ToolCallBatch(react.Step4ReAct(), tools).run(steps, steps, 0)
+        # the write runs after the reads before it, and before the reads after it
+        assert slow_tools.calls.index("write c") == 2
+        assert slow_tools.calls[-1] == "d"
+
+    def test_max_workers(self, slow_tools):
+        tools = {"t.read": slow_tools.read}
+        steps = [new_action("t.read", f"f{i}") for i in range(3)]
+        ToolCallBatch(react.Step4ReAct(), tools, max_workers=1).run(steps, steps, 0)
+        assert slow_tools.max_current == 1
+
+    def test_tool_error(self):
+        steps = [new_action("t.none", "a"), new_action("t.none", "b")]
+        results = ToolCallBatch(react.Step4ReAct(), {}).run(steps, steps, 0)
+        assert all(ret.tool_error for ret in results)
+
+
+@pytest.fixture
+def agent_env(monkeypatch):
+    monkeypatch.setenv("USE_TOOL_CALLS", "0")
+    monkeypatch.setenv("AGENT_STREAM", "0")
+    monkeypatch.setenv("DEBUG", "0")
+    monkeypatch.delenv("MODEL_SETTINGS", raising=False)
+    monkeypatch.delenv("LLM_CACHE_DIR", raising=False)
+    monkeypatch.delenv("CONTEXT_HISTORY_MANAGERS", raising=False)
+    monkeypatch.delenv("LLM_CASCADE_MODEL", raising=False)
+
+
+class TestAgentRun:
+    def test_parallel_actions(self, slow_tools, agent_env, monkeypatch):
+        responses = [
+            json_dump([new_action("t.read", f"f{i}") for i in range(3)]),
+            json_dump([{"step_name": "final_answer", "raw_text": "done"}]),
+        ]
+        with StubLLMServer(responses, StubConfig()) as server:
+            monkeypatch.setenv("OPENAI_API_BASE", server.base_url)
+            monkeypatch.setenv("OPENAI_API_KEY", "stub")
+            agent = AgentRun(
+                react.SYSTEM_PROMPT,
+                tools={"t.read": slow_tools.read},
+                agent_name=react.AGENT_NAME,
+            )
+            assert agent.run(Step4Batch(), "read the files") == "done"
+            assert server.stat.request_count == 2
+
+        assert slow_tools.max_current == 3
+        observations = [msg["content"] for msg in agent.messages if msg["role"] == "user" and "content of" in msg["content"]]
+        assert len(observations) == 3
+
+    def test_stop_step_not_batched(self, slow_tools, agent_env, monkeypatch):
+        # the stream stops after the first action of ReAct, so does the text mode without streaming
+        responses = [
+            json_dump([new_action("t.read", f"f{i}") for i in range(3)]),
+            json_dump([{"step_name": "final_answer", "raw_text": "done"}]),
+        ]
+        with StubLLMServer(responses, StubConfig()) as server:
+            monkeypatch.setenv("OPENAI_API_BASE", server.base_url)
+            monkeypatch.setenv("OPENAI_API_KEY", "stub")
+            agent = AgentRun(react.SYSTEM_PROMPT, tools={"t.read": slow_tools.read}, agent_name=react.AGENT_NAME)
+            assert agent.run(react.Step4ReAct(), "read the files") == "done"
+        assert slow_tools.calls == ["f0"]
+
+    def test_batch_task_final(self, slow_tools, agent_env, monkeypatch):
+        responses = [
+            json_dump([new_action("t.read", "f0"), new_action("t.finish", "")]),
+            json_dump([{"step_name": "final_answer", "raw_text": "done"}]),
+        ]
+        with StubLLMServer(responses, StubConfig()) as server:
+            monkeypatch.setenv("OPENAI_API_BASE", server.base_url)
+            monkeypatch.setenv("OPENAI_API_KEY", "stub")
+            agent = AgentRun(react.SYSTEM_PROMPT, tools={"t.read": slow_tools.read}, agent_name=react.AGENT_NAME)
+            # the task final of a batched call ends the task
+            assert agent.run(Step4Batch(), "read and finish") == "finished"
+            assert server.stat.request_count == 1
+        assert slow_tools.calls == ["f0"]
+
+
+class TestAgentArun:
+    def test_context_vars(self):
+        async def _task(name):
+            with ctxm_give_agent_name(name):
+                await asyncio.sleep(0.05)
+                # the tool thread has the agent name of this task
+                return (get_agent_name(), await asyncio.to_thread(get_agent_name))
+
+        async def _main():
+            return await asyncio.gather(_task("a1"), _task("a2"))
+
+        assert asyncio.run(_main()) == [("a1", "a1"), ("a2", "a2")]
+        assert get_agent_name() is None
+
+    def test_concurrent_agents(self, slow_tools, agent_env, monkeypatch):
+        slow_tools.seconds = 0.5
+        agents_of_calls = []
+
+        def read(name=""):
+            agents_of_calls.append((name, get_agent_object()))
+            return slow_tools.read(name)
+
+        responses = [
+            json_dump([new_action("t.read", "f")]),
+            json_dump([{"step_name": "final_answer", "raw_text": "done"}]),
+        ]
+        with StubLLMServer(responses, StubConfig()) as server:
+            monkeypatch.setenv("OPENAI_API_BASE", server.base_url)
+            monkeypatch.setenv("OPENAI_API_KEY", "stub")
+            agents = [
+                AgentRun(react.SYSTEM_PROMPT, tools={"t.read": read}, agent_name=f"agent{i}")
+                for i in range(4)
+            ]
+
+            async def _main():
+                return await asyncio.gather(*[
+                    agent.arun(react.Step4ReAct(), f"task {i}") for i, agent in enumerate(agents)
+                ])
+
+            assert asyncio.run(_main()) == ["done"] * 4
+            assert server.stat.request_count == 8
+
+        # the tools of the agents run at the same time
+        assert slow_tools.max_current == 4
+        assert sorted(id(agent) for _, agent in agents_of_calls) == sorted(id(agent) for agent in agents)
+        assert get_agent_object() is None
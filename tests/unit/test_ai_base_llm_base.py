@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+  Unit tests for ai_base llm_base
+'''
+
+import pytest
+import sys
+import os
+import copy
+import asyncio
+workspace_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if workspace_root not in sys.path:
+    sys.path.insert(0, workspace_root)
+    sys.path.insert(0, workspace_root + "/src")
+from topsailai.utils import json_tool, format_tool
+from topsailai.ai_base.llm_base import (
+    LLMModel,
+    AsyncLLMModel,
+    _format_messages,
+    FormattedContentCacheInstance,
+    EarlyStopStat,
+    get_stop_sequences,
+)
+from topsailai.ai_base.llm_stub import StubLLMServer, StubConfig
+from topsailai.ai_base.llm_client import ClientRegistryInstance
+
+
+def new_messages(system_prompt="output steps like topsailai.thought"):
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": "the task"},
+        {"role": "assistant", "content": json_tool.json_dump([
+            {"step_name": "thought", "raw_text": "think"},
+            {"step_name": "action", "tool_call": "t.x", "tool_args": {"a": 1}},
+        ]), "tool_calls": None},
+        {"role": "user", "content": json_tool.json_dump({"step_name": "observation", "raw_text": "ok"})},
+        {"role": "user", "content": "plain text"},
+    ]
+
+
+class TestFormatMessages:
+    def setup_method(self):
+        FormattedContentCacheInstance.clear()
+
+    def test_format(self):
+        messages = new_messages()
+        raw_messages = copy.deepcopy(messages)
+        result = _format_messages(messages, key_name="step_name", value_name="raw_text")
+
+        # the input is not changed
+        assert messages == raw_messages
+        assert result[2]["content"] == format_tool.to_topsailai_format(
+            raw_messages[2]["content"], key_name="step_name", value_name="raw_text",
+        ).strip()
+        assert result[3]["content"].startswith("topsailai.observation\nok")
+        assert result[4]["content"] == "plain text"
+        assert result[:2] == raw_messages[:2]
+
+    def test_memoized(self):
+        messages = new_messages()
+        _format_messages(messages, key_name="step_name", value_name="raw_text")
+        assert (FormattedContentCacheInstance.hit_count, FormattedContentCacheInstance.miss_count) == (0, 2)
+
+        messages.append({"role": "assistant", "content": json_tool.json_dump([{"step_name": "final_answer", "raw_text": "done"}])})
+        result = _format_messages(messages, key_name="step_name", value_name="raw_text")
+        # only the new message is formatted
+        assert (FormattedContentCacheInstance.hit_count, FormattedContentCacheInstance.miss_count) == (2, 3)
+        assert result[-1]["content"] == "topsailai.final_answer\ndone"
+
+    def test_json_format(self):
+        messages = new_messages(system_prompt="output json")
+        result = _format_messages(messages, key_name="step_name", value_name="raw_text")
+        assert result == messages
+        assert result[2] is not messages[2]
+        assert FormattedContentCacheInstance.miss_count == 0
+
+
+class TestPromptTokenCount:
+    def test_running_total(self, monkeypatch):
+        monkeypatch.delenv("CONTEXT_HISTORY_MANAGERS", raising=False)
+        from topsailai.context.token import count_messages_tokens
+        from topsailai.ai_base.prompt_base import PromptBase
+
+        prompt = PromptBase("system prompt")
+        prompt.add_user_message("hello world")
+        prompt.add_assistant_message([{"step_name": "final_answer", "raw_text": "done"}])
+        assert prompt.token_count == count_messages_tokens(prompt.messages)
+
+        prompt.update_message_for_env()
+        assert prompt.token_counter.total == count_messages_tokens(prompt.messages)
+
+        prompt.messages = prompt.messages[:2]
+        assert prompt.token_count == count_messages_tokens(prompt.messages)
+
+
+class TestEarlyStop:
+    def test_stop_sequences(self, monkeypatch):
+        monkeypatch.delenv("LLM_EARLY_STOP", raising=False)
+        messages = new_messages()
+        assert get_stop_sequences(messages, "DeepSeek-V3.1-Terminus") == ["topsailai.observation"]
+        # they reject 'stop'
+        for model_name in ("o1", "o3-mini", "openai/gpt-5-mini"):
+            assert get_stop_sequences(messages, model_name) is None
+        assert get_stop_sequences(new_messages("plain prompt"), "gpt-4o") is None
+
+        monkeypatch.setenv("LLM_EARLY_STOP", "0")
+        assert get_stop_sequences(messages, "gpt-4o") is None
+
+    def test_saved(self):
+        stat = EarlyStopStat()
+        stat.add(10, 0.5)
+        # no full output to compare
+        assert stat.get_saved_tokens() == 0
+        assert stat.get_saved_seconds() == 0.0
+
+        stat.add_full(100)
+        stat.add_full(200)
+        stat.add(20, 0.5)
+        # 150 * 2 - 30
+        assert stat.get_saved_tokens() == 270
+        # 30 tokens per second
+        assert stat.get_saved_seconds() == 9.0
+
+
+class TestAsyncLLMModel:
+    @pytest.fixture
+    def server(self, monkeypatch):
+        response = '[{"step_name": "thought", "raw_text": "think"}, {"step_name": "final_answer", "raw_text": "done"}]'
+        with StubLLMServer([response], StubConfig()) as server:
+            monkeypatch.setenv("OPENAI_API_BASE", server.base_url)
+            monkeypatch.setenv("OPENAI_API_KEY", "stub")
+            monkeypatch.delenv("MODEL_SETTINGS", raising=False)
+            monkeypatch.delenv("LLM_CACHE_DIR", raising=False)
+            yield server
+
+    def test_same_response(self, server):
+        messages = [{"role": "user", "content": "hello"}]
+        sync_result = LLMModel().chat(messages)
+
+        async def _main():
+            llm_model1 = AsyncLLMModel()
+            llm_model2 = AsyncLLMModel()
+            # the models share the async client of this event loop
+            assert llm_model1.chat_model is llm_model2.chat_model
+            return await llm_model1.chat(messages)
+
+        assert asyncio.run(_main()) == sync_result
+        assert sync_result == [
+            {"step_name": "thought", "raw_text": "think"},
+            {"step_name": "final_answer", "raw_text": "done"},
+        ]
+        assert server.stat.request_count == 2
+
+    def test_lazy_client(self, server):
+        ClientRegistryInstance.clear()
+        llm_model = AsyncLLMModel()
+        # no client out of event loop
+        assert llm_model.model is None
+        assert not [x for x in ClientRegistryInstance.get_stats() if x["is_async"]]
+
+        asyncio.run(llm_model.chat([{"role": "user", "content": "hello"}]))
+        stats = [x for x in ClientRegistryInstance.get_stats() if x["is_async"]]
+        assert [x["created_count"] for x in stats] == [1]
+        ClientRegistryInstance.clear()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+  Unit tests for ai_base llm_cache
+'''
+
+import pytest
+import sys
+import os
+import time
+workspace_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if workspace_root not in sys.path:
+    sys.path.insert(0, workspace_root)
+    sys.path.insert(0, workspace_root + "/src")
+from topsailai.ai_base.llm_cache import ResponseCache, get_cache_key
+
+
+def new_params(content="hello", temperature=0.3, **kwargs):
+    params = dict(
+        model="m1",
+        messages=[{"role": "user", "content": content}],
+        temperature=temperature,
+        stream=False,
+    )
+    params.update(kwargs)
+    return params
+
+def new_response(content):
+    return {
+        "id": "r1",
+        "object": "chat.completion",
+        "created": 1,
+        "model": "m1",
+        "choices": [
+            {"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}},
+        ],
+    }
+
+
+class TestResponseCache:
+    @pytest.fixture
+    def cache(self, tmp_path):
+        return ResponseCache(str(tmp_path), ttl=60, max_size=1024 * 1024, max_temperature=0.5)
+
+    def test_cache_key(self):
+        assert get_cache_key(new_params()) == get_cache_key(new_params(stream=True))
+        assert get_cache_key(new_params()) != get_cache_key(new_params(content="hi"))
+        assert get_cache_key(new_params()) != get_cache_key(new_params(temperature=0.1))
+        assert get_cache_key(new_params()) != get_cache_key(new_params(tools=[{"type": "function"}]))
+
+    def test_get_set(self, cache):
+        params = new_params()
+        assert cache.get(params) is None
+        cache.set(params, new_response("world"), content="world")
+        response = cache.get(params)
+        assert response.choices[0].message.content == "world"
+
+    def test_bypass_high_temperature(self, cache):
+        params = new_params(temperature=0.9)
+        cache.set(params, new_response("world"))
+        assert cache.get(params) is None
+
+    def test_ttl(self, cache):
+        params = new_params()
+        cache.set(params, new_response("world"))
+        cache.ttl = 1
+        time.sleep(1.1)
+        assert cache.get(params) is None
+
+    def test_discard(self, cache):
+        params = new_params()
+        cache.set(params, new_response("world"), content="world")
+        cache.discard("world")
+        assert cache.get(params) is None
+
+    def test_evict_lru(self, cache):
+        cache.max_size = 2000
+        for i in range(10):
+            params = new_params(content=f"hello{i}")
+            cache.set(params, new_response("x" * 200))
+            # the first one is always used
+            os.utime(cache._get_file_path(get_cache_key(new_params(content="hello0"))))
+            time.sleep(0.01)
+        assert cache.get(new_params(content="hello0")) is not None
+        assert cache.get(new_params(content="hello1")) is None
+        assert cache.get(new_params(content="hello9")) is not None
+        assert cache._total_size <= cache.max_size
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+  Unit tests for ai_base llm_cascade
+'''
+
+import pytest
+import sys
+import os
+workspace_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if workspace_root not in sys.path:
+    sys.path.insert(0, workspace_root)
+    sys.path.insert(0, workspace_root + "/src")
+from topsailai.context.token import TokenStat
+from topsailai.ai_base.llm_base import JsonError
+from topsailai.ai_base.llm_cascade import (
+    CascadePolicy,
+    ModelCascade,
+    TIER_SMALL,
+    TIER_LARGE,
+    REASON_PARSE,
+    REASON_TOOL_ERROR,
+    REASON_REPEAT,
+    REASON_STEP,
+)
+
+STEPS = [{"step_name": "action", "tool_call": "exec_cmd"}]
+
+
+class FakeLLMModel(object):
+    def __init__(self, model_name):
+        self.model_name = model_name
+        self.tokenStat = TokenStat(model_name)
+
+
+def new_cascade(**kwargs):
+    policy = CascadePolicy("small", **kwargs)
+    return ModelCascade(policy, FakeLLMModel("large"), small_llm_model=FakeLLMModel("small"))
+
+
+class TestModelCascade:
+    def test_from_env(self, monkeypatch):
+        monkeypatch.delenv("LLM_CASCADE_MODEL", raising=False)
+        assert CascadePolicy.from_env() is None
+        monkeypatch.setenv("LLM_CASCADE_MODEL", "small")
+        monkeypatch.setenv("LLM_CASCADE_STEP_NAMES", "final_answer; ")
+        policy = CascadePolicy.from_env()
+        assert policy.small_model == "small"
+        assert policy.escalate_step_names == ("final_answer",)
+
+    def test_small_first(self):
+        cascade = new_cascade()
+        result = cascade.call(lambda llm_model: (llm_model.model_name, STEPS))
+        assert result[0] == "small"
+        stats = cascade.get_stats()
+        assert stats["tiers"][TIER_SMALL]["request_count"] == 1
+        assert stats["tiers"][TIER_LARGE]["request_count"] == 0
+
+    def test_parse_failure(self):
+        cascade = new_cascade()
+
+        def _chat(llm_model):
+            if llm_model.model_name == "small":
+                raise Exception("chat to LLM is failed") from JsonError("invalid json string")
+            return (llm_model.model_name, STEPS)
+
+        assert cascade.call(_chat)[0] == "large"
+        stats = cascade.get_stats()
+        assert stats["escalation_counts"] == {REASON_PARSE: 1}
+        assert stats["tiers"][TIER_SMALL]["failure_count"] == 1
+
+        # only this turn is redone by the large model
+        cascade.end_turn()
+        assert cascade.get_tier() == TIER_SMALL
+
+    def test_step_trigger(self):
+        cascade = new_cascade(escalate_step_names=("final_answer",))
+        result = cascade.call(lambda llm_model: (llm_model.model_name, [{"step_name": "final_answer"}]))
+        assert result[0] == "large"
+        assert cascade.get_stats()["escalation_counts"] == {REASON_STEP: 1}
+        assert cascade.call(lambda llm_model: (llm_model.model_name, []))[0] == "large"
+
+    def test_tool_error(self):
+        cascade = new_cascade(escalate_turns=2)
+        cascade.call(lambda llm_model: (llm_model.model_name, STEPS))
+        cascade.on_step("key", tool_error=True)
+        # the countdown starts with the next turn
+        assert cascade.get_tier() == TIER_LARGE
+        cascade.end_turn()
+        assert cascade.call(lambda llm_model: (llm_model.model_name, STEPS))[0] == "large"
+        cascade.end_turn()
+        assert cascade.call(lambda llm_model: (llm_model.model_name, STEPS))[0] == "large"
+        cascade.end_turn()
+        assert cascade.get_tier() == TIER_SMALL
+        assert cascade.get_stats()["escalation_counts"] == {REASON_TOOL_ERROR: 1}
+
+    def test_repeated_steps(self):
+        cascade = new_cascade(max_repeat=2, escalate_turns=1)
+        cascade.on_step("key1")
+        cascade.end_turn()
+        cascade.on_step("key2")
+        cascade.end_turn()
+        assert cascade.get_tier() == TIER_SMALL
+
+        cascade.on_step("key2")
+        cascade.end_turn()
+        assert cascade.get_tier() == TIER_LARGE
+        assert cascade.get_stats()["escalation_counts"] == {REASON_REPEAT: 1}
+        cascade.end_turn()
+        assert cascade.get_tier() == TIER_SMALL
+
+    def test_escalate(self):
+        cascade = new_cascade()
+        cascade.escalate(turns=1)
+        assert cascade.call(lambda llm_model: (llm_model.model_name, STEPS))[0] == "large"
+        cascade.end_turn()
+        assert cascade.get_tier() == TIER_SMALL
+
+        # in a turn, the turns are after it
+        cascade.call(lambda llm_model: (llm_model.model_name, STEPS))
+        cascade.escalate(turns=1)
+        cascade.end_turn()
+        assert cascade.call(lambda llm_model: (llm_model.model_name, STEPS))[0] == "large"
+        cascade.end_turn()
+        assert cascade.get_tier() == TIER_SMALL
+
+    def test_failure_of_large(self):
+        cascade = new_cascade()
+        cascade.escalate(turns=1)
+
+        def _chat(llm_model):
+            raise ValueError("failed")
+
+        with pytest.raises(ValueError):
+            cascade.call(_chat)
+        assert cascade.get_stats()["tiers"][TIER_LARGE]["failure_count"] == 1
+
+    def test_is_final(self):
+        cascade = new_cascade()
+        # the steps of the small model are not dispatched early, they may be redone
+        assert not cascade.is_final(cascade.small_llm_model)
+        assert cascade.is_final(cascade.large_llm_model)
+
+    def test_new_small_llm_model(self):
+        large = FakeLLMModel("large")
+        large.max_tokens = 1000
+        large.temperature = 0.3
+        large.top_p = 0.9
+        large.frequency_penalty = 0.5
+        large.content_senders = []
+        cascade = ModelCascade(CascadePolicy("small"), large)
+        small = cascade.small_llm_model
+        assert small.model_name == "small"
+        assert (small.max_tokens, small.temperature, small.top_p, small.frequency_penalty) == (1000, 0.3, 0.9, 0.5)
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+  Unit tests for ai_base llm_client
+'''
+
+import pytest
+import sys
+import os
+import asyncio
+workspace_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if workspace_root not in sys.path:
+    sys.path.insert(0, workspace_root)
+    sys.path.insert(0, workspace_root + "/src")
+from topsailai.ai_base.llm_client import ClientRegistry
+
+class TestClientRegistry:
+    @pytest.fixture
+    def registry(self):
+        return ClientRegistry()
+
+    def test_get_client_shared(self, registry):
+        client1 = registry.get_client("key1", "http://127.0.0.1:1/v1")
+        client2 = registry.get_client("key1", "http://127.0.0.1:1/v1")
+        assert client1 is client2
+
+        stats = registry.get_stats()
+        assert len(stats) == 1
+        assert stats[0]["created_count"] == 1
+        assert stats[0]["reused_count"] == 1
+
+    def test_get_client_by_key(self, registry):
+        client1 = registry.get_client("key1", "http://127.0.0.1:1/v1")
+        client2 = registry.get_client("key2", "http://127.0.0.1:1/v1")
+        client3 = registry.get_client("key1", "http://127.0.0.1:2/v1")
+        assert client1 is not client2
+        assert client1 is not client3
+        assert len(registry.get_stats()) == 3
+
+    def test_get_client_renew(self, registry):
+        client1 = registry.get_client("key1", "http://127.0.0.1:1/v1")
+        client2 = registry.get_client("key1", "http://127.0.0.1:1/v1", renew=True)
+        assert client1 is not client2
+        assert registry.get_stats()[0]["created_count"] == 2
+
+    def test_get_client_async(self, registry):
+        client1 = registry.get_client("key1", "http://127.0.0.1:1/v1")
+        client2 = registry.get_client("key1", "http://127.0.0.1:1/v1", for_async=True)
+        assert client1 is not client2
+        assert registry.get_stats()[1]["is_async"] is True
+
+    def test_get_client_by_loop(self, registry):
+        async def _get_client():
+            return registry.get_client("key1", "http://127.0.0.1:1/v1", for_async=True)
+
+        async def _get_clients():
+            return (await _get_client(), await _get_client())
+
+        async def _get_client_and_loops():
+            return (await _get_client(), len(registry.loop_clients))
+
+        client1, client2 = asyncio.run(_get_clients())
+        assert client1 is client2
+        # a new event loop gets a new client, the closed loop is dropped
+        client3, loop_count = asyncio.run(_get_client_and_loops())
+        assert client3 is not client1
+        assert loop_count == 1
+        stats = registry.get_stats()
+        assert len(stats) == 1
+        assert stats[0]["created_count"] == 2
+
+    def test_api_key_masked(self, registry):
+        registry.get_client("sk-1234567890", "http://127.0.0.1:1/v1")
+        assert registry.get_stats()[0]["api_key"] == "sk-1234"
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+  Unit tests for ai_base llm_hedge
+'''
+
+import sys
+import os
+import time
+import asyncio
+import threading
+workspace_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if workspace_root not in sys.path:
+    sys.path.insert(0, workspace_root)
+    sys.path.insert(0, workspace_root + "/src")
+from topsailai.ai_base import llm_base
+from topsailai.ai_base.llm_hedge import Hedger
+from topsailai.ai_base.llm_stub import StubLLMServer, StubConfig
+
+
+def new_hedger(delay=0.05, **kwargs):
+    hedger = Hedger(min_samples=5, max_ratio=1.0, **kwargs)
+    for _ in range(5):
+        hedger.record_latency(delay)
+    return hedger
+
+
+def slow(value, seconds):
+    def _func():
+        time.sleep(seconds)
+        return value
+    return _func
+
+
+class TestHedger:
+    def test_no_samples(self):
+        hedger = Hedger(min_samples=5)
+        assert hedger.get_hedge_delay() is None
+        assert hedger.call(slow("primary", 0), slow("backup", 0)) == "primary"
+        assert hedger.hedged_count == 0
+
+    def test_percentile(self):
+        hedger = Hedger(min_samples=1, percentile=90)
+        for i in range(1, 11):
+            hedger.record_latency(i)
+        assert hedger.get_hedge_delay() == 10
+        hedger.percentile = 50
+        assert hedger.get_hedge_delay() == 6
+
+    def test_fast_primary(self):
+        hedger = new_hedger(delay=1)
+        assert hedger.call(slow("primary", 0), slow("backup", 0)) == "primary"
+        assert hedger.hedged_count == 0
+
+    def test_backup_wins(self):
+        hedger = new_hedger()
+        losers = []
+        assert hedger.call(slow("primary", 0.3), slow("backup", 0), on_loser=losers.append) == "backup"
+        stats = hedger.to_dict()
+        assert stats["hedged_count"] == 1
+        assert stats["hedge_win_count"] == 1
+        # the loser is not interrupted
+        time.sleep(0.4)
+        assert losers == ["primary"]
+
+    def test_backup_failed(self):
+        hedger = new_hedger()
+
+        def _backup():
+            raise ValueError("backup")
+
+        assert hedger.call(slow("primary", 0.2), _backup) == "primary"
+        assert hedger.hedge_win_count == 0
+
+    def test_cap(self):
+        hedger = new_hedger()
+        hedger.max_ratio = 0.0
+        # no hedge can fire, the primary runs inline
+        assert hedger.call(slow("primary", 0.2), threading.current_thread) == "primary"
+        assert hedger.call(threading.current_thread, slow("backup", 0)) is threading.current_thread()
+        assert hedger.hedged_count == 0
+        # only the slow one would be hedged
+        assert hedger.capped_count == 1
+        assert hedger.has_budget() is False
+        assert hedger.capped_count == 1
+
+    def test_busy_pool(self):
+        hedger = new_hedger(max_workers=1)
+        assert hedger.call(threading.current_thread, slow("backup", 0)) is threading.current_thread()
+        assert hedger.pooled_count == 0
+
+    def test_pooled_count(self):
+        hedger = new_hedger()
+        assert hedger.call(slow("primary", 0.2), slow("backup", 0)) == "backup"
+        time.sleep(0.3)
+        assert hedger.pooled_count == 0
+
+    def test_acall(self):
+        hedger = new_hedger()
+        cancelled = []
+
+        async def _primary():
+            try:
+                await asyncio.sleep(1)
+            except asyncio.CancelledError:
+                cancelled.append(1)
+                raise
+            return "primary"
+
+        async def _backup():
+            return "backup"
+
+        assert asyncio.run(hedger.acall(_primary, _backup)) == "backup"
+        assert cancelled == [1]
+
+
+class TestHedgedChat:
+    def test_chat(self, monkeypatch):
+        response = '[{"step_name": "final_answer", "raw_text": "ok"}]'
+        with StubLLMServer([response], StubConfig(latency=1)) as slow_server, \
+            StubLLMServer([response], StubConfig()) as fast_server:
+            monkeypatch.setenv("OPENAI_API_KEY", "stub")
+            monkeypatch.setenv(
+                "MODEL_SETTINGS",
+                f"api_key=a,api_base={slow_server.base_url};api_key=b,api_base={fast_server.base_url}",
+            )
+            monkeypatch.setenv("LLM_ROUTING_MODE", "random")
+            monkeypatch.delenv("LLM_CACHE_DIR", raising=False)
+            hedger = new_hedger()
+            monkeypatch.setattr(llm_base, "HedgerInstance", hedger)
+
+            llm_model = llm_base.LLMModel()
+            # the slow endpoint is the primary
+            monkeypatch.setattr(llm_model, "choose_model", lambda *_: (llm_model.models[0], llm_model.models[0]["_model"]))
+            start_time = time.time()
+            assert llm_model.chat([{"role": "user", "content": "hello"}]) == [{"step_name": "final_answer", "raw_text": "ok"}]
+            assert time.time() - start_time < 0.9
+            assert hedger.hedge_win_count == 1
+            assert fast_server.stat.request_count == 1
+
+            # the usage of the loser is recorded when it is done
+            time.sleep(1.2)
+            assert slow_server.stat.request_count == 1
+            assert llm_model.tokenStat.usage_count == 2
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+  Unit tests for ai_base llm_retry
+'''
+
+import pytest
+import sys
+import os
+workspace_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if workspace_root not in sys.path:
+    sys.path.insert(0, workspace_root)
+    sys.path.insert(0, workspace_root + "/src")
+import openai
+from topsailai.ai_base import llm_retry
+from topsailai.ai_base.llm_retry import (
+    RetryPolicy,
+    classify_error,
+)
+from topsailai.ai_base.llm_stub import (
+    StubLLMServer,
+    StubConfig,
+    ERROR_RATE_LIMIT,
+    ERROR_INTERNAL_SERVER,
+)
+from topsailai.ai_base.llm_base import LLMModel, JsonError
+
+
+class FakeResponse(object):
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.request = None
+
+
+def new_error(error_cls, status_code, message="error", headers=None):
+    return error_cls(message, response=FakeResponse(status_code, headers), body=None)
+
+
+class TestClassifyError:
+    def test_classes(self):
+        assert classify_error(new_error(openai.RateLimitError, 429)) == llm_retry.ERROR_RATE_LIMIT
+        assert classify_error(new_error(openai.InternalServerError, 500)) == llm_retry.ERROR_SERVER
+        assert classify_error(new_error(openai.AuthenticationError, 401)) == llm_retry.ERROR_AUTHENTICATION
+        assert classify_error(new_error(openai.BadRequestError, 400)) == llm_retry.ERROR_BAD_REQUEST
+        assert classify_error(JsonError("invalid json string")) == llm_retry.ERROR_JSON
+        assert classify_error(TypeError("null")) == llm_retry.ERROR_EMPTY
+        assert classify_error(ValueError("x")) == llm_retry.ERROR_UNKNOWN
+
+    def test_context_length(self):
+        e = new_error(openai.BadRequestError, 400, "This model's maximum context length is 8192 tokens")
+        assert classify_error(e) == llm_retry.ERROR_CONTEXT_LENGTH
+        assert not RetryPolicy().is_retryable(e)
+
+
+class TestRetryPolicy:
+    def test_backoff(self):
+        policy = RetryPolicy(base_delay=1, max_delay=5, jitter=0)
+        assert [policy.get_delay(i) for i in range(5)] == [1, 2, 4, 5, 5]
+
+    def test_jitter(self):
+        policy = RetryPolicy(base_delay=4, jitter=0.5)
+        for _ in range(20):
+            assert 2 <= policy.get_delay(0) <= 4
+
+    def test_retry_after(self):
+        policy = RetryPolicy(base_delay=1, max_delay=30, jitter=0)
+        e = new_error(openai.RateLimitError, 429, headers={"retry-after": "7"})
+        assert policy.get_delay(0, e) == 7
+        e = new_error(openai.RateLimitError, 429, headers={"retry-after-ms": "1500"})
+        assert policy.get_delay(0, e) == 1.5
+        e = new_error(openai.RateLimitError, 429, headers={"retry-after": "100"})
+        assert policy.get_delay(0, e) == 30
+
+    def test_budget(self):
+        policy = RetryPolicy(jitter=0, base_delay=0, budgets={llm_retry.ERROR_BAD_REQUEST: 2})
+        state = policy.new_state()
+        e = new_error(openai.BadRequestError, 400)
+        assert state.next_delay(e) is not None
+        assert state.next_delay(e) is not None
+        assert state.next_delay(e) is None
+        assert state.get_error_count(llm_retry.ERROR_BAD_REQUEST) == 3
+
+    def test_max_retries(self):
+        state = RetryPolicy(max_retries=2, base_delay=0).new_state()
+        e = new_error(openai.InternalServerError, 500)
+        assert state.next_delay(e) is not None
+        assert state.next_delay(e) is not None
+        assert state.next_delay(e) is None
+
+    def test_deadline(self):
+        state = RetryPolicy(base_delay=10, jitter=0).new_state(deadline=5)
+        assert 0 < state.get_remaining_seconds() <= 5
+        # the delay is beyond the deadline
+        assert state.next_delay(new_error(openai.InternalServerError, 500)) is None
+        assert RetryPolicy().new_state().get_remaining_seconds() is None
+
+
+class TestChatRetry:
+    @pytest.fixture
+    def env(self, monkeypatch):
+        monkeypatch.setenv("OPENAI_API_KEY", "stub")
+        monkeypatch.delenv("MODEL_SETTINGS", raising=False)
+        monkeypatch.delenv("LLM_CACHE_DIR", raising=False)
+        monkeypatch.setenv("LLM_RETRY_BASE_DELAY", "0.01")
+        return monkeypatch
+
+    def test_retry_injected_errors(self, env):
+        config = StubConfig(errors=[ERROR_RATE_LIMIT, ERROR_INTERNAL_SERVER], retry_after=0)
+        with StubLLMServer(['[{"step_name": "final_answer", "raw_text": "ok"}]'], config) as server:
+            env.setenv("OPENAI_API_BASE", server.base_url)
+            llm_model = LLMModel()
+            result = llm_model.chat([{"role": "user", "content": "hello"}])
+            assert result == [{"step_name": "final_answer", "raw_text": "ok"}]
+            assert server.stat.request_count == 3
+
+    def test_not_retryable(self, env):
+        llm_model = LLMModel()
+        calls = []
+
+        def _call_llm_model(*args, **kwargs):
+            calls.append(kwargs.get("timeout"))
+            raise new_error(openai.BadRequestError, 400, "context_length_exceeded")
+
+        llm_model.call_llm_model = _call_llm_model
+        with pytest.raises(openai.BadRequestError):
+            llm_model.chat([{"role": "user", "content": "hello"}], deadline=30)
+        assert len(calls) == 1
+        assert 0 < calls[0] <= 30
+
+    def test_out_of_budget(self, env):
+        llm_model = LLMModel()
+        llm_model.retry_policy = RetryPolicy(base_delay=0.001, budgets={llm_retry.ERROR_SERVER: 2})
+        calls = []
+
+        def _call_llm_model(*args, **kwargs):
+            calls.append(1)
+            raise new_error(openai.InternalServerError, 500)
+
+        llm_model.call_llm_model = _call_llm_model
+        with pytest.raises(Exception, match="chat to LLM is failed"):
+            llm_model.chat([{"role": "user", "content": "hello"}])
+        assert len(calls) == 3
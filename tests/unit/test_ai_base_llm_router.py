@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+  Unit tests for ai_base llm_router
+'''
+
+import pytest
+import sys
+import os
+import time
+import threading
+workspace_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if workspace_root not in sys.path:
+    sys.path.insert(0, workspace_root)
+    sys.path.insert(0, workspace_root + "/src")
+import openai
+from topsailai.ai_base.llm_router import EndpointRouter, EndpointLimiter, CIRCUIT_OPEN, CIRCUIT_HALF_OPEN
+
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.request = None
+
+def new_error(error_cls, status_code, headers=None):
+    return error_cls("error", response=FakeResponse(status_code, headers), body=None)
+
+
+class TestEndpointRouter:
+    @pytest.fixture
+    def router(self):
+        return EndpointRouter(explore_ratio=0)
+
+    @pytest.fixture
+    def endpoints(self):
+        return [
+            {"api_key": "key1", "api_base": "http://a/v1"},
+            {"api_key": "key2", "api_base": "http://b/v1"},
+        ]
+
+    def test_choose_unknown_first(self, router, endpoints):
+        router.report_success(endpoints[0], 1.0)
+        assert router.choose(endpoints) is endpoints[1]
+
+    def test_choose_lower_latency(self, router, endpoints):
+        router.report_success(endpoints[0], 5.0)
+        router.report_success(endpoints[1], 1.0)
+        assert router.choose(endpoints) is endpoints[1]
+
+    def test_choose_lower_error_rate(self, router, endpoints):
+        router.report_success(endpoints[0], 1.0)
+        router.report_success(endpoints[1], 1.0)
+        router.report_failure(endpoints[1], new_error(openai.InternalServerError, 500))
+        assert router.choose(endpoints) is endpoints[0]
+
+    def test_rate_limit_cooldown(self, router, endpoints):
+        router.report_success(endpoints[0], 5.0)
+        router.report_success(endpoints[1], 1.0)
+        router.report_failure(endpoints[1], new_error(openai.RateLimitError, 429, {"retry-after": "60"}))
+        assert router.choose(endpoints) is endpoints[0]
+        stat = router.get_stat(endpoints[1])
+        assert stat.rate_limit_count == 1
+        assert stat.cooldown_until - time.time() > 50
+
+    def test_circuit_breaker(self, router, endpoints):
+        router.report_success(endpoints[0], 5.0)
+        router.report_success(endpoints[1], 1.0)
+        stat = router.get_stat(endpoints[1])
+        for _ in range(stat.failure_threshold):
+            router.report_failure(endpoints[1], new_error(openai.InternalServerError, 500))
+        assert stat.circuit_state == CIRCUIT_OPEN
+        assert router.choose(endpoints) is endpoints[0]
+
+        # half open after a while, success closes it
+        stat.circuit_opened_at -= stat.circuit_open_seconds + 1
+        stat.error_rate = 0
+        assert router.choose(endpoints) is endpoints[1]
+        router.report_success(endpoints[1], 1.0)
+        assert stat.to_dict()["circuit_state"] == "closed"
+
+    def test_half_open_probe(self, router, endpoints):
+        router.report_success(endpoints[0], 5.0)
+        router.report_success(endpoints[1], 1.0)
+        stat = router.get_stat(endpoints[1])
+        for _ in range(stat.failure_threshold):
+            router.report_failure(endpoints[1], new_error(openai.InternalServerError, 500))
+        stat.circuit_opened_at -= stat.circuit_open_seconds + 1
+        stat.error_rate = 0
+
+        # the scan has no side effect, only the chosen endpoint is half open
+        assert stat.is_available(time.time())
+        assert stat.circuit_state == CIRCUIT_OPEN
+        assert router.choose(endpoints) is endpoints[1]
+        assert stat.circuit_state == CIRCUIT_HALF_OPEN
+
+        # one probe in flight, the others go to the healthy endpoint
+        assert router.choose(endpoints) is endpoints[0]
+        assert router.choose(endpoints) is endpoints[0]
+
+        # the probe is failed, the circuit is open again
+        router.report_failure(endpoints[1], new_error(openai.InternalServerError, 500))
+        assert stat.circuit_state == CIRCUIT_OPEN
+        assert router.choose(endpoints) is endpoints[0]
+
+    def test_all_unavailable(self, router, endpoints):
+        for endpoint, seconds in zip(endpoints, ["60", "10"]):
+            router.report_failure(endpoint, new_error(openai.RateLimitError, 429, {"retry-after": seconds}))
+        assert router.choose(endpoints) is endpoints[1]
+
+    def test_ignore_client_error(self, router, endpoints):
+        router.report_failure(endpoints[0], new_error(openai.BadRequestError, 400))
+        assert router.get_stat(endpoints[0]).error_count == 0
+
+    def test_ctxm_track(self, router, endpoints):
+        with router.ctxm_track(endpoints[0]):
+            pass
+        with pytest.raises(openai.InternalServerError):
+            with router.ctxm_track(endpoints[0]):
+                raise new_error(openai.InternalServerError, 500)
+        stats = router.get_stats()
+        assert stats[0]["request_count"] == 2
+        assert stats[0]["error_count"] == 1
+        assert stats[0]["inflight_count"] == 0
+
+    def test_sticky(self, router, endpoints):
+        router.report_success(endpoints[0], 1.0)
+        router.report_success(endpoints[1], 5.0)
+        assert router.choose(endpoints, mode="sticky", affinity_key="s1") is endpoints[0]
+
+        # slower, but sticky
+        router.report_success(endpoints[0], 50.0)
+        assert router.choose(endpoints, mode="sticky", affinity_key="s1") is endpoints[0]
+        assert router.choose(endpoints, mode="sticky", affinity_key="s2") is endpoints[1]
+
+        cache_stats = router.get_cache_stats()
+        assert cache_stats["sticky_hit_count"] == 1
+        assert cache_stats["sticky_miss_count"] == 2
+
+    def test_sticky_failover(self, router, endpoints):
+        router.report_success(endpoints[0], 1.0)
+        router.report_success(endpoints[1], 5.0)
+        assert router.choose(endpoints, mode="sticky", affinity_key="s1") is endpoints[0]
+        with pytest.raises(openai.RateLimitError):
+            with router.ctxm_track(endpoints[0], "s1"):
+                raise new_error(openai.RateLimitError, 429)
+        assert router.choose(endpoints, mode="sticky", affinity_key="s1") is endpoints[1]
+
+    def test_report_usage(self, router, endpoints):
+        router.report_usage(endpoints[0], {"prompt_tokens": 100, "completion_tokens": 10, "prompt_tokens_details": {"cached_tokens": 80}})
+        router.report_usage(endpoints[0], {"prompt_tokens": 100, "completion_tokens": 10, "prompt_cache_hit_tokens": 20})
+        router.report_usage(endpoints[0], None)
+        stat = router.get_stats()[0]
+        assert stat["prompt_tokens"] == 200
+        assert stat["cached_tokens"] == 100
+        assert stat["cache_hit_rate"] == 0.5
+
+
+class TestEndpointLimiter:
+    def test_limit(self):
+        limiter = EndpointLimiter(2)
+        model_config = {"api_key": "k", "api_base": "b"}
+        state = {"current": 0, "max": 0}
+        rlock = threading.Lock()
+
+        def _run():
+            with limiter.ctxm_acquire(model_config):
+                with rlock:
+                    state["current"] += 1
+                    state["max"] = max(state["max"], state["current"])
+                time.sleep(0.05)
+                with rlock:
+                    state["current"] -= 1
+
+        thrs = [threading.Thread(target=_run) for _ in range(6)]
+        for thr in thrs:
+            thr.start()
+        for thr in thrs:
+            thr.join()
+        assert state["max"] == 2
@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+  Unit tests for ai_base llm_structured
+'''
+
+import pytest
+import sys
+import os
+workspace_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if workspace_root not in sys.path:
+    sys.path.insert(0, workspace_root)
+    sys.path.insert(0, workspace_root + "/src")
+import openai
+from topsailai.ai_base.llm_structured import (
+    LEVEL_JSON_SCHEMA,
+    LEVEL_JSON_OBJECT,
+    LEVEL_NONE,
+    PARSE_NULL,
+    PARSE_INVALID_JSON,
+    StructuredOutputRegistryInstance,
+    ParseStatInstance,
+    StructuredOutputRegistry,
+    get_parse_stats,
+    get_response_format,
+    get_structured_mode,
+    is_unsupported_error,
+    unwrap_steps,
+)
+from topsailai.ai_base.llm_stub import StubLLMServer, StubConfig
+from topsailai.ai_base.llm_base import LLMModel, JsonError, _format_response
+from topsailai.ai_base.llm_retry import RetryPolicy
+
+RESPONSES = [
+    '[{"step_name": "thought", "raw_text": "turn0"}]',
+    '[{"step_name": "final_answer", "raw_text": "turn1"}]',
+]
+
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.request = None
+
+
+@pytest.fixture(autouse=True)
+def clear_stats():
+    StructuredOutputRegistryInstance.clear()
+    ParseStatInstance.clear()
+    yield
+    StructuredOutputRegistryInstance.clear()
+    ParseStatInstance.clear()
+
+
+class TestStructured:
+    def test_mode(self, monkeypatch):
+        monkeypatch.delenv("LLM_STRUCTURED_OUTPUT", raising=False)
+        assert get_structured_mode() == LEVEL_NONE
+        monkeypatch.setenv("LLM_STRUCTURED_OUTPUT", "auto")
+        assert get_structured_mode() == LEVEL_JSON_SCHEMA
+        monkeypatch.setenv("LLM_STRUCTURED_OUTPUT", "json_object")
+        assert get_structured_mode() == LEVEL_JSON_OBJECT
+        monkeypatch.setenv("LLM_STRUCTURED_OUTPUT", "0")
+        assert get_structured_mode() == LEVEL_NONE
+
+    def test_response_format(self):
+        assert get_response_format(LEVEL_JSON_SCHEMA)["type"] == "json_schema"
+        assert get_response_format(LEVEL_JSON_OBJECT) == {"type": "json_object"}
+        assert get_response_format(LEVEL_NONE) is None
+
+    def test_unwrap(self):
+        steps = [{"step_name": "thought"}]
+        assert unwrap_steps({"steps": steps}) == steps
+        assert unwrap_steps({"response": steps}) == steps
+        assert unwrap_steps({"step_name": "thought"}) == {"step_name": "thought"}
+        assert unwrap_steps(steps) is steps
+        assert _format_response('{"steps": [{"step_name": "thought"}]}', structured=True) == steps
+        # not asked by response_format, it is kept
+        assert _format_response('{"steps": [{"step_name": "thought"}]}') == [{"steps": steps}]
+        assert _format_response({"response": steps}) == [{"response": steps}]
+
+    def test_unsupported_error(self):
+        e = openai.BadRequestError("response_format is not supported", response=FakeResponse(400), body=None)
+        assert is_unsupported_error(e)
+        e = openai.BadRequestError("invalid messages", response=FakeResponse(400), body=None)
+        assert not is_unsupported_error(e)
+        assert not is_unsupported_error(ValueError("response_format"))
+
+    def test_registry(self):
+        registry = StructuredOutputRegistry()
+        model_config = {"api_key": "k", "api_base": "b"}
+        assert registry.get_level(model_config, LEVEL_JSON_SCHEMA) == LEVEL_JSON_SCHEMA
+        assert registry.downgrade(model_config, LEVEL_JSON_SCHEMA) == LEVEL_JSON_OBJECT
+        assert registry.get_level(model_config, LEVEL_JSON_SCHEMA) == LEVEL_JSON_OBJECT
+        assert registry.get_level({"api_key": "k2", "api_base": "b"}, LEVEL_JSON_SCHEMA) == LEVEL_JSON_SCHEMA
+        assert registry.get_level(model_config, LEVEL_NONE) == LEVEL_NONE
+        assert registry.downgrade(model_config, LEVEL_JSON_OBJECT) == LEVEL_NONE
+        assert registry.downgrade(model_config, LEVEL_NONE) == LEVEL_NONE
+
+    def test_rejection(self):
+        registry = StructuredOutputRegistry()
+        model_config = {"api_key": "k", "api_base": "b"}
+        assert registry.add_rejection(model_config, LEVEL_JSON_SCHEMA) == LEVEL_JSON_SCHEMA
+        assert registry.add_rejection(model_config, LEVEL_JSON_SCHEMA) == LEVEL_JSON_SCHEMA
+        # not in a row
+        registry.add_accepted(model_config)
+        assert registry.add_rejection(model_config, LEVEL_JSON_SCHEMA) == LEVEL_JSON_SCHEMA
+        assert registry.add_rejection(model_config, LEVEL_JSON_SCHEMA) == LEVEL_JSON_SCHEMA
+        assert registry.get_level(model_config, LEVEL_JSON_SCHEMA) == LEVEL_JSON_SCHEMA
+        assert registry.add_rejection(model_config, LEVEL_JSON_SCHEMA) == LEVEL_NONE
+        assert registry.get_level(model_config, LEVEL_JSON_SCHEMA) == LEVEL_NONE
+
+    def test_parse_stats(self):
+        _format_response('[{"step_name": "thought"}]')
+        _format_response('```json\n[{"step_name": "thought"}]\n```')
+        with pytest.raises(JsonError) as excinfo:
+            _format_response("  ")
+        assert excinfo.value.reason == PARSE_NULL
+        with pytest.raises(JsonError) as excinfo:
+            _format_response("not a json")
+        assert excinfo.value.reason == PARSE_INVALID_JSON
+
+        stats = get_parse_stats()
+        assert stats["clean_count"] == 1
+        assert stats["repaired_count"] == 1
+        assert stats["failure_counts"] == {PARSE_NULL: 1, PARSE_INVALID_JSON: 1}
+
+
+class TestStructuredChat:
+    @pytest.fixture
+    def server(self, monkeypatch):
+        server = StubLLMServer(RESPONSES, StubConfig())
+        server.start()
+        monkeypatch.setenv("OPENAI_API_BASE", server.base_url)
+        monkeypatch.setenv("OPENAI_API_KEY", "stub")
+        monkeypatch.delenv("MODEL_SETTINGS", raising=False)
+        monkeypatch.delenv("LLM_CACHE_DIR", raising=False)
+        monkeypatch.setenv("LLM_STRUCTURED_OUTPUT", "auto")
+        yield server
+        server.stop()
+
+    def test_chat(self, server):
+        llm_model = LLMModel()
+        messages = [{"role": "system", "content": "reply in json"}, {"role": "user", "content": "hello"}]
+        assert llm_model.chat(messages) == [{"step_name": "thought", "raw_text": "turn0"}]
+        assert server.stat.structured_count == 1
+        assert get_parse_stats()["structured_count"] == 1
+
+        # raw text and streaming are not structured
+        llm_model.chat(messages, for_raw=True)
+        llm_model.chat(messages, for_stream=True)
+        assert server.stat.structured_count == 1
+
+    def test_disabled(self, server, monkeypatch):
+        monkeypatch.delenv("LLM_STRUCTURED_OUTPUT", raising=False)
+        llm_model = LLMModel()
+        llm_model.chat([{"role": "user", "content": "hello"}])
+        assert server.stat.structured_count == 0
+
+    def test_downgrade(self, server):
+        server.config.response_format = False
+        llm_model = LLMModel()
+        llm_model.retry_policy = RetryPolicy(base_delay=0.01, jitter=0)
+        messages = [{"role": "system", "content": "reply in json"}, {"role": "user", "content": "hello"}]
+        assert llm_model.chat(messages) == [{"step_name": "thought", "raw_text": "turn0"}]
+        # json_schema and json_object are rejected, no retry of chat for them
+        assert server.stat.rejected_count == 2
+        assert server.stat.request_count == 3
+        assert StructuredOutputRegistryInstance.get_level(llm_model.model_config, LEVEL_JSON_SCHEMA) == LEVEL_NONE
+
+        llm_model.chat(messages)
+        assert server.stat.request_count == 4
+        assert server.stat.rejected_count == 2
+
+    def test_generic_rejection(self, server, monkeypatch):
+        # a proxy rejects response_format without a known message
+        monkeypatch.setattr("topsailai.ai_base.llm_structured.UNSUPPORTED_KEYWORDS", ())
+        server.config.response_format = False
+        llm_model = LLMModel()
+        llm_model.retry_policy = RetryPolicy(base_delay=0.01, jitter=0)
+        messages = [{"role": "system", "content": "reply in json"}, {"role": "user", "content": "hello"}]
+        assert llm_model.chat(messages) == [{"step_name": "thought", "raw_text": "turn0"}]
+        # retried once without response_format, no retries of the bad request
+        assert server.stat.rejected_count == 1
+        assert server.stat.request_count == 2
+        # it may be a bad request of other reasons, not downgraded at once
+        assert StructuredOutputRegistryInstance.get_level(llm_model.model_config, LEVEL_JSON_SCHEMA) == LEVEL_JSON_SCHEMA
+
+        llm_model.chat(messages)
+        llm_model.chat(messages)
+        assert server.stat.rejected_count == 3
+        assert server.stat.request_count == 6
+        assert StructuredOutputRegistryInstance.get_level(llm_model.model_config, LEVEL_JSON_SCHEMA) == LEVEL_NONE
+
+        llm_model.chat(messages)
+        assert server.stat.rejected_count == 3
+        assert server.stat.request_count == 7
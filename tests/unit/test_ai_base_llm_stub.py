@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+  Unit tests for ai_base llm_stub
+'''
+
+import pytest
+import sys
+import os
+import asyncio
+workspace_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if workspace_root not in sys.path:
+    sys.path.insert(0, workspace_root)
+    sys.path.insert(0, workspace_root + "/src")
+import openai
+from topsailai.utils.json_tool import json_dump
+from topsailai.ai_base.llm_stub import (
+    StubLLMServer,
+    StubConfig,
+    load_recorded_responses,
+    ERROR_RATE_LIMIT,
+    ERROR_INTERNAL_SERVER,
+)
+from topsailai.ai_base.llm_base import LLMModel, AsyncLLMModel, StopRegistryInstance
+from topsailai.ai_base.stream_parser import StepStreamParser
+from topsailai.ai_base.llm_retry import RetryPolicy
+
+RESPONSES = [
+    '[{"step_name": "thought", "raw_text": "turn0"}]',
+    '[{"step_name": "final_answer", "raw_text": "turn1"}]',
+]
+
+
+class TestStubLLMServer:
+    @pytest.fixture
+    def server(self, monkeypatch):
+        server = StubLLMServer(RESPONSES, StubConfig())
+        server.start()
+        monkeypatch.setenv("OPENAI_API_BASE", server.base_url)
+        monkeypatch.setenv("OPENAI_API_KEY", "stub")
+        monkeypatch.delenv("MODEL_SETTINGS", raising=False)
+        monkeypatch.delenv("LLM_CACHE_DIR", raising=False)
+        yield server
+        server.stop()
+
+    def test_load_recorded_responses(self, tmp_path):
+        file_path = tmp_path / "dump.msg"
+        file_path.write_text(json_dump([
+            {"role": "system", "content": "sys"},
+            {"role": "user", "content": "task"},
+            {"role": "assistant", "content": RESPONSES[0]},
+            {"role": "user", "content": "observation"},
+            {"role": "assistant", "content": RESPONSES[1]},
+        ]))
+        assert load_recorded_responses(str(file_path)) == RESPONSES
+
+    def test_chat(self, server):
+        llm_model = LLMModel()
+        messages = [{"role": "user", "content": "hello"}]
+        assert llm_model.chat(messages) == [{"step_name": "thought", "raw_text": "turn0"}]
+
+        # replay by turn
+        messages.append({"role": "assistant", "content": RESPONSES[0]})
+        assert llm_model.chat(messages) == [{"step_name": "final_answer", "raw_text": "turn1"}]
+
+    def test_chat_stream(self, server):
+        llm_model = LLMModel()
+        content = llm_model.chat([{"role": "user", "content": "hello"}], for_stream=True, for_raw=True)
+        assert content == RESPONSES[0]
+        assert server.stat.stream_count == 1
+
+        # usage of stream, no local tokenization
+        assert llm_model.tokenStat.usage_count == 1
+        assert llm_model.tokenStat.completion_tokens == server.stat.completion_tokens
+
+    def test_stop_sequences(self, server):
+        server.responses = ["topsailai.action\n{}\ntopsailai.observation\nhallucinated"]
+        messages = [
+            {"role": "system", "content": "output steps like topsailai.thought"},
+            {"role": "user", "content": "hello"},
+        ]
+        content = LLMModel().chat(messages, for_raw=True)
+        assert "observation" not in content
+        assert server.stat.stopped_count == 1
+
+    def test_stop_rejected(self, server):
+        StopRegistryInstance.clear()
+        server.config.stop = False
+        server.responses = ["topsailai.action\n{}\ntopsailai.observation\nhallucinated"]
+        messages = [
+            {"role": "system", "content": "output steps like topsailai.thought"},
+            {"role": "user", "content": "hello"},
+        ]
+        llm_model = LLMModel()
+        # retried without stop at once, not by the retry policy
+        assert llm_model.chat(messages, for_raw=True) == server.responses[0]
+        assert server.stat.stop_rejected_count == 1
+        assert server.stat.request_count == 2
+
+        # the endpoint is remembered
+        messages[1]["content"] = "hello again"
+        llm_model.chat(messages, for_raw=True)
+        assert server.stat.stop_rejected_count == 1
+        assert server.stat.request_count == 3
+        StopRegistryInstance.clear()
+
+    def test_stop_unsupported_model(self, server):
+        server.config.stop = False
+        messages = [
+            {"role": "system", "content": "output steps like topsailai.thought"},
+            {"role": "user", "content": "hello"},
+        ]
+        assert LLMModel(model_name="o3-mini").chat(messages, for_raw=True) == RESPONSES[0]
+        assert server.stat.stop_rejected_count == 0
+        assert server.stat.request_count == 1
+
+    def test_stream_abort(self, server):
+        server.config.tokens_per_second = 200
+        server.responses = [json_dump([
+            {"step_name": "action", "tool_call": "a", "tool_args": {}},
+            {"step_name": "observation", "raw_text": "x" * 400},
+        ])]
+        messages = [{"role": "user", "content": "hello"}]
+        llm_model = LLMModel()
+
+        # no stop step, it runs to the end
+        parser = StepStreamParser(stop_step_names=("final_answer",))
+        llm_model.chat(messages, for_stream=True, step_parser=parser)
+        assert llm_model.early_stop_stat.full_count == 1
+        assert llm_model.early_stop_stat.get_saved_tokens() == 0
+
+        parser = StepStreamParser(stop_step_names=("action",))
+        messages[0]["content"] = "hello again"
+        steps = llm_model.chat(messages, for_stream=True, step_parser=parser)
+        assert steps == [{"step_name": "action", "tool_call": "a", "tool_args": {}}]
+        stat = llm_model.early_stop_stat.to_dict()
+        assert stat["abort_count"] == 1
+        # the observation is not generated
+        assert 0 < stat["received_tokens"] < stat["saved_tokens"] < stat["full_tokens"]
+        assert stat["saved_seconds"] > 0
+
+    def test_async_chat(self, server):
+        llm_model = AsyncLLMModel()
+
+        async def _main():
+            return await asyncio.gather(*[
+                llm_model.chat([{"role": "user", "content": "hello"}]) for _ in range(10)
+            ])
+
+        results = asyncio.run(_main())
+        assert len(results) == 10
+        assert server.stat.request_count == 10
+
+    def test_async_chat_new_loops(self, server):
+        # the model is reused by event loops one after another, each loop has its own client
+        llm_model = AsyncLLMModel()
+        for _ in range(3):
+            assert asyncio.run(llm_model.chat([{"role": "user", "content": "hello"}])) is not None
+        assert server.stat.request_count == 3
+
+    def test_inject_errors(self, server):
+        server.config.errors = [ERROR_RATE_LIMIT, ERROR_INTERNAL_SERVER]
+        client = openai.OpenAI(api_key="stub", base_url=server.base_url, max_retries=0)
+        messages = [{"role": "user", "content": "hello"}]
+
+        with pytest.raises(openai.RateLimitError) as e:
+            client.chat.completions.create(model="m", messages=messages)
+        assert e.value.response.headers.get("retry-after") == "1"
+
+        with pytest.raises(openai.InternalServerError):
+            client.chat.completions.create(model="m", messages=messages)
+
+        response = client.chat.completions.create(model="m", messages=messages)
+        assert response.choices[0].message.content == RESPONSES[0]
+        assert server.stat.rate_limit_count == 1
+        assert server.stat.server_error_count == 1
+
+
+class TestChatMany:
+    @pytest.fixture
+    def server(self, monkeypatch):
+        server = StubLLMServer(RESPONSES, StubConfig(latency=0.05))
+        server.start()
+        monkeypatch.setenv("OPENAI_API_BASE", server.base_url)
+        monkeypatch.setenv("OPENAI_API_KEY", "stub")
+        monkeypatch.delenv("MODEL_SETTINGS", raising=False)
+        monkeypatch.delenv("LLM_CACHE_DIR", raising=False)
+        yield server
+        server.stop()
+
+    def test_chat_many(self, server):
+        llm_model = LLMModel()
+        messages_list = [[{"role": "user", "content": f"hello {i}"}] for i in range(6)]
+        results = list(llm_model.chat_many(messages_list, max_concurrency=3, for_raw=True))
+        assert sorted(x[0] for x in results) == list(range(6))
+        for _, result, error in results:
+            assert error is None
+            assert result == RESPONSES[0]
+        assert server.stat.request_count == 6
+        # the original model is not limited
+        assert llm_model.endpoint_limiter is None
+
+    def test_item_error(self, server):
+        server.config.errors = [ERROR_INTERNAL_SERVER]
+        llm_model = LLMModel()
+        llm_model.retry_policy = RetryPolicy(max_retries=0)
+        messages_list = [[{"role": "user", "content": f"hello {i}"}] for i in range(4)]
+        results = list(llm_model.chat_many(messages_list, max_concurrency=1, for_raw=True))
+        errors = [x for x in results if x[2] is not None]
+        assert len(results) == 4
+        assert len(errors) == 1
+        assert errors[0][1] is None
+
+    def test_async_chat_many(self, server):
+        async def _run():
+            llm_model = AsyncLLMModel()
+            messages_list = [[{"role": "user", "content": f"hello {i}"}] for i in range(6)]
+            return [x async for x in llm_model.chat_many(messages_list, max_concurrency=3, max_per_endpoint=2)]
+
+        results = asyncio.run(_run())
+        assert sorted(x[0] for x in results) == list(range(6))
+        assert all(x[2] is None for x in results)
+        assert results[0][1] == [{"step_name": "thought", "raw_text": "turn0"}]
+
+
+class TestPrefixCache:
+    def test_cached_tokens(self):
+        server = StubLLMServer(RESPONSES, StubConfig())
+        prompt = "x" * 400
+        assert server.get_cached_tokens(prompt) == 0
+        assert server.get_cached_tokens(prompt + "y" * 40) == 100
+        server.config.prefix_cache = False
+        assert server.get_cached_tokens(prompt) == 0
+        server.httpd.server_close()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+  Unit tests for ai_base prompt_base
+'''
+
+import pytest
+import sys
+import os
+workspace_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if workspace_root not in sys.path:
+    sys.path.insert(0, workspace_root)
+    sys.path.insert(0, workspace_root + "/src")
+from topsailai.ai_base.prompt_base import PromptBase
+
+
+class FakeHistory(object):
+    """ archive the long messages """
+    def __init__(self, max_size=100):
+        self.max_size = max_size
+        self.call_count = 0
+
+    def add_session_message(self, msg):
+        pass
+
+    def link_messages(self, messages):
+        self.call_count += 1
+        for msg in messages[3:-2]:
+            if len(msg["content"]) > self.max_size:
+                msg["content"] = "msg_id=xxx"
+
+
+@pytest.fixture
+def prompt(monkeypatch):
+    monkeypatch.delenv("CONTEXT_HISTORY_MANAGERS", raising=False)
+    prompt = PromptBase("system prompt", tool_prompt="tool prompt")
+    prompt.threshold_ctx_history.slim_len = 10000
+    return prompt
+
+
+def fill(prompt, count=20, size=400):
+    for i in range(count):
+        prompt.add_user_message(f"{i} " + "word " * size)
+        prompt.add_assistant_message(f"answer {i}")
+
+
+class TestFitContextWindow:
+    def test_within_budget(self, prompt):
+        fill(prompt, count=2)
+        messages = list(prompt.messages)
+        assert not prompt.fit_context_window(prompt.token_count)
+        assert prompt.messages == messages
+
+    def test_archive(self, prompt):
+        fill(prompt)
+        hook = FakeHistory()
+        prompt.hooks_ctx_history = [hook]
+        budget = prompt.token_count // 4
+        assert prompt.fit_context_window(budget)
+        assert hook.call_count == 1
+        assert prompt.token_count <= budget
+        # nothing is dropped
+        assert len(prompt.messages) == 3 + 40
+
+    def test_drop(self, prompt):
+        fill(prompt)
+        header = prompt.messages[:3]
+        last_messages = prompt.messages[-11:]
+        budget = prompt.token_count // 2
+        assert prompt.fit_context_window(budget)
+        assert prompt.token_count <= budget
+        assert prompt.messages[:3] == header
+        assert prompt.messages[-11:] == last_messages
+        assert "earlier messages are dropped" in prompt.messages[4]["content"]
+
+    def test_keep_task_message(self, prompt):
+        prompt.new_session("the task " + "goal " * 20)
+        task_message = prompt.messages[3]
+        fill(prompt)
+        assert prompt.fit_context_window(1500)
+        # the agent never loses its goal
+        assert prompt.messages[3] is task_message
+        assert "earlier messages are dropped" in prompt.messages[4]["content"]
+
+    def test_no_orphaned_tool_message(self, prompt):
+        fill(prompt, count=12)
+        prompt.messages[6] = {"role": "tool", "content": "result " * 400, "tool_call_id": "x"}
+        prompt.token_counter.sync(prompt.messages)
+        # the budget is met after dropping 2 messages, the tool message goes with them
+        items = prompt.token_counter.items
+        budget = prompt.token_count - items[4][2] - items[5][2] + 50
+        assert prompt.fit_context_window(budget)
+        assert all(msg["role"] != "tool" for msg in prompt.messages)
+        assert len(prompt.messages) == 3 + 24 - 3 + 1
+
+
+class FakeToolCall(object):
+    def __init__(self, id):
+        self.id = id
+
+
+class TestToolCallId:
+    def test_each_id(self, prompt):
+        prompt.add_assistant_message("calls", tool_calls=[FakeToolCall("a"), {"id": "b"}])
+        assert prompt.get_tool_call_id() == "a"
+        prompt.add_tool_message("result a")
+        assert prompt.get_tool_call_id() == "b"
+        prompt.add_tool_message("result b")
+        assert prompt.get_tool_call_id() is None
+        assert [msg.get("tool_call_id") for msg in prompt.messages[-2:]] == ["a", "b"]
+
+    def test_given_id(self, prompt):
+        prompt.add_assistant_message("calls", tool_calls=[FakeToolCall("a"), FakeToolCall("b")])
+        prompt.add_tool_message("result b", tool_call_id="b")
+        assert prompt.get_tool_call_id() == "a"
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+  Unit tests for ai_base stream_parser
+'''
+
+import pytest
+import sys
+import os
+import threading
+workspace_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if workspace_root not in sys.path:
+    sys.path.insert(0, workspace_root)
+    sys.path.insert(0, workspace_root + "/src")
+from topsailai.utils.json_tool import json_dump
+from topsailai.ai_base.stream_parser import StepStreamParser, is_complete_json
+from topsailai.ai_base.llm_base import _format_response
+from topsailai.ai_base.agent_base import StepCallBase, StepDispatcher
+
+TOPSAILAI_CONTENT = (
+    "topsailai.thought\n"
+    "I need the date\n"
+    "topsailai.action\n"
+    '{"tool_call": "time_tool.get_local_date", "tool_args": {"fmt": "}"}}\n'
+)
+JSON_CONTENT = json_dump([
+    {"step_name": "thought", "raw_text": 'a "quoted" ] } text'},
+    {"step_name": "action", "tool_call": "time_tool.get_local_date", "tool_args": {"l": [1, 2]}},
+])
+CONTENTS = [
+    TOPSAILAI_CONTENT,
+    JSON_CONTENT,
+    "hello topsailai.thought\nx\ntopsailai.final_answer\ndone",
+    '{"step_name": "final_answer", "raw_text": "ok"}',
+    "```json\n" + JSON_CONTENT + "\n```",
+]
+
+
+def feed_all(parser, content, size):
+    for i in range(0, len(content), size):
+        parser.feed(content[i:i+size])
+    parser.finish()
+    return parser.steps
+
+
+class TestStepStreamParser:
+    @pytest.mark.parametrize("content", CONTENTS)
+    @pytest.mark.parametrize("size", [1, 3, 7, 1000])
+    def test_same_as_final_parsing(self, content, size):
+        expected = _format_response(content)
+        if isinstance(expected[0], list):
+            # code block of a list
+            expected = expected[0]
+        assert feed_all(StepStreamParser(), content, size) == expected
+
+    def test_emit_before_end(self):
+        events = []
+        parser = StepStreamParser(on_step=lambda index, step: events.append((index, len(parser.content))))
+        content = TOPSAILAI_CONTENT + "topsailai.thought\nthe model keeps writing\n"
+        feed_all(parser, content, 5)
+        assert events[0][0] == 0
+        # the action is emitted when its json is complete, not at the next marker
+        assert events[1][0] == 1
+        assert events[1][1] <= len(TOPSAILAI_CONTENT)
+        assert parser.steps[1]["step_name"] == "action"
+
+    @pytest.mark.parametrize("size", [1, 5, 1000])
+    def test_stop_step(self, size):
+        content = json_dump([
+            {"step_name": "thought", "raw_text": "x"},
+            {"step_name": "action", "tool_call": "a", "tool_args": {}},
+            {"step_name": "observation", "raw_text": "hallucinated"},
+        ])
+        parser = StepStreamParser(stop_step_names=("action",))
+        for i in range(0, len(content), size):
+            parser.feed(content[i:i+size])
+            if parser.is_done:
+                break
+        parser.finish()
+        assert [step["step_name"] for step in parser.steps] == ["thought", "action"]
+        assert _format_response(parser.get_done_content()) == parser.steps
+
+    def test_stop_step_topsailai(self):
+        content = TOPSAILAI_CONTENT + "topsailai.observation\nhallucinated\n"
+        parser = StepStreamParser(stop_step_names=("action",))
+        feed_all(parser, content, 3)
+        assert parser.is_done
+        assert "observation" not in parser.get_done_content()
+        assert _format_response(parser.get_done_content()) == parser.steps
+
+    def test_reset(self):
+        parser = StepStreamParser()
+        feed_all(parser, JSON_CONTENT, 10)
+        parser.reset()
+        assert parser.steps == []
+        assert parser.content == ""
+
+    def test_is_complete_json(self):
+        assert is_complete_json('{"a": 1}')
+        assert is_complete_json('```json\n{"a": 1}\n```')
+        assert not is_complete_json('{"a": ')
+        assert not is_complete_json('```json\n{"a": 1}')
+
+
+class CountStep(StepCallBase):
+    early_step_names = ("action",)
+    calls = []
+    lock = threading.Lock()
+
+    def _execute(self, step, tools, response, index, rsp_msg_obj=None):
+        with self.lock:
+            self.calls.append(step)
+        self.tool_msg = {"step_name": "observation", "raw_text": "ok"}
+        self.code = self.CODE_STEP_FINAL
+
+
+class TestStepDispatcher:
+    def setup_method(self):
+        CountStep.calls = []
+
+    def test_reuse(self):
+        dispatcher = StepDispatcher(CountStep(), tools={})
+        parser = StepStreamParser(on_step=dispatcher.on_step)
+        steps = feed_all(parser, JSON_CONTENT, 4)
+
+        ret = dispatcher.pop_result(steps[1])
+        assert ret.tool_msg["raw_text"] == "ok"
+        assert dispatcher.pop_result(steps[0]) is None
+        dispatcher.close()
+        assert len(CountStep.calls) == 1
+        assert (dispatcher.dispatched_count, dispatcher.reused_count, dispatcher.wasted_count) == (1, 1, 0)
+
+    def test_first_action_only(self):
+        dispatcher = StepDispatcher(CountStep(), tools={})
+        parser = StepStreamParser(on_step=dispatcher.on_step)
+        content = json_dump([
+            {"step_name": "final_answer", "raw_text": "done"},
+            {"step_name": "action", "tool_call": "a", "tool_args": {}},
+        ])
+        feed_all(parser, content, 4)
+        dispatcher.close()
+        assert dispatcher.dispatched_count == 0
+
+    def test_different_tool_call(self):
+        dispatcher = StepDispatcher(CountStep(), tools={})
+        parser = StepStreamParser(on_step=dispatcher.on_step)
+        feed_all(parser, JSON_CONTENT, 4)
+        for future in dispatcher.futures.values():
+            future.result()
+        step = {"step_name": "action", "tool_call": "time_tool.get_local_date", "tool_args": {"l": [3]}}
+        assert dispatcher.pop_result(step) is None
+        dispatcher.close()
+        assert dispatcher.wasted_count == 1
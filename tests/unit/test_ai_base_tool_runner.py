@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+  Unit tests for ai_base tool_runner
+'''
+
+import pytest
+import sys
+import os
+import time
+import threading
+import subprocess
+workspace_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if workspace_root not in sys.path:
+    sys.path.insert(0, workspace_root)
+    sys.path.insert(0, workspace_root + "/src")
+from topsailai.ai_base.tool_runner import ToolRunner
+from topsailai.utils.cmd_tool import exec_cmd, CmdCancelled
+from topsailai.utils.thread_local_tool import (
+    ctxm_give_agent_name,
+    get_agent_name,
+    is_cancelled,
+)
+from topsailai.tools.cmd_tool import exec_cmd as tool_exec_cmd
+
+
+def pid_alive(pid:int) -> bool:
+    """ a zombie is not alive, it waits for the reaper """
+    try:
+        with open(f"/proc/{pid}/stat") as fd:
+            return fd.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except FileNotFoundError:
+        return False
+
+
+class TestExecCmd:
+    def test_timeout_kills_group(self, tmp_path):
+        pid_file = tmp_path / "pid"
+        start = time.time()
+        with pytest.raises(subprocess.TimeoutExpired) as e:
+            exec_cmd(f"echo begin; sleep 30 & echo $! > {pid_file}; wait", timeout=0.5)
+        assert time.time() - start < 5
+        assert e.value.output == b"begin\n"
+        # the grandchild is killed too
+        time.sleep(0.1)
+        assert not pid_alive(int(pid_file.read_text()))
+
+    def test_cancel(self):
+        cancel_event = threading.Event()
+        threading.Timer(0.3, cancel_event.set).start()
+        start = time.time()
+        with pytest.raises(CmdCancelled):
+            exec_cmd("sleep 30", cancel_event=cancel_event)
+        assert time.time() - start < 5
+
+    def test_tool_timeout(self):
+        code, stdout, stderr = tool_exec_cmd("echo begin; sleep 30", timeout=1)
+        assert code == -1
+        assert stdout == "begin"
+        assert "timeout" in stderr
+
+
+class TestToolRunner:
+    def test_result(self):
+        runner = ToolRunner(timeout=5)
+        with ctxm_give_agent_name("a1"):
+            assert runner.call("t", lambda x: (x, get_agent_name()), {"x": 1}) == (1, "a1")
+        with pytest.raises(ValueError):
+            runner.call("t", lambda: int("x"), {})
+
+    def test_timeout(self):
+        runner = ToolRunner(timeout=0.3, grace=1)
+        states = []
+
+        def _slow():
+            while not is_cancelled():
+                time.sleep(0.05)
+            states.append("cancelled")
+            return "late"
+
+        start = time.time()
+        ret = runner.call("t.slow", _slow, {})
+        assert ret.startswith("timeout:")
+        assert states == ["cancelled"]
+        assert time.time() - start < 2
+        assert runner.to_dict()["timeout_count"] == 1
+
+    def test_cmd_cancelled(self):
+        runner = ToolRunner(timeout=0.5, grace=3)
+        start = time.time()
+        ret = runner.call("cmd_tool.exec_cmd", lambda cmd: exec_cmd(cmd), {"cmd": "sleep 30"})
+        assert ret.startswith("timeout:")
+        # the command is killed on the cancellation, no need to wait the whole grace
+        assert time.time() - start < 2
+
+    def test_get_timeout(self):
+        runner = ToolRunner(timeout=10, grace=5)
+        assert runner.get_timeout(tool_exec_cmd, {"cmd": "ls"}) == 10
+        assert runner.get_timeout(tool_exec_cmd, {"cmd": "ls", "timeout": 100}) == 105
+        assert runner.get_timeout(lambda cmd: cmd, {"cmd": "ls", "timeout": 100}) == 10
+        assert runner.get_timeout(tool_exec_cmd, {"cmd": "ls"}, {"timeout": 0}) == 0
+
+    def test_no_timeout_by_default(self, monkeypatch):
+        monkeypatch.delenv("TOOL_TIMEOUT", raising=False)
+        runner = ToolRunner.from_env()
+        assert runner.get_timeout(lambda: None, {}) == 0
+        assert runner.call("t", lambda: threading.current_thread(), {}) is threading.current_thread()
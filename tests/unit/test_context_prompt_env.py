@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+  Unit tests for context prompt_env
+'''
+
+import pytest
+import sys
+import os
+workspace_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if workspace_root not in sys.path:
+    sys.path.insert(0, workspace_root)
+    sys.path.insert(0, workspace_root + "/src")
+from topsailai.context import prompt_env
+from topsailai.context.prompt_env import (
+    generate_prompt_for_env,
+    generate_prompt_for_tail,
+    get_env_mode,
+)
+from topsailai.ai_base.prompt_base import PromptBase
+
+
+class FakeTimeTool(object):
+    """ the time goes on for each call """
+    def __init__(self):
+        self.count = 0
+
+    def get_current_date(self, with_t=False):
+        self.count += 1
+        return f"2026-10-17T10:00:{self.count:02d}"
+
+    def get_current_day(self):
+        return "2026-10-17"
+
+
+@pytest.fixture
+def fake_time(monkeypatch):
+    monkeypatch.delenv("CONTEXT_HISTORY_MANAGERS", raising=False)
+    monkeypatch.setattr(prompt_env, "time_tool", FakeTimeTool())
+
+
+class TestPromptEnv:
+    def test_mode(self, monkeypatch):
+        monkeypatch.delenv("PROMPT_ENV_MODE", raising=False)
+        assert get_env_mode() == "stable"
+        monkeypatch.setenv("PROMPT_ENV_MODE", "Tail")
+        assert get_env_mode() == "tail"
+        monkeypatch.setenv("PROMPT_ENV_MODE", "xxx")
+        assert get_env_mode() == "stable"
+
+    def test_generate(self, fake_time):
+        assert generate_prompt_for_env("dynamic") != generate_prompt_for_env("dynamic")
+        assert generate_prompt_for_env("stable") == generate_prompt_for_env("stable")
+        assert "CurrentDate: 2026-10-17\n" in generate_prompt_for_env("stable")
+        assert "CurrentDate" not in generate_prompt_for_env("tail")
+        assert generate_prompt_for_tail("stable") == ""
+        # to the minute
+        assert generate_prompt_for_tail("tail") == "CurrentDate: 2026-10-17T10:00"
+
+
+class TestPromptLayout:
+    def test_stable(self, fake_time, monkeypatch):
+        monkeypatch.setenv("PROMPT_ENV_MODE", "stable")
+        prompt = PromptBase("system prompt")
+        prompt.add_user_message("hello")
+        env_msg = prompt.messages[1]
+        prompt.update_message_for_env()
+        # the same object, nothing is rewritten
+        assert prompt.messages[1] is env_msg
+        assert prompt.get_messages_for_chat() is prompt.messages
+
+    def test_dynamic(self, fake_time, monkeypatch):
+        monkeypatch.setenv("PROMPT_ENV_MODE", "dynamic")
+        prompt = PromptBase("system prompt")
+        env_content = prompt.messages[1]["content"]
+        prompt.update_message_for_env()
+        assert prompt.messages[1]["content"] != env_content
+        assert prompt.token_count == prompt.token_counter.sync(prompt.messages)
+
+    def test_tail(self, fake_time, monkeypatch):
+        monkeypatch.setenv("PROMPT_ENV_MODE", "tail")
+        prompt = PromptBase("system prompt")
+        prompt.add_user_message("hello")
+        messages = prompt.get_messages_for_chat()
+        assert messages[:-1] == prompt.messages[:-1]
+        # no system message after the history
+        assert messages[-1]["role"] == "user"
+        assert messages[-1]["content"] == 'hello\n\n[CurrentDate: 2026-10-17T10:00]'
+        # the history is not changed
+        assert len(prompt.messages) == 3
+        assert prompt.messages[-1]["content"] == 'hello'
+        # the same request in the same minute
+        assert prompt.get_messages_for_chat() == messages
+
+        prompt.add_assistant_message("answer")
+        assert prompt.get_messages_for_chat()[-1] == {"role": "user", "content": "[CurrentDate: 2026-10-17T10:00]"}
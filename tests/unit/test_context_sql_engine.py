@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+  Unit tests for context sql_engine
+'''
+
+import sys
+import os
+workspace_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if workspace_root not in sys.path:
+    sys.path.insert(0, workspace_root)
+    sys.path.insert(0, workspace_root + "/src")
+from topsailai.context.sql_engine import get_engine, is_memory_conn
+from topsailai.context.session_manager.sql import SessionSQLAlchemy
+from topsailai.context.session_manager.__base import SessionData
+
+
+class TestSqlEngine:
+    def test_shared(self, tmp_path):
+        conn = f"sqlite:///{tmp_path}/1.db"
+        assert get_engine(conn) is get_engine(conn)
+        mgr1 = SessionSQLAlchemy(conn)
+        mgr1.create_session(SessionData(session_id="s1", task="t1"))
+        mgr2 = SessionSQLAlchemy(conn)
+        assert mgr2.engine is mgr1.engine
+        assert mgr2.exists_session("s1")
+
+    def test_memory(self):
+        assert is_memory_conn("sqlite://")
+        assert is_memory_conn("sqlite:///:memory:")
+        assert not is_memory_conn("sqlite:///memory.db")
+        assert get_engine("sqlite://") is not get_engine("sqlite://")
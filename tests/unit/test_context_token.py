@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+  Unit tests for context token
+'''
+
+import pytest
+import sys
+import os
+import threading
+workspace_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if workspace_root not in sys.path:
+    sys.path.insert(0, workspace_root)
+    sys.path.insert(0, workspace_root + "/src")
+from topsailai.context import token
+from topsailai.context.token import (
+    TokenStat,
+    TokenWorker,
+    UsageStat,
+    parse_usage,
+)
+
+
+class TestParseUsage:
+    def test_openai(self):
+        usage = {"prompt_tokens": 10, "completion_tokens": 5, "prompt_tokens_details": {"cached_tokens": 8}}
+        assert parse_usage(usage) == dict(prompt_tokens=10, completion_tokens=5, cached_tokens=8)
+
+    def test_deepseek(self):
+        usage = {"prompt_tokens": 10, "completion_tokens": 5, "prompt_cache_hit_tokens": 6}
+        assert parse_usage(usage)["cached_tokens"] == 6
+
+    def test_none(self):
+        assert parse_usage(None) is None
+
+
+class TestUsageStat:
+    def test_aggregate(self):
+        stat = UsageStat(max_session_count=2)
+        usage = dict(prompt_tokens=10, completion_tokens=2, cached_tokens=4)
+        stat.add(usage, model_name="m1", agent_name="a1", session_id="s1")
+        stat.add(usage, agent_name="a1", session_id="s2")
+        stat.add(usage, agent_name="a2", session_id="s3", estimated=True)
+
+        stats = stat.get_stats()
+        assert stats["total"]["call_count"] == 3
+        assert stats["total"]["prompt_tokens"] == 30
+        assert stats["total"]["estimated_count"] == 1
+        assert stats["agents"]["a1"]["completion_tokens"] == 4
+        assert stats["models"]["m1"]["call_count"] == 1
+        # the oldest session is dropped
+        assert list(stats["sessions"].keys()) == ["s2", "s3"]
+
+
+class TestTokenStat:
+    @pytest.fixture
+    def usage_stat(self, monkeypatch):
+        usage_stat = UsageStat()
+        monkeypatch.setattr(token, "UsageStatInstance", usage_stat)
+        return usage_stat
+
+    @pytest.fixture
+    def worker(self, monkeypatch):
+        worker = TokenWorker()
+        monkeypatch.setattr(token, "TokenWorkerInstance", worker)
+        yield worker
+        worker.shutdown()
+
+    def test_usage(self, usage_stat, worker):
+        stat = TokenStat("test")
+        stat.add_msgs([{"role": "user", "content": "hello"}])
+        parsed = stat.add_usage(
+            {"prompt_tokens": 10, "completion_tokens": 3},
+            labels=dict(agent_name="a1", session_id="s1"),
+        )
+
+        assert parsed["prompt_tokens"] == 10
+        assert (stat.prompt_tokens, stat.completion_tokens, stat.usage_count) == (10, 3, 1)
+        # no local tokenization
+        assert worker.thread is None
+        assert usage_stat.get_session_stat("s1")["prompt_tokens"] == 10
+
+    def test_fallback(self, usage_stat, worker, monkeypatch):
+        monkeypatch.setattr(token, "count_tokens", lambda text, *_: len(text))
+        stat = TokenStat("test")
+        stat.add_msgs("hello")
+        assert stat.add_usage(None, content="abc", labels=dict(session_id="s1")) is None
+        worker.join()
+
+        assert stat.estimated_count == 1
+        assert (stat.prompt_tokens, stat.completion_tokens) == (5, 3)
+        assert usage_stat.get_session_stat("s1")["estimated_count"] == 1
+
+    def test_fallback_messages(self, usage_stat, worker):
+        stat = TokenStat("test")
+        msgs = [{"role": "user", "content": "hello world"}]
+        stat.add_msgs(msgs)
+        stat.add_usage(None, content="abc")
+        worker.join()
+        # the messages are counted as messages, not as the repr of list
+        assert stat.prompt_tokens == token.count_messages_tokens(msgs)
+        assert stat.current_text_len == len("hello world")
+
+    def test_concurrent_calls(self, usage_stat, worker, monkeypatch):
+        monkeypatch.setattr(token, "count_tokens", lambda text, *_: len(text))
+        stat = TokenStat("test")
+        barrier = threading.Barrier(2)
+
+        def _call(msgs):
+            stat.add_msgs(msgs)
+            barrier.wait()
+            stat.add_usage(None)
+
+        threads = [threading.Thread(target=_call, args=(msgs,)) for msgs in ("a" * 10, "b" * 100)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        worker.join()
+        # each call has its own msgs
+        assert stat.estimated_count == 2
+        assert stat.prompt_tokens == 110
+
+    def test_drop_msgs(self, worker):
+        stat = TokenStat("test")
+        stat.add_msgs("hello")
+        stat.drop_msgs()
+        stat.add_usage(None)
+        assert worker.thread is None
+
+
+class TestTokenWorker:
+    def test_one_thread(self, monkeypatch):
+        monkeypatch.setattr(token, "count_tokens", lambda text, *_: len(text))
+        worker = TokenWorker()
+        monkeypatch.setattr(token, "TokenWorkerInstance", worker)
+
+        thread_count = threading.active_count()
+        stats = [TokenStat(i) for i in range(20)]
+        for stat in stats:
+            stat.add_msgs("hello")
+            stat.add_usage(None)
+        worker.join()
+        assert threading.active_count() <= thread_count + 1
+        assert all(stat.estimated_count == 1 for stat in stats)
+
+        worker.shutdown()
+        assert threading.active_count() <= thread_count
+
+    def test_shutdown_idle(self):
+        worker = TokenWorker()
+        worker.shutdown()
+        assert worker.thread is None
+
+
+class FakeEncoding(object):
+    def encode(self, text, **_):
+        return text.split()
+
+
+class TestCountTokens:
+    @pytest.fixture(autouse=True)
+    def fake_tiktoken(self, monkeypatch):
+        calls = []
+
+        def _get_encoding(name):
+            calls.append(name)
+            return FakeEncoding()
+
+        def _encoding_for_model(name):
+            if name != "gpt-4o":
+                raise KeyError(name)
+            calls.append(name)
+            return FakeEncoding()
+
+        monkeypatch.setattr(token.tiktoken, "get_encoding", _get_encoding)
+        monkeypatch.setattr(token.tiktoken, "encoding_for_model", _encoding_for_model)
+        token.get_encoding.cache_clear()
+        token.get_encoding_for_model.cache_clear()
+        token.MessageTokenMemoInstance.clear()
+        yield calls
+        token.get_encoding.cache_clear()
+        token.get_encoding_for_model.cache_clear()
+        token.MessageTokenMemoInstance.clear()
+
+    def test_cached_encoder(self, fake_tiktoken):
+        assert token.count_tokens("a b c") == 3
+        assert token.count_tokens("a b") == 2
+        assert fake_tiktoken == ["cl100k_base"]
+
+    def test_model(self, fake_tiktoken):
+        assert token.count_tokens_for_model("a b", "gpt-4o") == 2
+        # unknown model, the default encoding
+        assert token.count_tokens_for_model("a b", "DeepSeek-V3") == 2
+        token.count_tokens_for_model("a", "DeepSeek-V3")
+        assert fake_tiktoken == ["gpt-4o", "cl100k_base"]
+
+    def test_no_encoder(self, monkeypatch):
+        def _get_encoding(name):
+            raise ValueError("offline")
+        monkeypatch.setattr(token.tiktoken, "get_encoding", _get_encoding)
+        token.get_encoding.cache_clear()
+        assert token.count_tokens("12345678") == 2
+
+    def test_counter(self):
+        counter = token.MessagesTokenCounter()
+        messages = [{"role": "user", "content": "a b"}, {"role": "user", "content": "c"}]
+        for msg in messages:
+            counter.append(msg)
+        per_msg = token.TOKENS_PER_MESSAGE
+        assert counter.total == 3 + 2 * per_msg
+
+        messages[1] = {"role": "user", "content": "c d e"}
+        counter.replace(1, messages[1])
+        assert counter.total == 5 + 2 * per_msg
+
+        # archived in place
+        messages[0]["content"] = "x"
+        assert counter.sync(messages) == 4 + 2 * per_msg
+
+        # removed
+        assert counter.sync(messages[:1]) == 1 + per_msg
+
+    def test_memo(self):
+        messages = [{"role": "user", "content": f"word {i}"} for i in range(10)]
+        token.count_messages_tokens(messages)
+        token.count_messages_tokens(messages)
+        memo = token.MessageTokenMemoInstance
+        assert (memo.hit_count, memo.miss_count) == (10, 10)
+
+
+class TestContextWindow:
+    def test_model(self, monkeypatch):
+        monkeypatch.delenv("CONTEXT_WINDOW", raising=False)
+        assert token.get_context_window("gpt-4") == 8192
+        assert token.get_context_window("gpt-4o-mini") == 128000
+        assert token.get_context_window("openai/gpt-4.1") == 1047576
+        assert token.get_context_window("DeepSeek-V3.1-Terminus") == 128000
+        assert token.get_context_window("unknown") == token.DEFAULT_CONTEXT_WINDOW
+        assert token.get_context_window(None) == token.DEFAULT_CONTEXT_WINDOW
+
+    def test_env(self, monkeypatch):
+        monkeypatch.setenv("CONTEXT_WINDOW", "32000")
+        assert token.get_context_window("gpt-4o") == 32000
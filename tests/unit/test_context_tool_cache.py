@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+  Unit tests for context tool_cache
+'''
+
+import pytest
+import sys
+import os
+import time
+workspace_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if workspace_root not in sys.path:
+    sys.path.insert(0, workspace_root)
+    sys.path.insert(0, workspace_root + "/src")
+from topsailai.context.tool_cache import ToolCache, ToolCacheInstance
+from topsailai.tools import TOOLS, TOOLS_META
+from topsailai.tools.file_tool import write_file, append_file
+from topsailai.utils.thread_local_tool import set_thread_var, unset_thread_var, KEY_SESSION_ID
+from topsailai.ai_base.agent_types.react import Step4ReAct
+
+
+class CountingRead(object):
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, file_path):
+        self.count += 1
+        return TOOLS["file_tool.read_file"](file_path)
+
+
+@pytest.fixture
+def session(monkeypatch):
+    monkeypatch.delenv("TOOL_CACHE", raising=False)
+    set_thread_var(KEY_SESSION_ID, "s1")
+    ToolCacheInstance.clear()
+    yield "s1"
+    unset_thread_var(KEY_SESSION_ID)
+    ToolCacheInstance.clear()
+
+
+@pytest.fixture
+def file_path(tmp_path):
+    path = str(tmp_path / "1.txt")
+    with open(path, "w") as fd:
+        fd.write("hello")
+    return path
+
+
+META = {"cache": {"path_args": ["file_path"]}}
+
+
+class TestToolCache:
+    def test_hit(self, session, file_path):
+        cache = ToolCache()
+        read = CountingRead()
+        assert cache.call("read", read, {"file_path": file_path}, META) == "hello"
+        assert cache.call("read", read, {"file_path": file_path}, META) == "hello"
+        assert read.count == 1
+        assert cache.to_dict()["hit_count"] == 1
+
+        # not cacheable
+        cache.call("read", read, {"file_path": file_path}, {})
+        assert read.count == 2
+
+    def test_no_session(self, file_path):
+        unset_thread_var(KEY_SESSION_ID)
+        cache = ToolCache()
+        read = CountingRead()
+        cache.call("read", read, {"file_path": file_path}, META)
+        cache.call("read", read, {"file_path": file_path}, META)
+        assert read.count == 2
+
+    def test_sessions(self, session, file_path):
+        cache = ToolCache()
+        read = CountingRead()
+        cache.call("read", read, {"file_path": file_path}, META)
+        set_thread_var(KEY_SESSION_ID, "s2")
+        cache.call("read", read, {"file_path": file_path}, META)
+        assert read.count == 2
+
+    def test_changed_file(self, session, file_path):
+        cache = ToolCache()
+        read = CountingRead()
+        cache.call("read", read, {"file_path": file_path}, META)
+        with open(file_path, "a") as fd:
+            fd.write(" world")
+        assert cache.call("read", read, {"file_path": file_path}, META) == "hello world"
+        assert read.count == 2
+
+    def test_ttl(self, session, file_path):
+        cache = ToolCache()
+        read = CountingRead()
+        meta = {"cache": {"path_args": ["file_path"], "ttl": 0.05}}
+        cache.call("read", read, {"file_path": file_path}, meta)
+        time.sleep(0.1)
+        cache.call("read", read, {"file_path": file_path}, meta)
+        assert read.count == 2
+
+    def test_max_entries(self, session, tmp_path):
+        cache = ToolCache(max_entries=2)
+        read = CountingRead()
+        for i in range(3):
+            path = str(tmp_path / f"{i}.txt")
+            write_file(path, str(i))
+            cache.call("read", read, {"file_path": path}, META)
+        assert cache.to_dict()["entry_count"] == 2
+
+    def test_invalidate_by_write(self, session, file_path):
+        read = CountingRead()
+        ToolCacheInstance.call("read", read, {"file_path": file_path}, META)
+        # the same size and maybe the same mtime, the write invalidates it
+        write_file(file_path, "HELLO")
+        assert ToolCacheInstance.call("read", read, {"file_path": file_path}, META) == "HELLO"
+        append_file(file_path, "!")
+        assert ToolCacheInstance.call("read", read, {"file_path": file_path}, META) == "HELLO!"
+        assert read.count == 3
+        assert ToolCacheInstance.to_dict()["invalidated_count"] == 2
+
+
+class TestStep4ReAct:
+    def test_memoized(self, session, file_path):
+        assert TOOLS_META["file_tool.read_file"]["cache"]
+        read = CountingRead()
+        tools = {"file_tool.read_file": read}
+        step = {"step_name": "action", "tool_call": "file_tool.read_file", "tool_args": {"file_path": file_path}}
+        for _ in range(2):
+            ret = Step4ReAct()(step, tools=tools, response=[step], index=0)
+            assert ret.tool_msg["raw_text"] == "hello"
+        assert read.count == 1
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+  Unit tests for daemon server and client
+'''
+
+import pytest
+import sys
+import os
+import time
+import subprocess
+workspace_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if workspace_root not in sys.path:
+    sys.path.insert(0, workspace_root)
+    sys.path.insert(0, workspace_root + "/src")
+from topsailai.daemon.client import run_by_daemon, connect, get_socket_path
+from topsailai.daemon.server import AgentDaemon
+
+
+SCRIPT = '''
+import os
+import sys
+from topsailai.daemon import client
+print("argv:", sys.argv[1:])
+print("env:", os.getenv("DAEMON_TEST_VAR"))
+print("cwd:", os.getcwd())
+print("stdin:", sys.stdin.readline().strip())
+print("in_daemon:", client.g_in_daemon)
+print("err", file=sys.stderr)
+sys.exit(int(os.getenv("DAEMON_TEST_CODE", "0")))
+'''
+
+DAEMON = '''
+import sys
+from topsailai.daemon.server import AgentDaemon
+AgentDaemon(socket_path=sys.argv[1], cli_dir=sys.argv[2], warm_modules=(), warm_resources=False).serve_forever()
+'''
+
+
+@pytest.fixture
+def daemon(tmp_path, monkeypatch):
+    monkeypatch.setenv("AGENT_DAEMON", "1")
+    cli_dir = tmp_path / "cli"
+    cli_dir.mkdir()
+    (cli_dir / "echo_args.py").write_text(SCRIPT)
+    socket_path = str(tmp_path / "run" / "d.sock")
+    env = dict(os.environ, PYTHONPATH=workspace_root + "/src")
+    proc = subprocess.Popen([sys.executable, "-c", DAEMON, socket_path, str(cli_dir)], env=env)
+    for _ in range(100):
+        sock = connect(socket_path)
+        if sock is not None:
+            sock.close()
+            break
+        time.sleep(0.05)
+    yield (socket_path, str(cli_dir / "echo_args.py"))
+    proc.terminate()
+    proc.wait(timeout=10)
+    assert not os.path.exists(socket_path)
+
+
+def run_script(tmp_path, socket_path, script_path, argv, stdin_text=""):
+    stdin_path = tmp_path / "stdin"
+    stdin_path.write_text(stdin_text)
+    with open(stdin_path) as stdin, open(tmp_path / "stdout", "w+") as stdout, open(tmp_path / "stderr", "w+") as stderr:
+        code = run_by_daemon(script_path, argv, fds=(stdin.fileno(), stdout.fileno(), stderr.fileno()), socket_path=socket_path)
+    return (code, (tmp_path / "stdout").read_text(), (tmp_path / "stderr").read_text())
+
+
+class TestAgentDaemon:
+    def test_run(self, daemon, tmp_path, monkeypatch):
+        socket_path, script_path = daemon
+        monkeypatch.setenv("DAEMON_TEST_VAR", "v1")
+        monkeypatch.setenv("DAEMON_TEST_CODE", "3")
+        monkeypatch.chdir(tmp_path)
+        code, stdout, stderr = run_script(tmp_path, socket_path, script_path, ["a", "b c"], "hello\n")
+        assert code == 3
+        assert stdout.splitlines() == [
+            "argv: ['a', 'b c']",
+            "env: v1",
+            f"cwd: {tmp_path}",
+            "stdin: hello",
+            "in_daemon: True",
+        ]
+        assert stderr == "err\n"
+
+        # the next request gets its own env
+        monkeypatch.setenv("DAEMON_TEST_VAR", "v2")
+        monkeypatch.delenv("DAEMON_TEST_CODE")
+        code, stdout, _ = run_script(tmp_path, socket_path, script_path, [])
+        assert code == 0
+        assert "env: v2" in stdout
+
+    def test_refused(self, daemon, tmp_path):
+        socket_path, _ = daemon
+        # only the scripts in the cli folder of daemon
+        code, _, _ = run_script(tmp_path, socket_path, "/tmp/other.py", [])
+        assert code is None
+
+    def test_unavailable(self, tmp_path, monkeypatch):
+        monkeypatch.setenv("AGENT_DAEMON", "1")
+        assert run_by_daemon("echo_args.py", [], socket_path=str(tmp_path / "none.sock")) is None
+        monkeypatch.setenv("AGENT_DAEMON", "0")
+        assert run_by_daemon("echo_args.py", [], socket_path=str(tmp_path / "none.sock")) is None
+
+    def test_disabled_by_default(self, daemon, tmp_path, monkeypatch):
+        socket_path, script_path = daemon
+        monkeypatch.delenv("AGENT_DAEMON")
+        code, _, _ = run_script(tmp_path, socket_path, script_path, [])
+        assert code is None
+
+    def test_insecure_folder(self, daemon, tmp_path):
+        socket_path, script_path = daemon
+        folder = os.path.dirname(socket_path)
+        os.chmod(folder, 0o755)
+        try:
+            # the client does not send the env to a socket which may be of another user
+            assert connect(socket_path) is None
+            code, _, _ = run_script(tmp_path, socket_path, script_path, [])
+            assert code is None
+        finally:
+            os.chmod(folder, 0o700)
+
+    def test_symlink_folder(self, daemon, tmp_path):
+        socket_path, script_path = daemon
+        link = tmp_path / "link"
+        link.symlink_to(os.path.dirname(socket_path))
+        assert connect(str(link / "d.sock")) is None
+
+    def test_listen_insecure_folder(self, tmp_path):
+        folder = tmp_path / "shared"
+        folder.mkdir(mode=0o755)
+        os.chmod(folder, 0o755)
+        daemon = AgentDaemon(socket_path=str(folder / "d.sock"), cli_dir=str(tmp_path), warm_modules=(), warm_resources=False)
+        with pytest.raises(Exception, match="not safe"):
+            daemon.listen()
+        assert daemon.sock is None
+
+    def test_socket_path(self, monkeypatch):
+        monkeypatch.delenv("AGENT_DAEMON_SOCKET", raising=False)
+        monkeypatch.setenv("XDG_RUNTIME_DIR", "/run/user/1000")
+        assert get_socket_path() == "/run/user/1000/topsailai/agent_daemon.sock"
+        monkeypatch.delenv("XDG_RUNTIME_DIR")
+        assert get_socket_path() == f"/tmp/topsailai-{os.getuid()}/agent_daemon.sock"
+        monkeypatch.setenv("AGENT_DAEMON_SOCKET", "/tmp/x.sock")
+        assert get_socket_path() == "/tmp/x.sock"
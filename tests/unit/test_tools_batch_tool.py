@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+  Unit tests for tools batch_tool
+'''
+
+import pytest
+import sys
+import os
+import time
+import threading
+workspace_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if workspace_root not in sys.path:
+    sys.path.insert(0, workspace_root)
+    sys.path.insert(0, workspace_root + "/src")
+from topsailai import tools as tools_mod
+from topsailai.tools.batch_tool import multi_call, MAX_CALL_COUNT
+from topsailai.utils.thread_local_tool import ctxm_set_agent, get_agent_object
+from topsailai.utils.thread_tool import run_with_barriers
+
+
+class FakeAgent(object):
+    def __init__(self, available_tools):
+        self.available_tools = available_tools
+
+
+class SlowRead(object):
+    def __init__(self, seconds=0.2):
+        self.seconds = seconds
+        self.current = 0
+        self.max_current = 0
+        self.rlock = threading.Lock()
+        self.agents = []
+
+    def __call__(self, name=""):
+        with self.rlock:
+            self.current += 1
+            self.max_current = max(self.max_current, self.current)
+            self.agents.append(get_agent_object())
+        time.sleep(self.seconds)
+        with self.rlock:
+            self.current -= 1
+        if name == "bad":
+            raise ValueError("bad file")
+        return f"content of {name}"
+
+
+@pytest.fixture
+def slow_read(monkeypatch):
+    monkeypatch.setitem(tools_mod.TOOLS_META, "t.read", {"parallel": True})
+    return SlowRead()
+
+
+class TestMultiCall:
+    def test_parallel(self, slow_read):
+        agent = FakeAgent({"t.read": slow_read})
+        calls = [{"tool_call": "t.read", "tool_args": {"name": f"f{i}"}} for i in range(3)]
+        with ctxm_set_agent(agent):
+            result = multi_call(calls)
+        assert result == {f"[{i}] t.read": f"content of f{i}" for i in range(3)}
+        assert slow_read.max_current == 3
+        # the agent is carried into the worker threads
+        assert slow_read.agents == [agent] * 3
+
+    def test_errors(self, slow_read):
+        agent = FakeAgent({"t.read": slow_read})
+        calls = [
+            {"tool_call": "t.read", "tool_args": '{"name": "bad"}'},
+            {"tool_call": "t.none"},
+            {"tool_call": "batch_tool.multi_call", "tool_args": {"calls": []}},
+        ]
+        with ctxm_set_agent(agent):
+            result = multi_call(calls)
+        assert list(result.values()) == [
+            "error: bad file",
+            "no found such as tool: t.none",
+            "multi_call cannot be nested",
+        ]
+
+    def test_illegal(self):
+        assert "illegal" in multi_call("not a json")
+        assert "too many" in multi_call([{"tool_call": "x"}] * (MAX_CALL_COUNT + 1))
+
+    def test_internal_tools(self):
+        result = multi_call('[{"tool_call": "time_tool.get_local_time"}]')
+        assert isinstance(result["[0] time_tool.get_local_time"], int)
+
+
+class TestRunWithBarriers:
+    def test_order(self):
+        calls = []
+        lock = threading.Lock()
+
+        def _task(name, seconds=0.0):
+            def _run():
+                time.sleep(seconds)
+                with lock:
+                    calls.append(name)
+                return name
+            return _run
+
+        tasks = [
+            (_task("a", 0.1), True),
+            (_task("b"), True),
+            (_task("barrier"), False),
+            (_task("c"), True),
+        ]
+        assert run_with_barriers(tasks) == ["a", "b", "barrier", "c"]
+        assert calls[2:] == ["barrier", "c"]
+        assert set(calls[:2]) == {"a", "b"}
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+  Unit tests for tools job_tool
+'''
+
+import pytest
+import sys
+import os
+import time
+workspace_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if workspace_root not in sys.path:
+    sys.path.insert(0, workspace_root)
+    sys.path.insert(0, workspace_root + "/src")
+from topsailai.tools.job_tool import start_job, poll_job, cancel_job, list_jobs
+from topsailai.utils.job_tool import JobManager
+
+
+def wait_status(job_id, seconds=5):
+    end = time.time() + seconds
+    while time.time() < end:
+        info = poll_job(job_id)
+        if info["status"] != "running":
+            return info
+        time.sleep(0.05)
+    return info
+
+
+class TestJobTool:
+    def test_done(self):
+        job = start_job("echo hello; echo err >&2; exit 3")
+        assert job["status"] in ("running", "done")
+        info = wait_status(job["job_id"])
+        assert info["status"] == "done"
+        assert info["returncode"] == 3
+        assert info["output"] == "hello\nerr"
+        assert job["job_id"] in [j["job_id"] for j in list_jobs()]
+
+    def test_cancel(self):
+        job = start_job("sleep 30 | cat")
+        assert poll_job(job["job_id"])["status"] == "running"
+        info = cancel_job(job["job_id"])
+        assert info["status"] == "cancelled"
+        assert info["returncode"] is not None
+
+    def test_timeout(self):
+        job = start_job("echo begin; sleep 30", timeout=0.3)
+        info = wait_status(job["job_id"])
+        assert info["status"] == "timeout"
+        assert "begin" in info["output"]
+
+    def test_unknown(self):
+        assert "no found" in poll_job("job-x")
+        assert "no found" in cancel_job("job-x")
+
+
+class TestJobManager:
+    def test_max_count(self, tmp_path):
+        manager = JobManager(max_count=1, log_dir=str(tmp_path))
+        job = manager.start("sleep 30")
+        with pytest.raises(Exception):
+            manager.start("sleep 30")
+        manager.cancel_all()
+        assert job.status == "cancelled"
+        manager.start("true")
+        manager.cancel_all()